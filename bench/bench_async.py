@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Latency of concurrent requests over one session, ucs.post_many.
+
+Starts a stand-in UCSM adding --latency milliseconds to every request and
+resolves --requests dns, each in a request of its own, over one logged in
+session: first one after another through the handle, then through
+post_many at each --concurrency.  For every run it reports the wall time,
+requests per second and the per request latency (mean, p50, p95, max) from
+the spans ucs.Tracer records.
+
+    python bench/bench_async.py --requests 500 --latency 20 --https
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+from bench_transport import self_signed
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def latencies(tracer):
+    """milliseconds each request of tracer took"""
+
+    return [(span['end'] - span['start']) * 1000 for span in tracer.spans
+            if span['kind'] == "client" and span['end'] is not None]
+
+
+def measure(handle, requests, concurrency):
+    tracer = ucs.Tracer()
+    ucs.trace_handle(handle, tracer)
+    start = time.time()
+    if concurrency:
+        bodies = ucs.post_many(handle, requests, concurrency)
+    else:
+        bodies = [handle.post_xml(request) for request in requests]
+    elapsed = time.time() - start
+    assert len(bodies) == len(requests)
+
+    times = latencies(tracer)
+    return dict(seconds=round(elapsed, 3),
+                requests_per_s=round(len(requests) / elapsed, 1),
+                mean_ms=round(sum(times) / len(times), 1),
+                p50_ms=round(percentile(times, 0.5), 1),
+                p95_ms=round(percentile(times, 0.95), 1),
+                max_ms=round(max(times), 1))
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds added to every request")
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 10, 100])
+    parser.add_argument("--https", action="store_true")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        tls = self_signed(directory) if args.https else (None, None)
+        tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+        for index in range(args.requests):
+            tree.add("lsServer", "org-root/ls-sp{0}".format(index),
+                     name="sp{0}".format(index), assocState="associated")
+        server = mock_ucsm.start_server(tree=tree, certfile=tls[0],
+                                        keyfile=tls[1],
+                                        latency=args.latency / 1000.0)
+        try:
+            handle = ucs.open_handle(dict(
+                hostname="127.0.0.1", username="admin", password="password",
+                port=server.server_address[1], secure=args.https,
+                broker_socket=None, pool_size=4))
+            requests = [ucs.dns_request(handle, ["org-root/ls-sp{0}".format(
+                index)]) for index in range(args.requests)]
+            results = dict(sequential=measure(handle, requests, 0))
+            for concurrency in args.concurrency:
+                results["concurrency_{0}".format(concurrency)] = measure(
+                    handle, requests, concurrency)
+            handle.logout()
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(json.dumps(dict(requests=args.requests, latency_ms=args.latency,
+                          https=args.https, results=results),
+                     indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Task latency with and without the session broker.
+
+Each simulated task is a fresh python process, like an ansible task: it calls
+ucs.get_handle() and issues one query.  Run against the stand-in UCSM with a
+realistic login cost:
+
+    python bench/bench_broker.py --tasks 50 --login-latency 400 --latency 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY = os.path.join(os.path.dirname(HERE), "library")
+
+TASK = """
+import json, sys
+sys.path.insert(0, %r)
+from ucs import get_handle
+
+class Module(object):
+    def __init__(self, params):
+        self.params = params
+
+    def fail_json(self, **kwargs):
+        sys.stderr.write(json.dumps(kwargs))
+        sys.exit(1)
+
+handle = get_handle(Module(json.loads(sys.argv[1])))
+handle.query_dn("org-root")
+""" % LIBRARY
+
+
+def run_tasks(params, count):
+    """run count task processes one after another, returns latencies"""
+
+    latencies = []
+    for _ in range(count):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", TASK,
+                               json.dumps(params)])
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def summarize(name, latencies, sessions):
+    ordered = sorted(latencies)
+    return dict(scenario=name, tasks=len(ordered),
+                mean_ms=round(1000 * sum(ordered) / len(ordered), 1),
+                p50_ms=round(1000 * ordered[len(ordered) // 2], 1),
+                p95_ms=round(1000 * ordered[int(len(ordered) * 0.95) - 1], 1),
+                open_sessions=sessions)
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=10,
+                        help="milliseconds added to every request")
+    parser.add_argument("--login-latency", type=float, default=400,
+                        help="extra milliseconds added to aaaLogin")
+    args = parser.parse_args()
+
+    server = mock_ucsm.start_server(latency=args.latency / 1000.0,
+                                    login_latency=args.login_latency / 1000.0,
+                                    max_sessions=10000)
+    params = dict(hostname="127.0.0.1", username="admin",
+                  password="password", port=server.server_address[1],
+                  secure=False, broker_socket=None)
+
+    results = []
+    latencies = run_tasks(params, args.tasks)
+    results.append(summarize("direct login", latencies,
+                             len(server.ucsm.sessions)))
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+    broker = subprocess.Popen([sys.executable,
+                               os.path.join(LIBRARY, "ucs_broker.py"),
+                               "--socket", socket_path])
+    try:
+        while not os.path.exists(socket_path):
+            time.sleep(0.05)
+        before = len(server.ucsm.sessions)
+        params['broker_socket'] = socket_path
+        latencies = run_tasks(params, args.tasks)
+        results.append(summarize("session broker", latencies,
+                                 len(server.ucsm.sessions) - before))
+    finally:
+        broker.terminate()
+        broker.wait()
+        server.shutdown()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
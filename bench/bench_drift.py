@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Drift check time, per-object reads versus one streamed index.
+
+Seeds a stand-in UCSM with a growing number of lan connection policies and
+checks all of them once the way running every play in check mode does,
+each object read on its own (ucs_apply's plan_objects on the live handle,
+object cache off), and once the way ucs_drift does, streaming the classes
+into an index by dn first:
+
+    python bench/bench_drift.py --objects 100 1000 --latency 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+from ucs_apply import plan_objects
+from ucs_drift import drift
+
+
+def seeded_server(count, latency):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for number in range(count):
+        dn = "org-root/lan-conn-pol-lan{0}".format(number)
+        tree.add("vnicLanConnPolicy", dn, name="lan{0}".format(number),
+                 descr="")
+        tree.add("vnicEther", dn + "/ether-eth0", name="eth0", order="1",
+                 nwTemplName="t", adaptorProfileName="Windows")
+    return mock_ucsm.start_server(tree=tree, latency=latency)
+
+
+def desired(count):
+    return [dict(type="lan_conn", org_name="root",
+                 lan_con_name="lan{0}".format(number), lan_con_descr="",
+                 vnics=[dict(name="eth0", order=1, templ="t",
+                             policy="Windows")])
+            for number in range(count)]
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, nargs="+",
+                        default=[100, 1000])
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds added to every request")
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.objects:
+        server = seeded_server(count, args.latency / 1000.0)
+        params = dict(hostname="127.0.0.1", username="admin",
+                      password="password", port=server.server_address[1],
+                      secure=False, broker_socket=None, org_cache_ttl=0,
+                      mo_cache_ttl=0, check_mode=True,
+                      objects=desired(count))
+        try:
+            handle = ucs.open_handle(params)
+            server.ucsm.reset_stats()
+            start = time.time()
+            plan_objects(handle, params)
+            per_object = time.time() - start
+            per_object_calls = sum(method['calls'] for method in
+                                   server.ucsm.snapshot_stats()['methods']
+                                   .values())
+
+            server.ucsm.reset_stats()
+            start = time.time()
+            result = drift(handle, params)
+            indexed = time.time() - start
+            indexed_calls = sum(method['calls'] for method in
+                                server.ucsm.snapshot_stats()['methods']
+                                .values())
+            handle.logout()
+        finally:
+            del ucs.HANDLE_LIST[:]
+            server.shutdown()
+            server.server_close()
+        rows.append(dict(objects=count, per_object_s=round(per_object, 2),
+                         per_object_requests=per_object_calls,
+                         indexed_s=round(indexed, 2),
+                         indexed_requests=indexed_calls,
+                         drifted=result['drifted']))
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == '__main__':
+    main()
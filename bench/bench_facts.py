@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Inventory of many servers, per server queries versus ucs_facts.
+
+Seeds a stand-in UCSM with --servers blades spread over chassis of eight,
+each with two adapters, two cpus, 24 dimm slots (16 equipped) and its
+firmware, then gathers the same inventory twice:
+
+    per_server   query_classid for the blades, then a hierarchical
+                 query_dn of every blade, the way hand written scripts do
+    ucs_facts    one class query per class, read concurrently and joined
+                 by dn
+
+    python bench/bench_facts.py --servers 1200 --latency 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+import ucs_facts
+
+
+def seed(servers):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for index in range(servers):
+        chassis_id, slot_id = index // 8 + 1, index % 8 + 1
+        chassis = "sys/chassis-{0}".format(chassis_id)
+        if slot_id == 1:
+            tree.add("equipmentChassis", chassis, id=chassis_id,
+                     model="UCSB-5108-AC2", serial="FOX{0:05d}".format(
+                         chassis_id), operState="operable", power="ok")
+        blade = "{0}/blade-{1}".format(chassis, slot_id)
+        tree.add("computeBlade", blade, chassisId=chassis_id,
+                 slotId=slot_id, model="UCSB-B200-M5",
+                 serial="FLM{0:05d}".format(index), totalMemory=262144,
+                 numOfCpus=2, numOfCores=40, operState="ok", operPower="on",
+                 association="associated",
+                 assignedToDn="org-root/ls-sp{0}".format(index))
+        tree.add("firmwareRunning", blade + "/mgmt/fw-system",
+                 deployment="system", version="4.0(4e)")
+        tree.add("firmwareRunning", blade + "/bios/fw-boot-loader",
+                 deployment="boot-loader", version="B200M5.4.0.4e")
+        for adaptor in (1, 2):
+            adaptor_dn = "{0}/adaptor-{1}".format(blade, adaptor)
+            tree.add("adaptorUnit", adaptor_dn, id=adaptor,
+                     model="UCSB-MLOM-40G-04", serial="FCH{0:05d}{1}".format(
+                         index, adaptor), operState="operable")
+            tree.add("firmwareRunning", adaptor_dn + "/mgmt/fw-system",
+                     deployment="system", version="5.0(3c)")
+        for cpu in (1, 2):
+            tree.add("processorUnit", "{0}/board/cpu-{1}".format(blade, cpu),
+                     socketDesignation="CPU{0}".format(cpu), cores=20,
+                     model="Intel Xeon Gold 6148", speed="2.4",
+                     presence="equipped")
+        for dimm in range(1, 25):
+            tree.add("memoryUnit", "{0}/board/memarray-1/mem-{1}".format(
+                blade, dimm), capacity=16384 if dimm <= 16 else
+                     "unspecified",
+                     presence="equipped" if dimm <= 16 else "missing")
+    return tree
+
+
+def per_server(handle):
+    servers = []
+    for blade in handle.query_classid("ComputeBlade"):
+        parts = handle.query_dn(blade.dn, hierarchy=True)
+        servers.append((blade.dn, len(parts)))
+    return len(servers)
+
+
+def measure(server, gatherer):
+    del ucs.HANDLE_LIST[:]
+    handle = ucs.open_handle(dict(
+        hostname="127.0.0.1", username="admin", password="password",
+        port=server.server_address[1], secure=False, broker_socket=None,
+        pool_size=4))
+    server.ucsm.reset_stats()
+    start = time.time()
+    servers = gatherer(handle)
+    elapsed = time.time() - start
+    stats = server.ucsm.snapshot_stats()['methods']
+    handle.logout()
+    return dict(seconds=round(elapsed, 3), servers=servers,
+                requests=sum(entry['calls'] for method, entry in
+                             stats.items() if method != "aaaLogout"))
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds added to every request")
+    args = parser.parse_args()
+
+    server = mock_ucsm.start_server(tree=seed(args.servers),
+                                    latency=args.latency / 1000.0)
+    try:
+        results = dict(
+            per_server=measure(server, per_server),
+            ucs_facts=measure(server, lambda handle: len(ucs_facts.gather(
+                handle, ucs_facts.chosen_subsets(["all"]))['servers'])))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(json.dumps(dict(servers=args.servers, latency_ms=args.latency,
+                          results=results), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""Wall clock of one lan connection policy task across many UCS domains.
+
+Starts one stand-in UCSM per domain and runs ucs_lan_conn's vcon_present
+through ucs.run_on_domains, once one domain at a time and once with a
+thread pool, for a growing number of domains:
+
+    python bench/bench_fanout.py --domains 1 5 10 20 40 --workers 16
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+from ucs_lan_conn import vcon_present
+
+
+class Module(object):
+    """just enough of AnsibleModule for run_on_domains"""
+
+    def __init__(self, params):
+        self.params = params
+
+    def fail_json(self, **kwargs):
+        raise SystemExit(json.dumps(kwargs))
+
+
+def module_params(servers, workers):
+    params = dict((name, option.get('default')) for name, option in
+                  ucs.get_ucs_argument_spec().items())
+    params.update(username="admin", password="password", secure=False,
+                  broker_socket=None, org_cache_ttl=0, max_workers=workers,
+                  hostnames=["127.0.0.1:{0}".format(server.server_address[1])
+                             for server in servers],
+                  org_name="root", lan_con_name="exchange",
+                  lan_con_descr="exchange", state="present",
+                  vnics=[dict(name="nic{0}".format(i), order=i,
+                              templ="exchange_{0}".format(i),
+                              policy="Windows") for i in (1, 2)])
+    return params
+
+
+def run(servers, workers):
+    # every run logs in afresh, like a new ansible task would
+    del ucs.HANDLE_LIST[:]
+    start = time.time()
+    result = ucs.run_on_domains(Module(module_params(servers, workers)),
+                                vcon_present)
+    return time.time() - start, result
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--domains", type=int, nargs="+",
+                        default=[1, 5, 10, 20, 40])
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds added to every request")
+    parser.add_argument("--login-latency", type=float, default=300,
+                        help="extra milliseconds added to aaaLogin")
+    args = parser.parse_args()
+
+    rows = []
+    for count in args.domains:
+        servers = [mock_ucsm.start_server(
+            latency=args.latency / 1000.0,
+            login_latency=args.login_latency / 1000.0)
+                   for _ in range(count)]
+        try:
+            serial, _ = run(servers, 1)
+            parallel, result = run(servers, args.workers)
+        finally:
+            for server in servers:
+                server.shutdown()
+        rows.append(dict(domains=count, serial_s=round(serial, 2),
+                         parallel_s=round(parallel, 2),
+                         speedup=round(serial / parallel, 1),
+                         failed=bool(result.get('failed'))))
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == '__main__':
+    main()
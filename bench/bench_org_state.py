@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""Whole-org reconciliation, ucs_org_state versus the modules one by one.
+
+Seeds a stand-in UCSM with --orgs orgs, each using a vsan of its own on both
+fabrics and holding a leftover lan connection policy, then builds every org
+from a definition of one ip pool, --policies lan and san connection
+policies, eight fc ports of its vsan and --policies service profile
+templates naming them.  Once with the task functions of ucs_ip_pool,
+ucs_lan_conn, ucs_san_conn, ucs_vsan_assign and
+ucs_service_profile_template, one task per object, in dependency order, and
+once with ucs_org_state, one task per org, each on a stand-in of its own.
+ucs_org_state then runs again with nothing to change, and once more with
+prune and a policy and template dropped from every definition.  For every
+scenario it reports the tasks run, the round trips, the commits and the
+wall time.
+
+    python bench/bench_org_state.py --orgs 20 --policies 10 --latency 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+from ip_pool import ip_pool_present
+from ucs_apply import OBJECT_TYPES
+from ucs_lan_conn import vcon_present
+from ucs_org_state import SECTIONS, reconcile_org
+from ucs_san_conn import san_con_present
+from ucs_service_profile_template import sp_template_present
+from ucs_vsan_assign import assign_ports
+
+
+def seed(orgs):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for org in range(orgs):
+        org_dn = "org-root/org-t{0}".format(org)
+        tree.add("orgOrg", org_dn, name="t{0}".format(org), descr="")
+        tree.add("vnicLanConnPolicy", org_dn + "/lan-conn-pol-leftover",
+                 name="leftover", descr="")
+        for switch_id in ("A", "B"):
+            tree.add("fabricVsan", "fabric/san/{0}/net-v{1}".format(
+                switch_id, org + 100), name="v{0}".format(org + 100),
+                     id=org + 100, fcoeVlan=org + 3100, switchId=switch_id)
+    return tree
+
+
+def definition(org, policies):
+    """the ucs_org_state options of one org"""
+
+    base = "10.{0}.{1}".format(org // 256, org % 256)
+    vnics = [dict(name="eth0", order=1, templ="lan-a", policy="Linux"),
+             dict(name="eth1", order=2, templ="lan-b", policy="Linux")]
+    hbas = [dict(name="fc0", order=1, templ="san-a", policy="Linux"),
+            dict(name="fc1", order=2, templ="san-b", policy="Linux")]
+    return dict(
+        org_name="t{0}".format(org),
+        ip_pools=[dict(ip_pool_name="mgmt", ip_pool_descr="bench pool",
+                       ip_v4_pool_block=[dict(
+                           name="first", starting_address=base + ".10",
+                           number_of_ip=100, subnet_mask="255.255.255.0",
+                           default_route=base + ".1")])],
+        lan_conns=[dict(lan_con_name="lan{0}".format(index),
+                        lan_con_descr="bench policy", vnics=vnics)
+                   for index in range(policies)],
+        san_conns=[dict(san_con_name="san{0}".format(index),
+                        san_con_descr="bench policy",
+                        wwnn_pool="node-default", hbas=hbas)
+                   for index in range(policies)],
+        vsan_assigns=[dict(vsan_id="v{0}".format(org + 100),
+                           switch_id=["A", "B"], ports=["1/1-8"])],
+        sp_templates=[dict(service_profile_name="sp{0}".format(index),
+                           template_descr="bench template",
+                           management_ip="mgmt",
+                           lan_con_policy="lan{0}".format(index),
+                           san_con_policy="san{0}".format(index))
+                      for index in range(policies)])
+
+
+def module_tasks(state):
+    """the definition of an org as (task function, options), one per
+       object, in the order the modules have to run"""
+
+    funcs = dict(ip_pool=ip_pool_present, lan_conn=vcon_present,
+                 san_conn=san_con_present, vsan_assign=assign_ports,
+                 sp_template=sp_template_present)
+    tasks = []
+    for section, obj_type in SECTIONS:
+        defaults = OBJECT_TYPES[obj_type][4]
+        for entry in state[section]:
+            tasks.append((funcs[obj_type], dict(
+                defaults, org_name=state['org_name'], **entry)))
+    return tasks
+
+
+def run(server, tasks):
+    """run every (task function, options) over one session, returns what
+       the scenario cost"""
+
+    params = dict((name, option.get('default')) for name, option in
+                  ucs.get_ucs_argument_spec().items())
+    params.update(hostname="127.0.0.1", username="admin",
+                  password="password", port=server.server_address[1],
+                  secure=False, broker_socket=None, mo_cache_ttl=0)
+    handle = ucs.open_handle(params)
+    server.ucsm.reset_stats()
+    changed = 0
+    start = time.time()
+    for func, task in tasks:
+        result = func(handle, dict(params, **task))
+        if result.get('failed'):
+            raise SystemExit("{0}: {1}".format(func.__name__, result['msg']))
+        changed += bool(result.get('changed'))
+    elapsed = time.time() - start
+    methods = server.ucsm.snapshot_stats()['methods']
+    handle.logout()
+    del ucs.HANDLE_LIST[:]
+
+    return dict(tasks=len(tasks), changed=changed,
+                seconds=round(elapsed, 3),
+                requests=sum(entry['calls'] for method, entry in
+                             methods.items() if method != "aaaLogout"),
+                commits=methods.get('configConfMos', {}).get('calls', 0))
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orgs", type=int, default=20)
+    parser.add_argument("--policies", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=5,
+                        help="milliseconds added to every request")
+    args = parser.parse_args()
+
+    states = [definition(org, args.policies) for org in range(args.orgs)]
+    pruned = [dict(state, prune=True, lan_conns=state['lan_conns'][1:],
+                   sp_templates=state['sp_templates'][1:])
+              for state in states]
+
+    ucs.ORG_CACHE_DIR = tempfile.mkdtemp()
+    servers = [mock_ucsm.start_server(tree=seed(args.orgs),
+                                      latency=args.latency / 1000.0)
+               for _ in range(2)]
+    try:
+        results = dict(
+            modules=run(servers[0], [task for state in states
+                                     for task in module_tasks(state)]),
+            org_state=run(servers[1], [(reconcile_org, state)
+                                       for state in states]),
+            org_state_converged=run(servers[1], [(reconcile_org, state)
+                                                 for state in states]),
+            org_state_prune=run(servers[1], [(reconcile_org, state)
+                                             for state in pruned]))
+        left = [dn for dn in servers[1].ucsm.tree.of_class(
+            "vnicLanConnPolicy") if dn.endswith("-leftover")]
+        if left:
+            raise SystemExit("prune left {0}".format(", ".join(left)))
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(ucs.ORG_CACHE_DIR)
+
+    print(json.dumps(dict(orgs=args.orgs, policies=args.policies,
+                          latency_ms=args.latency, results=results),
+                     indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+"""Pool usage of large pools, interval arithmetic versus address sets.
+
+Seeds a stand-in UCSM with one mac, wwpn, uuid and ip pool per org for
+--orgs orgs, each mac pool holding --block-size addresses in four
+overlapping blocks and --assigned of them handed out, then times
+ucs_pool_usage end to end and its counting step against the obvious
+alternative of expanding every block into a set of addresses.
+
+    python bench/bench_pool_usage.py --orgs 4 --block-size 250000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+import ucs_pool_usage
+
+
+def mac(value):
+    text = "{0:012X}".format(value)
+    return ":".join(text[index:index + 2] for index in range(0, 12, 2))
+
+
+def ip(value):
+    return ".".join(str(value >> shift & 255) for shift in (24, 16, 8, 0))
+
+
+def seed(orgs, block_size, assigned):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    quarter = block_size // 4
+    for org in range(orgs):
+        org_dn = "org-root/org-t{0}".format(org)
+        tree.add("orgOrg", org_dn, name="t{0}".format(org))
+        base = 0x0025B5000000 + org * 0x100000000
+
+        pool = org_dn + "/mac-pool-macs"
+        tree.add("macpoolPool", pool, name="macs")
+        for block in range(4):
+            # each block overlaps the next by a tenth of a quarter
+            first = base + block * quarter
+            last = first + quarter + quarter // 10 - 1
+            tree.add("macpoolBlock", "{0}/block-{1}-{2}".format(
+                pool, mac(first), mac(last)), **{"from": mac(first),
+                                                 "to": mac(last)})
+        for index in range(assigned):
+            tree.add("macpoolPooled", "{0}/mac-{1}".format(
+                pool, mac(base + index * 3)), id=mac(base + index * 3),
+                     assigned="yes")
+
+        pool = org_dn + "/wwn-pool-wwpns"
+        tree.add("fcpoolInitiators", pool, name="wwpns",
+                 purpose="port-wwn-assignment")
+        first, last = "20:00:00:25:B5:{0:02X}:00:00".format(org), \
+            "20:00:00:25:B5:{0:02X}:FF:FF".format(org)
+        tree.add("fcpoolBlock", "{0}/block-{1}-{2}".format(pool, first, last),
+                 **{"from": first, "to": last})
+
+        pool = org_dn + "/uuid-pool-uuids"
+        tree.add("uuidpoolPool", pool, name="uuids")
+        tree.add("uuidpoolBlock", pool + "/block-from-0000-000000000001-to-"
+                 "0000-000000001000", **{"from": "0000-000000000001",
+                                         "to": "0000-000000001000"})
+
+        pool = org_dn + "/ip-pool-mgmt"
+        tree.add("ippoolPool", pool, name="mgmt")
+        first, last = ip(0x0A000000 + org * 65536), \
+            ip(0x0A000000 + org * 65536 + 4095)
+        tree.add("ippoolBlock", "{0}/block-{1}-{2}".format(pool, first, last),
+                 **{"from": first, "to": last})
+    return tree
+
+
+def count_with_sets(pools):
+    """used counts from every block expanded into addresses"""
+
+    used = {}
+    for dn, pool in pools.items():
+        addresses = set()
+        for first, last in pool['blocks']:
+            addresses.update(range(first, last + 1))
+        used[dn] = len(addresses & set(pool['addresses']))
+    return used
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orgs", type=int, default=4)
+    parser.add_argument("--block-size", type=int, default=250000)
+    parser.add_argument("--assigned", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="milliseconds added to every request")
+    args = parser.parse_args()
+
+    server = mock_ucsm.start_server(
+        tree=seed(args.orgs, args.block_size, args.assigned),
+        latency=args.latency / 1000.0)
+    try:
+        handle = ucs.open_handle(dict(
+            hostname="127.0.0.1", username="admin", password="password",
+            port=server.server_address[1], secure=False, broker_socket=None,
+            pool_size=4))
+        server.ucsm.reset_stats()
+        start = time.time()
+        result = ucs_pool_usage.usage(handle, dict(
+            kinds=None, pools=None, profiles=200,
+            per_profile=dict(macs=2, wwpns=2)))
+        module_seconds = time.time() - start
+        requests = sum(entry['calls'] for entry in
+                       server.ucsm.snapshot_stats()['methods'].values())
+        pools = ucs_pool_usage.read_pools(handle, sorted(
+            ucs_pool_usage.KINDS))
+        handle.logout()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    start = time.time()
+    intervals = dict((dn, ucs_pool_usage.pool_usage(pool)['used'])
+                     for dn, pool in pools.items())
+    interval_seconds = time.time() - start
+    start = time.time()
+    sets = count_with_sets(pools)
+    set_seconds = time.time() - start
+    assert intervals == sets
+
+    print(json.dumps(dict(
+        orgs=args.orgs, block_size=args.block_size, assigned=args.assigned,
+        latency_ms=args.latency,
+        addresses=sum(pool['size'] for pool in result['pools']),
+        module=dict(seconds=round(module_seconds, 3), requests=requests,
+                    fits=result['fits'], short=result['short']),
+        counting=dict(intervals_s=round(interval_seconds, 4),
+                      address_sets_s=round(set_seconds, 4))),
+        indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Rolling acknowledgement of pending reboots, waves versus all at once.
+
+Seeds a stand-in UCSM with --servers blades in chassis of eight, each with a
+service profile bound to one lan connection policy and a pending activity
+waiting for the user, half of the profiles on fabric A and half on B, and a
+reboot taking --reboot-seconds once acknowledged.  Then acknowledges them
+through ucs_rolling.roll_out, once as a single wave and once in waves of
+--wave-size with at most --max-per-chassis blades of a chassis together,
+reporting for each the waves, the most servers and the most blades of one
+chassis rebooting at once, the round trips and the wall time.
+
+    python bench/bench_rolling.py --servers 320 --wave-size 10%
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+import ucs_rolling
+
+POLICY_DN = "org-root/lan-conn-pol-exchange"
+
+
+def seed(servers):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    tree.add("vnicLanConnPolicy", POLICY_DN, name="exchange")
+    for index in range(servers):
+        blade = "sys/chassis-{0}/blade-{1}".format(index // 8 + 1,
+                                                   index % 8 + 1)
+        tree.add("computeBlade", blade, operState="ok",
+                 association="associated")
+        profile = "org-root/ls-sp{0}".format(index)
+        tree.add("lsServer", profile, name="sp{0}".format(index),
+                 type="instance", pnDn=blade, assocState="associated",
+                 configState="applied", operState="ok")
+        tree.add("vnicConnDef", profile + "/conn-def",
+                 lanConnPolicyName="exchange",
+                 operLanConnPolicyName=POLICY_DN)
+        tree.add("vnicEther", profile + "/ether-eth0", name="eth0",
+                 order=1, switchId="A" if index % 2 == 0 else "B")
+        tree.add("lsmaintAck", profile + "/ack",
+                 adminState="untriggered", operState="waiting-for-user")
+    return tree
+
+
+def measure(server, params):
+    del ucs.HANDLE_LIST[:]
+    handle = ucs.open_handle(dict(
+        params, hostname="127.0.0.1", username="admin",
+        password="password", port=server.server_address[1], secure=False,
+        broker_socket=None))
+    # every reboot of an earlier run has finished and taken its ack along
+    for dn in server.ucsm.tree.of_class("lsServer"):
+        server.ucsm.tree.add("lsmaintAck", dn + "/ack",
+                             adminState="untriggered",
+                             operState="waiting-for-user")
+    server.ucsm.reset_stats()
+
+    start = time.time()
+    report = ucs_rolling.roll_out(handle, params, POLICY_DN, "lan")
+    elapsed = time.time() - start
+    requests = sum(entry['calls'] for method, entry in
+                   server.ucsm.snapshot_stats()['methods'].items()
+                   if method != "aaaLogout")
+    handle.logout()
+
+    per_chassis = 0
+    for wave in report['waves']:
+        counts = {}
+        for blade in wave['servers']:
+            chassis = ucs_rolling.chassis_of(blade)
+            counts[chassis] = counts.get(chassis, 0) + 1
+        per_chassis = max([per_chassis] + list(counts.values()))
+    return dict(seconds=round(elapsed, 2), requests=requests,
+                waves=len(report['waves']),
+                failed=bool(report.get('failed')),
+                most_rebooting=max(len(wave['servers'])
+                                   for wave in report['waves']),
+                most_per_chassis=per_chassis,
+                fabrics=[wave['fabric'] for wave in report['waves']])
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", type=int, default=160)
+    parser.add_argument("--wave-size", default="10%")
+    parser.add_argument("--max-per-chassis", type=int, default=2)
+    parser.add_argument("--reboot-seconds", type=float, default=1)
+    parser.add_argument("--latency", type=float, default=5,
+                        help="milliseconds added to every request")
+    args = parser.parse_args()
+
+    params = dict((name, option.get('default')) for name, option in
+                  ucs.get_ucs_argument_spec(
+                      **ucs_rolling.ROLLING_SPEC).items())
+    params.update(rolling=True, wave_interval=args.reboot_seconds / 4.0,
+                  wave_timeout=60)
+
+    server = mock_ucsm.start_server(tree=seed(args.servers),
+                                    latency=args.latency / 1000.0,
+                                    reboot_seconds=args.reboot_seconds)
+    try:
+        results = dict(
+            all_at_once=measure(server, dict(
+                params, wave_size="100%", max_per_chassis=0,
+                fabric_order=[])),
+            waves=measure(server, dict(
+                params, wave_size=args.wave_size,
+                max_per_chassis=args.max_per_chassis)))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(json.dumps(dict(servers=args.servers, wave_size=args.wave_size,
+                          max_per_chassis=args.max_per_chassis,
+                          reboot_seconds=args.reboot_seconds,
+                          latency_ms=args.latency, results=results),
+                     indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
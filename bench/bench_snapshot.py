@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Peak memory of exporting one class, streamed versus query_classid.
+
+Seeds a stand-in UCSM with a growing number of service profiles and reads
+them back in a fresh process, once through ucs.stream_class writing each to
+a json lines file as ucs_snapshot does, and once through
+handle.query_classid, which holds the whole response and every managed
+object at the same time.  Reports how far the client's peak resident size
+grew during the read:
+
+    python bench/bench_snapshot.py --objects 1000 10000 30000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+
+def seeded_server(count):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for number in range(count):
+        tree.add("lsServer", "org-root/ls-sp{0}".format(number),
+                 name="sp{0}".format(number), type="instance",
+                 descr="profile {0}".format(number),
+                 bootPolicyName="default", hostFwPolicyName="default")
+    return mock_ucsm.start_server(tree=tree)
+
+
+def client(port, how):
+    """one export in this process, prints seconds and how far the peak
+       resident size grew past what logging in took"""
+
+    import ucs
+    from ucs_snapshot import record
+
+    handle = ucs.open_handle(dict(
+        hostname="127.0.0.1", username="admin", password="password",
+        port=port, secure=False, broker_socket=None))
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    with tempfile.TemporaryFile(mode="w") as out_file:
+        if how == "stream":
+            for _, attrs in ucs.stream_class(handle, "lsServer"):
+                out_file.write(record(attrs))
+        else:
+            for mo in handle.query_classid("lsServer"):
+                out_file.write(mo.dn + "\n")
+    elapsed = time.time() - start
+    grown = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    handle.logout()
+    print(json.dumps(dict(seconds=round(elapsed, 2), peak_kb=grown)))
+
+
+def run_client(port, how):
+    output = subprocess.check_output([sys.executable, __file__, "--client",
+                                      how, "--port", str(port)])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--objects", type=int, nargs="+",
+                        default=[1000, 10000])
+    parser.add_argument("--client", choices=["stream", "query"],
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        client(args.port, args.client)
+        return
+
+    rows = []
+    for count in args.objects:
+        server = seeded_server(count)
+        try:
+            port = server.server_address[1]
+            streamed = run_client(port, "stream")
+            queried = run_client(port, "query")
+        finally:
+            server.shutdown()
+            server.server_close()
+        rows.append(dict(objects=count, stream_s=streamed['seconds'],
+                         stream_peak_kb=streamed['peak_kb'],
+                         query_s=queried['seconds'],
+                         query_peak_kb=queried['peak_kb']))
+
+    print(json.dumps(rows, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Cold start time and import count of every module.
+
+Each module is run the way ansible runs it, in a fresh interpreter with an
+args file, but with arguments that fail validation: that is the path which
+should never pay for loading ucsmsdk.  --eager imports ucsmsdk and the
+module's classes up front first, which is what every task paid before the
+imports were made lazy.
+
+    python bench/bench_startup.py --runs 10 --eager
+
+Exits non zero when a module goes over either budget.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LIBRARY = os.path.join(os.path.dirname(HERE), "library")
+
+RUNNER = """
+import atexit, json, runpy, sys
+sys.path.insert(0, %r)
+module_path, args_path, eager = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+
+def report():
+    sys.stderr.write("\\nSTARTUP " + json.dumps(dict(
+        imports=len(sys.modules),
+        ucsmsdk=any(name.startswith("ucsmsdk") for name in sys.modules))))
+
+atexit.register(report)
+if eager:
+    import ucsmsdk.ucshandle, ucsmsdk.ucscoreutils
+    import ucs
+    for name, value in list(vars(runpy.run_path(module_path)).items()):
+        if isinstance(value, ucs.LazyMo):
+            value._load()
+sys.argv = [module_path, args_path]
+runpy.run_path(module_path, run_name="__main__")
+""" % LIBRARY
+
+
+def modules():
+    """every ansible module in library/"""
+
+    return sorted(path for path in glob.glob(os.path.join(LIBRARY, "*.py"))
+                  if os.path.basename(path) not in ("ucs.py",
+                                                    "ucs_broker.py"))
+
+
+def run_once(module_path, args_path, eager):
+    """one cold start, returns (seconds, report)"""
+
+    start = time.time()
+    process = subprocess.Popen([sys.executable, "-c", RUNNER, module_path,
+                                args_path, "1" if eager else "0"],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+    elapsed = time.time() - start
+    for line in err.decode("utf-8", "replace").splitlines():
+        if line.startswith("STARTUP "):
+            return elapsed, json.loads(line[len("STARTUP "):])
+    raise RuntimeError("{0} did not report: {1}".format(module_path, err))
+
+
+def measure(module_path, args_path, runs, eager):
+    times = []
+    report = None
+    for _ in range(runs):
+        elapsed, report = run_once(module_path, args_path, eager)
+        times.append(elapsed)
+    times.sort()
+    return dict(p50_ms=round(1000 * times[len(times) // 2], 1),
+                min_ms=round(1000 * times[0], 1), **report)
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=300,
+                        help="median cold start allowed per module")
+    parser.add_argument("--budget-imports", type=int, default=250,
+                        help="modules loaded allowed per module")
+    parser.add_argument("--eager", action="store_true",
+                        help="also measure with ucsmsdk imported up front")
+    args = parser.parse_args()
+
+    fd, args_path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as args_file:
+        # an unsupported option fails validation even for modules that
+        # require none
+        json.dump(dict(ANSIBLE_MODULE_ARGS=dict(bench_startup=True)),
+                  args_file)
+
+    results = []
+    over = []
+    try:
+        for module_path in modules():
+            name = os.path.basename(module_path)[:-len(".py")]
+            result = dict(module=name, lazy=measure(module_path, args_path,
+                                                    args.runs, False))
+            if args.eager:
+                result['eager'] = measure(module_path, args_path, args.runs,
+                                          True)
+            if result['lazy']['p50_ms'] > args.budget_ms or \
+                    result['lazy']['imports'] > args.budget_imports or \
+                    result['lazy']['ucsmsdk']:
+                over.append(name)
+            results.append(result)
+    finally:
+        os.unlink(args_path)
+
+    print(json.dumps(dict(budget_ms=args.budget_ms,
+                          budget_imports=args.budget_imports,
+                          results=results, over_budget=over), indent=2))
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
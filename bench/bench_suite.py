@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+"""Module suite at scale against a stand-in UCSM, with a regression baseline.
+
+Seeds a stand-in UCSM with --orgs orgs and --vsans vsans on both fabrics,
+then runs the task functions of ucs_lan_conn, ucs_san_conn, ucs_vsan_assign
+and ucs_ip_pool over them, one logged in session per scenario:
+
+    lan_conn_create      --policies lan connection policies, two vnics each,
+                         spread over the orgs
+    lan_conn_converged   the same tasks again, nothing to change
+    lan_conn_update      every policy with one vnic changed and one added
+    lan_conn_absent      every policy removed
+    san_conn_create      --policies san connection policies, two vhbas each
+    san_conn_converged   the same tasks again
+    vsan_assign          eight fc ports on both fabrics of every vsan
+    vsan_converged       the same tasks again
+    ip_pool_create       an ip pool with two blocks in each of the first
+                         --pools orgs
+    ip_pool_converged    the same tasks again
+
+Every ip_pool task reads every ip block of the domain to check for
+overlaps, so those two scenarios grow with the square of --pools.
+
+For every scenario it records the tasks run, the round trips and bytes the
+stand-in saw and the wall time.  --save-baseline writes them to a file and
+--baseline compares a run against one, exiting 1 when a scenario needs more
+round trips, more than --bytes-tolerance more bytes or more than
+--tolerance more time than the baseline.
+
+    python bench/bench_suite.py --orgs 200 --policies 2000 --latency 2
+    python bench/bench_suite.py --save-baseline bench/baseline.json
+    python bench/bench_suite.py --baseline bench/baseline.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+from ip_pool import ip_pool_present
+from ucs_lan_conn import vcon_absent, vcon_present
+from ucs_san_conn import san_con_present
+from ucs_vsan_assign import assign_ports
+
+
+def seed(orgs, vsans):
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for org in range(orgs):
+        tree.add("orgOrg", "org-root/org-t{0}".format(org),
+                 name="t{0}".format(org), descr="")
+    for vsan in range(vsans):
+        for switch_id in ("A", "B"):
+            tree.add("fabricVsan", "fabric/san/{0}/net-v{1}".format(
+                switch_id, vsan + 100), name="v{0}".format(vsan + 100),
+                     id=vsan + 100, fcoeVlan=vsan + 3100,
+                     switchId=switch_id)
+    return tree
+
+
+def org_name(index, orgs):
+    return "t{0}".format(index % orgs)
+
+
+def lan_conn(index, orgs, update=False):
+    vnics = [dict(name="eth0", order=1, templ="lan-a", policy="Linux"),
+             dict(name="eth1", order=2, templ="lan-b", policy="Linux")]
+    if update:
+        vnics[1]['templ'] = "lan-b2"
+        vnics.append(dict(name="eth2", order=3, templ="lan-c",
+                          policy="Linux"))
+    return dict(org_name=org_name(index, orgs),
+                lan_con_name="lan{0}".format(index),
+                lan_con_descr="bench policy {0}".format(index), vnics=vnics)
+
+
+def san_conn(index, orgs):
+    return dict(org_name=org_name(index, orgs),
+                san_con_name="san{0}".format(index),
+                san_con_descr="bench policy {0}".format(index),
+                wwnn_pool="node-default",
+                hbas=[dict(name="fc0", order=1, templ="san-a",
+                           policy="Linux"),
+                      dict(name="fc1", order=2, templ="san-b",
+                           policy="Linux")])
+
+
+def vsan_assign(index):
+    return dict(vsan_id="v{0}".format(index + 100), switch_id=["A", "B"],
+                ports=["1/{0}-{1}".format(index % 24 + 1, index % 24 + 8)],
+                exclusive=False)
+
+
+def ip_pool(index):
+    base = "10.{0}.{1}".format(index // 256, index % 256)
+    return dict(org_name="t{0}".format(index),
+                ip_pool_name="mgmt", ip_pool_descr="bench pool",
+                ip_v4_pool_block=[
+                    dict(name="first", starting_address=base + ".10",
+                         number_of_ip=100, subnet_mask="255.255.255.0",
+                         default_route=base + ".1"),
+                    dict(name="second", starting_address=base + ".150",
+                         number_of_ip=50, subnet_mask="255.255.255.0",
+                         default_route=base + ".1")])
+
+
+def scenarios(args):
+    """(name, task function, list of task options) in the order they run"""
+
+    lan = [lan_conn(index, args.orgs) for index in range(args.policies)]
+    san = [san_conn(index, args.orgs) for index in range(args.policies)]
+    vsans = [vsan_assign(index) for index in range(args.vsans)]
+    pools = [ip_pool(index) for index in range(min(args.pools, args.orgs))]
+    return [
+        ("lan_conn_create", vcon_present, lan),
+        ("lan_conn_converged", vcon_present, lan),
+        ("lan_conn_update", vcon_present,
+         [lan_conn(index, args.orgs, update=True)
+          for index in range(args.policies)]),
+        ("lan_conn_absent", vcon_absent, lan),
+        ("san_conn_create", san_con_present, san),
+        ("san_conn_converged", san_con_present, san),
+        ("vsan_assign", assign_ports, vsans),
+        ("vsan_converged", assign_ports, vsans),
+        ("ip_pool_create", ip_pool_present, pools),
+        ("ip_pool_converged", ip_pool_present, pools),
+    ]
+
+
+def run(server, func, tasks):
+    """run every task over one session, returns what the scenario cost"""
+
+    params = dict((name, option.get('default')) for name, option in
+                  ucs.get_ucs_argument_spec().items())
+    params.update(hostname="127.0.0.1", username="admin",
+                  password="password", port=server.server_address[1],
+                  secure=False, broker_socket=None, mo_cache_ttl=0)
+    handle = ucs.open_handle(params)
+    server.ucsm.reset_stats()
+    changed = 0
+    start = time.time()
+    for task in tasks:
+        result = func(handle, dict(params, **task))
+        if result.get('failed'):
+            raise SystemExit("{0}: {1}".format(func.__name__, result['msg']))
+        changed += bool(result.get('changed'))
+    elapsed = time.time() - start
+    methods = server.ucsm.snapshot_stats()['methods']
+    handle.logout()
+    del ucs.HANDLE_LIST[:]
+
+    return dict(tasks=len(tasks), changed=changed,
+                seconds=round(elapsed, 3),
+                requests=sum(entry['calls'] for entry in methods.values()),
+                bytes=sum(entry['bytes_in'] + entry['bytes_out']
+                          for entry in methods.values()),
+                methods=dict((method, entry['calls'])
+                             for method, entry in methods.items()))
+
+
+def regressions(results, baseline, tolerance, bytes_tolerance):
+    """what got worse than the baseline, one line per regression"""
+
+    found = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None or before['tasks'] != result['tasks']:
+            continue
+        if result['requests'] > before['requests']:
+            found.append("{0}: {1} requests, baseline {2}".format(
+                name, result['requests'], before['requests']))
+        if result['bytes'] > before['bytes'] * (1 + bytes_tolerance):
+            found.append("{0}: {1} bytes, baseline {2}".format(
+                name, result['bytes'], before['bytes']))
+        if result['seconds'] > before['seconds'] * (1 + tolerance):
+            found.append("{0}: {1}s, baseline {2}s".format(
+                name, result['seconds'], before['seconds']))
+    return found
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orgs", type=int, default=200)
+    parser.add_argument("--policies", type=int, default=1000)
+    parser.add_argument("--vsans", type=int, default=50)
+    parser.add_argument("--pools", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every request")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--baseline", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="fraction the wall time may exceed the "
+                             "baseline by")
+    parser.add_argument("--bytes-tolerance", type=float, default=0.05,
+                        help="fraction the bytes may exceed the baseline by")
+    args = parser.parse_args()
+
+    # the org index is built once, by the first scenario, as in a play
+    ucs.ORG_CACHE_DIR = tempfile.mkdtemp()
+    server = mock_ucsm.start_server(tree=seed(args.orgs, args.vsans),
+                                    latency=args.latency / 1000.0)
+    results = {}
+    try:
+        for name, func, tasks in scenarios(args):
+            results[name] = run(server, func, tasks)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(ucs.ORG_CACHE_DIR)
+
+    report = dict(orgs=args.orgs, policies=args.policies, vsans=args.vsans,
+                  pools=args.pools, latency_ms=args.latency,
+                  scenarios=results)
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('latency_ms') != args.latency:
+            sys.stderr.write("baseline was run with --latency {0}, timings "
+                             "are not comparable\n".format(
+                                 baseline.get('latency_ms')))
+        found = regressions(results, baseline['scenarios'], args.tolerance,
+                            args.bytes_tolerance)
+        for line in found:
+            sys.stderr.write("regression: {0}\n".format(line))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""Requests per second over https, ucsmsdk's transport versus PooledDriver.
+
+Starts a stand-in UCSM serving https with a throwaway self signed
+certificate (made with the openssl command unless --certfile is given) and
+sends the same configResolveDn through one handle per transport:
+
+    default      ucsmsdk's UcsDriver, a new connection and handshake each
+    pooled       keep-alive connections reused from the pool
+    resumed      a new connection each, resuming the tls session
+    handshake    a new connection each, full handshake every time
+
+    python bench/bench_transport.py --requests 500 --latency 1
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_ucsm
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "library"))
+
+import ucs
+
+TRANSPORTS = [
+    ("default", dict(pool_size=0)),
+    ("pooled", dict(pool_size=4, keep_alive=True, tls_resume=True)),
+    ("resumed", dict(pool_size=4, keep_alive=False, tls_resume=True)),
+    ("handshake", dict(pool_size=4, keep_alive=False, tls_resume=False)),
+]
+
+
+def self_signed(directory):
+    """a throwaway certificate and key, returns their paths"""
+
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048",
+                           "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                           "-keyout", keyfile, "-out", certfile],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return certfile, keyfile
+
+
+def measure(server, requests, options):
+    del ucs.HANDLE_LIST[:]
+    params = dict(hostname="127.0.0.1", username="admin",
+                  password="password", port=server.server_address[1],
+                  secure=True, broker_socket=None, **options)
+    handle = ucs.open_handle(params)
+    server.ucsm.reset_stats()
+    start = time.time()
+    for _ in range(requests):
+        handle.query_dn("org-root")
+    elapsed = time.time() - start
+    connections = server.ucsm.snapshot_stats()['connections']
+    handle.logout()
+    driver = handle._UcsSession__driver
+    return dict(requests_per_s=round(requests / elapsed, 1),
+                connections=connections,
+                tls_resumed=getattr(driver, "tls_resumed", None))
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every request")
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        certfile, keyfile = args.certfile, args.keyfile
+        if not certfile:
+            certfile, keyfile = self_signed(directory)
+        server = mock_ucsm.start_server(certfile=certfile, keyfile=keyfile,
+                                        latency=args.latency / 1000.0)
+        try:
+            results = dict((name, measure(server, args.requests, options))
+                           for name, options in TRANSPORTS)
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(json.dumps(dict(requests=args.requests, latency_ms=args.latency,
+                          results=results), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,704 @@
+#!/usr/bin/env python
+"""Stand-in UCS Manager XML API server for benchmarks.
+
+Speaks just enough of the UCSM XML API (POST /nuova) for ucsmsdk to log in
+and run the queries and commits the modules issue, against an in-memory tree
+of managed objects.  Latency can be injected per request and per login so the effect of
+saving round trips is visible on a laptop.
+
+    python bench/mock_ucsm.py --port 8080 --latency 20 --login-latency 400
+
+GET /stats returns the per-method request counts, connections and session
+numbers as json.  --certfile serves https instead of http.  With --state
+the tree is loaded from that file and every change saved back to it (json
+lines, at most every --save-interval seconds and on exit), so it outlives
+the server.
+An eventSubscribe request is answered with a stream of configMoChangeEvent
+messages for every object configConfMos changes, framed the way UCSM does.
+"""
+
+import argparse
+import json
+import os
+import re
+import ssl
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def _camel(name):
+    return name[0].lower() + name[1:]
+
+
+class MoTree(object):
+    """managed objects keyed by dn, with a parent -> children and a class
+       index.  changes counts every add and remove, so a saver can tell
+       whether there is anything new to write."""
+
+    def __init__(self):
+        self.mos = {}
+        self.children = {}
+        self.classes = {}
+        self.changes = 0
+        self.lock = threading.RLock()
+
+    def add(self, class_id, dn, **attrs):
+        """add or replace one managed object"""
+
+        class_id = _camel(class_id)
+        with self.lock:
+            attrs = dict((k, str(v)) for k, v in attrs.items())
+            attrs['dn'] = dn
+            attrs.setdefault('rn', dn.rsplit('/', 1)[-1])
+            current = self.mos.get(dn)
+            if current is not None and current[0] != class_id:
+                self.classes[current[0]].discard(dn)
+            self.mos[dn] = (class_id, attrs)
+            self.classes.setdefault(class_id, set()).add(dn)
+            parent = dn.rsplit('/', 1)[0] if '/' in dn else ""
+            self.children.setdefault(parent, set()).add(dn)
+            self.changes += 1
+
+    def remove(self, dn):
+        """remove a managed object and everything below it"""
+
+        with self.lock:
+            for child in list(self.children.get(dn, ())):
+                self.remove(child)
+            self.children.pop(dn, None)
+            removed = self.mos.pop(dn, None)
+            if removed is not None:
+                self.classes[removed[0]].discard(dn)
+                parent = dn.rsplit('/', 1)[0] if '/' in dn else ""
+                self.children.get(parent, set()).discard(dn)
+                self.changes += 1
+
+    def get(self, dn):
+        return self.mos.get(dn)
+
+    def child_dns(self, dn):
+        return sorted(self.children.get(dn, ()))
+
+    def of_class(self, class_id):
+        with self.lock:
+            return list(self.classes.get(_camel(class_id), ()))
+
+    def save(self, path):
+        """write every object to path as json lines of [class, attrs],
+           through a temporary file so a crash never leaves half a tree"""
+
+        with self.lock:
+            lines = [json.dumps([class_id, attrs], sort_keys=True) + "\n"
+                     for dn, (class_id, attrs) in sorted(self.mos.items())]
+            changes = self.changes
+        with open(path + ".tmp", "w") as state_file:
+            state_file.writelines(lines)
+        os.rename(path + ".tmp", path)
+        return changes
+
+    def load(self, path):
+        """add every object save wrote to path"""
+
+        with open(path) as state_file:
+            for line in state_file:
+                class_id, attrs = json.loads(line)
+                self.add(class_id, attrs.pop('dn'), **attrs)
+        return self
+
+    def element(self, dn, hierarchy=False):
+        """render dn (and optionally its subtree) as an xml element"""
+
+        class_id, attrs = self.mos[dn]
+        elem = ET.Element(class_id, attrs)
+        if hierarchy:
+            for child in self.child_dns(dn):
+                elem.append(self.element(child, True))
+        return elem
+
+
+def seed_tree(tree, name="mock-ucsm", address="127.0.0.1"):
+    """the objects ucsmsdk reads while logging in, plus the root org"""
+
+    tree.add("topSystem", "sys", name=name, address=address, mode="cluster")
+    tree.add("firmwareRunning", "sys/mgmt/fw-system", deployment="system",
+             version="4.0(4e)", type="system")
+    for switch_id in ("A", "B"):
+        tree.add("networkElement", "sys/switch-{0}".format(switch_id),
+                 id=switch_id, oobIfIp=address)
+    tree.add("orgOrg", "org-root", name="root", descr="")
+    return tree
+
+
+class FilterMatcher(object):
+    """evaluates a UCSM inFilter element against a managed object"""
+
+    def __init__(self, elem):
+        self.elem = elem
+
+    def __call__(self, attrs):
+        if self.elem is None:
+            return True
+        return self._match(self.elem, attrs)
+
+    def _match(self, elem, attrs):
+        tag = elem.tag
+        if tag == "and":
+            return all(self._match(child, attrs) for child in elem)
+        if tag == "or":
+            return any(self._match(child, attrs) for child in elem)
+        if tag == "not":
+            return not self._match(elem[0], attrs)
+
+        value = attrs.get(elem.attrib.get('property'), "")
+        wanted = elem.attrib.get('value', "")
+        if tag == "eq":
+            return value == wanted
+        if tag == "ne":
+            return value != wanted
+        if tag == "wcard":
+            return re.search(wanted, value) is not None
+        if tag in ("gt", "ge", "lt", "le"):
+            try:
+                value, wanted = float(value), float(wanted)
+            except ValueError:
+                pass
+            return dict(gt=value > wanted, ge=value >= wanted,
+                        lt=value < wanted, le=value <= wanted)[tag]
+        return True
+
+
+class MockUcsm(object):
+    """request dispatcher holding the tree, the sessions and the counters"""
+
+    def __init__(self, tree, username="admin", password="password",
+                 latency=0.0, login_latency=0.0, max_sessions=32,
+                 refresh_period=600, audit_size=1000, busy_commits=0,
+                 reboot_seconds=1.0):
+        self.tree = tree
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.login_latency = login_latency
+        self.max_sessions = max_sessions
+        self.refresh_period = refresh_period
+        self.sessions = {}
+        self.stats = {}
+        self.subscribers = []
+        self.event_id = 0
+        self.audit_size = audit_size
+        self.audit_id = 0
+        # configConfMos calls still to turn away as busy
+        self.busy_commits = busy_commits
+        # how long a server takes to reboot once its pending activity is
+        # acknowledged
+        self.reboot_seconds = reboot_seconds
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def count(self, method, request_bytes, response_bytes):
+        with self.lock:
+            entry = self.stats.setdefault(method, dict(calls=0, bytes_in=0,
+                                                       bytes_out=0))
+            entry['calls'] += 1
+            entry['bytes_in'] += request_bytes
+            entry['bytes_out'] += response_bytes
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(methods=json.loads(json.dumps(self.stats)),
+                        connections=self.connections,
+                        sessions=len(self.sessions),
+                        objects=len(self.tree.mos))
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+            self.connections = 0
+
+    def subscribe(self):
+        """a queue receiving every event from now on"""
+
+        events = queue.Queue()
+        with self.lock:
+            self.subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def publish(self, changes):
+        """queue one change event per changed object for every subscriber"""
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for class_id, dn, status in changes:
+            with self.lock:
+                self.event_id += 1
+                event_id = self.event_id
+            vessel = ET.Element("methodVessel")
+            stimuli = ET.SubElement(vessel, "inStimuli")
+            event = ET.SubElement(stimuli, "configMoChangeEvent",
+                                  inEid=str(event_id))
+            config = ET.SubElement(event, "inConfig")
+            mo = self.tree.get(dn)
+            attrs = dict(mo[1]) if mo else dict(dn=dn)
+            attrs['status'] = status
+            ET.SubElement(config, class_id, attrs)
+            body = ET.tostring(vessel)
+            for events in subscribers:
+                events.put(body)
+
+    def audit(self, changes):
+        """log one aaaModLR record per changed object, keeping the newest
+           audit_size the way the ucsm audit log does"""
+
+        for class_id, dn, status in changes:
+            with self.lock:
+                self.audit_id += 1
+                audit_id = self.audit_id
+            self.tree.add("aaaModLR", "aaa-log/{0}".format(audit_id),
+                          id=audit_id, affected=dn,
+                          ind=dict(created="creation",
+                                   modified="modification",
+                                   deleted="deletion")[status],
+                          created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                          user=self.username)
+            if audit_id > self.audit_size:
+                self.tree.remove("aaa-log/{0}".format(
+                    audit_id - self.audit_size))
+
+    def dispatch(self, body):
+        """handle one request body, returning the response body"""
+
+        request = ET.fromstring(body)
+        method = request.tag
+        if self.latency:
+            time.sleep(self.latency)
+
+        handler = getattr(self, "do_" + method, None)
+        if handler is None:
+            response = self._error(method, 101,
+                                   "Method {0} not supported".format(method))
+        elif not method.startswith("aaa") and \
+                request.attrib.get('cookie') not in self.sessions:
+            response = self._error(method, 552, "Authorization required")
+        else:
+            try:
+                response = handler(request)
+            except Exception as mock_exception:
+                response = self._error(method, 103, str(mock_exception))
+
+        response_body = ET.tostring(response)
+        self.count(method, len(body), len(response_body))
+        return response_body
+
+    def _response(self, method, request, **attrs):
+        elem = ET.Element(method, dict(cookie=request.attrib.get('cookie', ""),
+                                       response="yes"))
+        for key, value in attrs.items():
+            elem.set(key, str(value))
+        return elem
+
+    def _error(self, method, code, descr):
+        return ET.Element(method, dict(response="yes", errorCode=str(code),
+                                       invocationResult="unidentified-fail",
+                                       errorDescr=descr))
+
+    def _new_session(self):
+        cookie = "{0}/{1}".format(int(time.time()), uuid.uuid4())
+        self.sessions[cookie] = time.time()
+        return cookie
+
+    def do_aaaLogin(self, request):
+        if self.login_latency:
+            time.sleep(self.login_latency)
+        if request.attrib.get('inName') != self.username or \
+                request.attrib.get('inPassword') != self.password:
+            return self._error("aaaLogin", 551, "Authentication failed")
+        with self.lock:
+            if len(self.sessions) >= self.max_sessions:
+                return self._error("aaaLogin", 572,
+                                   "User reached maximum session limit")
+            cookie = self._new_session()
+        return self._response("aaaLogin", request, outCookie=cookie,
+                              outRefreshPeriod=self.refresh_period,
+                              outPriv="admin,read-only", outDomains="",
+                              outChannel="noencssl",
+                              outEvtChannel="noencssl",
+                              outSessionId=uuid.uuid4().hex[:16],
+                              outVersion="4.0(4e)",
+                              outName=self.username)
+
+    def do_aaaRefresh(self, request):
+        with self.lock:
+            if self.sessions.pop(request.attrib.get('inCookie'), None) is None:
+                return self._error("aaaRefresh", 552, "Authorization required")
+            cookie = self._new_session()
+        return self._response("aaaRefresh", request, outCookie=cookie,
+                              outRefreshPeriod=self.refresh_period,
+                              outPriv="admin,read-only", outDomains="",
+                              outChannel="noencssl",
+                              outEvtChannel="noencssl")
+
+    def do_aaaKeepAlive(self, request):
+        if request.attrib.get('cookie') not in self.sessions:
+            return self._error("aaaKeepAlive", 552, "Authorization required")
+        return self._response("aaaKeepAlive", request)
+
+    def do_aaaLogout(self, request):
+        with self.lock:
+            self.sessions.pop(request.attrib.get('inCookie'), None)
+        return self._response("aaaLogout", request, outStatus="success")
+
+    def _hierarchical(self, request):
+        return request.attrib.get('inHierarchical', "false") == "true"
+
+    def _in_filter(self, request):
+        in_filter = request.find("inFilter")
+        if in_filter is None or len(in_filter) == 0:
+            return FilterMatcher(None)
+        return FilterMatcher(in_filter[0])
+
+    def do_configResolveDn(self, request):
+        response = self._response("configResolveDn", request,
+                                  dn=request.attrib.get('dn'))
+        out = ET.SubElement(response, "outConfig")
+        dn = request.attrib.get('dn')
+        if self.tree.get(dn):
+            out.append(self.tree.element(dn, self._hierarchical(request)))
+        return response
+
+    def do_configResolveDns(self, request):
+        response = self._response("configResolveDns", request)
+        unresolved = ET.SubElement(response, "outUnresolved")
+        out = ET.SubElement(response, "outConfigs")
+        for dn_elem in request.iter("dn"):
+            dn = dn_elem.attrib.get('value')
+            if self.tree.get(dn):
+                out.append(self.tree.element(dn, self._hierarchical(request)))
+            else:
+                ET.SubElement(unresolved, "dn", value=dn)
+        return response
+
+    def do_configResolveClass(self, request):
+        class_id = request.attrib.get('classId')
+        response = self._response("configResolveClass", request,
+                                  classId=class_id)
+        out = ET.SubElement(response, "outConfigs")
+        matcher = self._in_filter(request)
+        for dn in sorted(self.tree.of_class(class_id)):
+            if matcher(self.tree.get(dn)[1]):
+                out.append(self.tree.element(dn, self._hierarchical(request)))
+        return response
+
+    def do_configResolveClasses(self, request):
+        response = self._response("configResolveClasses", request)
+        out = ET.SubElement(response, "outConfigs")
+        for class_elem in request.iter("classId"):
+            for dn in sorted(self.tree.of_class(class_elem.attrib['value'])):
+                out.append(self.tree.element(dn, self._hierarchical(request)))
+        return response
+
+    def do_configResolveChildren(self, request):
+        class_id = request.attrib.get('classId')
+        in_dn = request.attrib.get('inDn')
+        response = self._response("configResolveChildren", request,
+                                  inDn=in_dn)
+        out = ET.SubElement(response, "outConfigs")
+        matcher = self._in_filter(request)
+        for dn in self.tree.child_dns(in_dn):
+            mo_class, attrs = self.tree.get(dn)
+            if class_id and mo_class != _camel(class_id):
+                continue
+            if matcher(attrs):
+                out.append(self.tree.element(dn, self._hierarchical(request)))
+        return response
+
+
+    def _apply(self, elem, parent_dn, changes):
+        attrs = dict(elem.attrib)
+        status = attrs.pop('status', "")
+        dn = attrs.pop('dn', None) or "{0}/{1}".format(parent_dn, attrs['rn'])
+        if "deleted" in status:
+            self.tree.remove(dn)
+            changes.append((elem.tag, dn, "deleted"))
+            return
+        current = self.tree.get(dn)
+        merged = dict(current[1]) if current else {}
+        merged.pop('dn', None)
+        merged.update(attrs)
+        self.tree.add(elem.tag, dn, **merged)
+        changes.append((elem.tag, dn, "modified" if current else "created"))
+        for child in elem:
+            self._apply(child, dn, changes)
+
+    def do_configConfMos(self, request):
+        with self.lock:
+            busy = self.busy_commits > 0
+            self.busy_commits -= busy
+        if busy:
+            return self._error("configConfMos", 103,
+                               "system is busy, try again later")
+        response = self._response("configConfMos", request)
+        out = ET.SubElement(response, "outConfigs")
+        changes = []
+        with self.tree.lock:
+            for pair in request.iter("pair"):
+                dn = pair.attrib['key']
+                for mo in pair:
+                    self._apply(mo, dn.rsplit('/', 1)[0], changes)
+                    out_pair = ET.SubElement(out, "pair", key=dn)
+                    if self.tree.get(dn):
+                        out_pair.append(self.tree.element(dn, True))
+                    else:
+                        ET.SubElement(out_pair, mo.tag, dn=dn,
+                                      status="deleted")
+        self.audit(changes)
+        self.publish(changes)
+        for class_id, dn, status in changes:
+            if class_id == "lsmaintAck" and status != "deleted" and \
+                    "trigger" in self.tree.get(dn)[1].get('adminState', ""):
+                self.reboot(dn)
+        return response
+
+    def _update(self, dn, **attrs):
+        with self.tree.lock:
+            current = self.tree.get(dn)
+            if current:
+                merged = dict(current[1], **attrs)
+                merged.pop('dn', None)
+                self.tree.add(current[0], dn, **merged)
+
+    def reboot(self, ack_dn):
+        """play out the reboot an acknowledged pending activity starts: the
+           profile applies for reboot_seconds, then the ack goes away"""
+
+        profile = ack_dn.rsplit('/', 1)[0]
+        self._update(profile, operState="config", configState="applying")
+        self._update(ack_dn, operState="scheduled")
+
+        def finish():
+            self._update(profile, operState="ok", configState="applied")
+            self.tree.remove(ack_dn)
+
+        timer = threading.Timer(self.reboot_seconds, finish)
+        timer.daemon = True
+        timer.start()
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """http front end for MockUcsm"""
+
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        with self.server.ucsm.lock:
+            self.server.ucsm.connections += 1
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        ucsm = self.server.ucsm
+        if self.path.startswith("/stats/reset"):
+            ucsm.reset_stats()
+        body = json.dumps(ucsm.snapshot_stats()).encode("utf-8")
+        self._send(body, "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if body.lstrip().startswith(b"<eventSubscribe"):
+            self._stream_events(ET.fromstring(body).attrib.get('cookie'))
+            return
+        self._send(self.server.ucsm.dispatch(body), "text/xml")
+
+    def _stream_events(self, cookie):
+        """hold the connection open and write events until logout"""
+
+        ucsm = self.server.ucsm
+        ucsm.count("eventSubscribe", 0, 0)
+        if cookie not in ucsm.sessions:
+            self._send(ET.tostring(ucsm._error("eventSubscribe", 552,
+                                               "Authorization required")),
+                       "text/xml")
+            return
+
+        events = ucsm.subscribe()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            while cookie in ucsm.sessions:
+                try:
+                    event = events.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self.wfile.write("{0}\n".format(len(event)).encode("utf-8") +
+                                 event)
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+        finally:
+            ucsm.unsubscribe(events)
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """threaded http server carrying a MockUcsm"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+    # the default backlog of 5 drops connects from concurrent clients, which
+    # then wait a second or more to retry
+    request_queue_size = 128
+
+    def __init__(self, address, ucsm, ssl_context=None):
+        self.ucsm = ucsm
+        self.ssl_context = ssl_context
+        HTTPServer.__init__(self, address, MockRequestHandler)
+
+    def get_request(self):
+        sock, address = HTTPServer.get_request(self)
+        if self.ssl_context is not None:
+            # handshake on the handler thread, not the accepting one
+            sock = self.ssl_context.wrap_socket(
+                sock, server_side=True, do_handshake_on_connect=False)
+        return sock, address
+
+
+def tls_context(certfile, keyfile=None):
+    """server side tls context for a certificate (and key) pem file"""
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def start_server(port=0, tree=None, certfile=None, keyfile=None, **kwargs):
+    """start a mock ucsm on a background thread, returns the server;
+       server.server_address[1] is the port actually bound.  With certfile
+       it serves https."""
+
+    ucsm = MockUcsm(tree or seed_tree(MoTree()), **kwargs)
+    server = MockServer(("127.0.0.1", port), ucsm,
+                        tls_context(certfile, keyfile) if certfile else None)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class TreeSaver(threading.Thread):
+    """saves a tree to path every interval seconds while it changes, and
+       once more when stopped"""
+
+    def __init__(self, tree, path, interval=5.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.tree = tree
+        self.path = path
+        self.interval = interval
+        self.saved = tree.changes
+        self.stopped = threading.Event()
+
+    def save(self):
+        if self.tree.changes != self.saved:
+            self.saved = self.tree.save(self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.save()
+
+    def stop(self):
+        self.stopped.set()
+        self.save()
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="milliseconds added to every request")
+    parser.add_argument("--login-latency", type=float, default=0,
+                        help="extra milliseconds added to aaaLogin")
+    parser.add_argument("--max-sessions", type=int, default=32)
+    parser.add_argument("--audit-size", type=int, default=1000,
+                        help="aaaModLR records kept")
+    parser.add_argument("--busy-commits", type=int, default=0,
+                        help="configConfMos calls to reject as busy")
+    parser.add_argument("--reboot-seconds", type=float, default=1,
+                        help="seconds a server takes to reboot once its "
+                             "pending activity is acknowledged")
+    parser.add_argument("--certfile", help="serve https with this pem")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--state", help="load the tree from this file if it "
+                        "exists and save every change back to it")
+    parser.add_argument("--save-interval", type=float, default=5,
+                        help="seconds between saves of --state")
+    args = parser.parse_args()
+
+    tree = MoTree()
+    if args.state and os.path.exists(args.state):
+        tree.load(args.state)
+    else:
+        seed_tree(tree)
+    saver = None
+    if args.state:
+        saver = TreeSaver(tree, args.state, args.save_interval)
+        saver.start()
+
+    ucsm = MockUcsm(tree, username=args.username,
+                    password=args.password, latency=args.latency / 1000.0,
+                    login_latency=args.login_latency / 1000.0,
+                    max_sessions=args.max_sessions,
+                    audit_size=args.audit_size,
+                    busy_commits=args.busy_commits,
+                    reboot_seconds=args.reboot_seconds)
+    server = MockServer(("127.0.0.1", args.port), ucsm,
+                        tls_context(args.certfile, args.keyfile)
+                        if args.certfile else None)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if saver is not None:
+            saver.stop()
+
+
+if __name__ == '__main__':
+    main()
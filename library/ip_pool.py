@@ -1,8 +1,12 @@
 #!/usr/bin/python
 
-from ucsmsdk.ucsconstants import NamingId
-from ucsmsdk.mometa.ippool.IppoolPool import IppoolPool
-from ucsmsdk.mometa.ippool.IppoolBlock import IppoolBlock
+import socket
+import struct
+
+from ucs import LazyMo
+
+IppoolPool = LazyMo("IppoolPool")
+IppoolBlock = LazyMo("IppoolBlock")
 
 DOCUMENTATION = '''
 ---
@@ -12,9 +16,15 @@ author:  "Chris Dunlap (@stoffee)"
 version_added: "<version_tag>"
 description:
     - Create UCS ip_pool in a UCS version 2.2X and greater. This module,
-      allows you to create a IP Pool, add an IP Pool block to an existing IP Pool, 
+      allows you to create a IP Pool, add an IP Pool block to an existing IP Pool,
+      or delete the pool.
 notes:
-    - 
+    - Each block runs from starting_address for number_of_ip addresses. Blocks
+      are checked against each other and against the blocks of every other
+      ip pool in every org before anything is committed, an overlap fails the
+      task.
+    - When ip_v4_pool_block is given, blocks of the pool that are not listed
+      are removed. Leave it out to manage only the pool itself.
 requirements:
     - "python >= 2.7.5"
     - "ucsmsdk"
@@ -31,15 +41,20 @@ options:
       default: None
     state:
       description:
-        - "a choice, either 'enabled' or 'disabled'"
+        - "a choice, either 'present' or 'absent'"
+      required: false
+      default: present
     ip_v4_pool_block:
       description:
-        - "IP Block of IPv4 address type"
+        - "list of IPv4 blocks, each with starting_address, number_of_ip,
+           default_route, primary_dns and optionally secondary_dns and
+           subnet_mask"
       required: false
       default: None
     org_name:
       description:
-        - "organizational object name to create the ip pool under"
+        - "organizational object name to create the ip pool under, either a
+           bare org name or a full org path such as root/HR/Prod"
         required: true
         default: None
 '''
@@ -56,22 +71,22 @@ EXAMPLES = '''
     org_name: myorgname
     ip_pool_name: DC03
     ip_pool_descr: datacenter 03 ip pool
-    ip_v4_pool_block: 
+    ip_v4_pool_block:
       - name: IPv4_DC_Exchange
         description: v4 IP Block for exchange server and domain controllers
         starting_address: 10.10.0.1
         number_of_ip: 100
         default_route: 10.10.0.1
-	primary_dns: 10.10.0.10
-	secondary_dns: 10.10.0.11
+        primary_dns: 10.10.0.10
+        secondary_dns: 10.10.0.11
 
       - name: IPv4_Oracle
         description: v4 IP Block for Oracle
         starting_address: 10.10.1.1
         number_of_ip: 200
         default_route: 10.10.1.1
-	primary_dns: 10.10.1.10
-	secondary_dns: 10.10.1.11
+        primary_dns: 10.10.1.10
+        secondary_dns: 10.10.1.11
 '''
 
 ##### Start-Of-PythonScript #####
@@ -108,76 +123,184 @@ EXAMPLES = '''
 def get_ip_pool(handle, org_obj, name):
     """verify if ip pool already exists"""
 
-    ret_val = None
-    filter_str = '(name, "{0}", type="eq")'.format(name)
-    ip_pool_list = handle.query_children(in_mo=org_obj,
-                                      class_id=IppoolPool.name,
-                                      filter_str=filter_str,
-                                      hierarchy=False)
-    for ip_pool in ip_pool_list:
-        if ip_pool.name == name:
-            ret_val = ip_pool
-            break
-
-    return ret_val
+    return cache_query_dn(handle, IppoolPool(parent_mo_or_dn=org_obj,
+                                             name=name).dn)
+
+
+def ip_to_int(address):
+    """dotted quad to integer"""
+
+    return struct.unpack("!I", socket.inet_aton(address))[0]
+
+
+def int_to_ip(value):
+    """integer to dotted quad"""
+
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def desired_blocks(params):
+    """the ip_v4_pool_block param as {(from, to): block properties}, the
+       last address computed from starting_address and number_of_ip"""
+
+    blocks = {}
+    for block in params['ip_v4_pool_block'] or []:
+        try:
+            first = ip_to_int(block['starting_address'])
+        except (KeyError, socket.error, TypeError):
+            raise ValueError("ip block {0} needs a valid starting_address"
+                             .format(block.get('name', block)))
+        count = int(block.get('number_of_ip') or 0)
+        if count < 1 or first + count - 1 > 0xffffffff:
+            raise ValueError("ip block {0} has an invalid number_of_ip"
+                             .format(block.get('name', block)))
+
+        key = (int_to_ip(first), int_to_ip(first + count - 1))
+        if key in blocks:
+            raise ValueError("ip block {0}-{1} is listed twice".format(*key))
+        blocks[key] = dict(def_gw=block.get('default_route'),
+                           prim_dns=block.get('primary_dns'),
+                           sec_dns=block.get('secondary_dns'),
+                           subnet=block.get('subnet_mask'))
+    return blocks
+
+
+def find_overlaps(wanted, others):
+    """overlaps between the wanted (from, to) blocks and each other or any
+       block in others ({dn: (from, to)}), found with one sort and a sweep
+       over the integer intervals rather than comparing every pair"""
+
+    intervals = [(ip_to_int(first), ip_to_int(last),
+                  "{0}-{1}".format(first, last), True)
+                 for first, last in wanted]
+    intervals.extend((ip_to_int(first), ip_to_int(last), dn, False)
+                     for dn, (first, last) in others.items())
+    intervals.sort()
+
+    overlaps = []
+    reach = None
+    for first, last, label, is_wanted in intervals:
+        if reach is not None and first <= reach[0] and \
+                (is_wanted or reach[2]):
+            overlaps.append("{0} overlaps {1}".format(label, reach[1]))
+        if reach is None or last > reach[0]:
+            reach = (last, label, is_wanted)
+    return overlaps
+
+
+def build_ip_pool(handle, org_obj, params, batch=None):
+    """diff the wanted pool and blocks against ucsm, returns (changes, diff)
+       for commit_changes, raises ValueError for invalid or overlapping
+       blocks.  All the blocks of every org are read in one class query.
+       batch ({pool dn: [(from, to)]}) holds the blocks other pools
+       committed alongside this one will have instead of their current
+       ones."""
+
+    name = params['ip_pool_name']
+    descr = params['ip_pool_descr']
+    pool_dn = IppoolPool(parent_mo_or_dn=org_obj, name=name).dn
+    wanted = desired_blocks(params)
+    batch = dict((dn, blocks) for dn, blocks in (batch or {}).items()
+                 if dn != pool_dn)
+
+    pool = cache_query_dn(handle, pool_dn)
+    blocks = {}
+    others = {}
+    for block in cache_query_classid(handle, "IppoolBlock"):
+        block_pool = block.dn.rsplit('/', 1)[0]
+        if block_pool == pool_dn:
+            blocks[(block.r_from, block.to)] = block
+        elif block_pool not in batch:
+            others[block.dn] = (block.r_from, block.to)
+    for other_dn, other_blocks in batch.items():
+        for first, last in other_blocks:
+            others["{0}/block-{1}-{2}".format(other_dn, first, last)] = \
+                (first, last)
+
+    overlaps = find_overlaps(wanted, others)
+    if overlaps:
+        raise ValueError("overlapping ip blocks: " + "; ".join(overlaps))
+
+    diff = dict(before={}, after=dict(descr=descr, blocks=sorted(
+        "{0}-{1}".format(*key) for key in wanted)))
+    if pool is not None:
+        diff['before'] = dict(descr=pool.descr, blocks=sorted(
+            "{0}-{1}".format(*key) for key in blocks))
+
+    changes = []
+
+    if pool is None:
+        pool = IppoolPool(parent_mo_or_dn=org_obj, name=name, descr=descr)
+        for (first, last), props in wanted.items():
+            IppoolBlock(parent_mo_or_dn=pool, r_from=first, to=last,
+                        **dict((k, v) for k, v in props.items()
+                               if v is not None))
+        changes.append(("add", pool))
+        return changes, diff
+
+    if diff_props(pool, dict(descr=descr)):
+        changes.append(("add", IppoolPool(parent_mo_or_dn=org_obj,
+                                          name=name, descr=descr)))
+
+    for (first, last), props in sorted(wanted.items()):
+        if (first, last) not in blocks or \
+                diff_props(blocks[(first, last)], props):
+            changes.append(("add", IppoolBlock(
+                parent_mo_or_dn=pool_dn, r_from=first, to=last,
+                **dict((k, v) for k, v in props.items() if v is not None))))
+
+    # leave the blocks alone entirely when the task does not list any
+    if params['ip_v4_pool_block'] is not None:
+        for key, block in sorted(blocks.items()):
+            if key not in wanted:
+                changes.append(("remove", block))
+
+    return changes, diff
 
 
 def ip_pool_present(handle, params):
-    """make the IP Pool"""
+    """make the IP Pool, committing only the blocks that differ"""
 
-    org_obj = get_org(handle, params['org_name'])
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
 
-    if org_obj:
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
 
-        ip_pool_pool = IPPoolPool(parent_mo_or_dn=org_obj,
-                                     name=params['name'],
-                                     desc=params['desc'])
-                                     netbios=params['is_net_bios_enabled'])
-                                     dhcp=params['supports_dhcp'])
-                                     order=params['assignment_order'])
+    try:
+        changes, diff = build_ip_pool(handle, org_obj, params)
+    except ValueError as block_exception:
+        return dict(changed=False, failed=True, msg=str(block_exception))
 
-        for ip_pool in params['ippoolPool']:
-            ip_pool = IP_Pool(parent_mo_or_dn=ip_pool_pool,
-                             name=ip_pool['name'],
-                             desc=ip_pool['desc'],
-                             netbios=ip_pool['netbios']),
-                             dhcp=ip_pool['dhcp']),
-                             order=str(ip_pool['order'])
+    commits = commit_changes(handle, changes, params)
 
-        handle.add_mo(ip_pool_pool, True)
-        handle.commit()
+    return dict(changed=bool(changes), diff=diff, commits=commits)
 
-        if get_ip_pool(handle, org_obj, params['name']):
-            #return ({'changed': True, 'failed': False})
-            return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
-
-
-def vcon_absent(handle, params):
-    """remove the vcon"""
-
-    org_obj = get_org(handle, params['org_name'])
-
-    if org_obj:
-        filter_str = '(name, "{0}", type="eq")'.format(params['lan_con_name'])
-        vcon_list = handle.query_children(in_mo=org_obj,
-                                          class_id=NamingId.VNIC_LAN_CONN_POLICY,
-                                          filter_str=filter_str,
-                                          hierarchy=False)
-        for vcon in vcon_list:
-            if vcon.name == params['lan_con_name']:
-                handle.remove_mo(vcon)
-                handle.commit()
-                break
-
-    if get_vcon(handle, org_obj, params['lan_con_name']):
-        #return ({'changed': True, 'failed': False})
-        return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
+
+def ip_pool_absent(handle, params):
+    """remove the IP Pool"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False)
+
+    pool = get_ip_pool(handle, org_obj, params['ip_pool_name'])
+    if pool is None:
+        return dict(changed=False)
+
+    commit_changes(handle, [("remove", pool)], params)
+    return dict(changed=True)
 
 
 def main():
@@ -198,9 +321,6 @@ def main():
         ),
         ip_v4_pool_block=dict(
             required=False,
-            type="str"
-        ),
-        current_ip_pools=dict(
             type="list"
         ),
         state=dict(
@@ -211,16 +331,16 @@ def main():
     ))
 
 
-    module = AnsibleModule(argument_spec=spec)
-
-    handle = get_handle(module)
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
 
     if module.params['state'] == 'present':
-        result = vcon_present(handle, module.params)
+        result = run_on_domains(module, ip_pool_present)
     else:
-        result = vcon_absent(handle, module.params)
+        result = run_on_domains(module, ip_pool_absent)
 
-    module.exit_json(changed=result)
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
@@ -1,38 +1,803 @@
 """This is a utility module to hand off a ucs handle to calling ansible
-   modules"""
+   modules
 
+   Nothing from ucsmsdk is imported until a module first needs it: loading
+   the sdk and its class catalogue costs more than the rest of a task that
+   fails argument validation, so managed object classes are declared with
+   LazyMo and the sdk helpers are imported inside the functions using them."""
+
+import atexit
+import contextlib
+import importlib
+import json
 import os
-from ucsmsdk.ucshandle import UcsHandle
-from ucsmsdk.ucsconstants import NamingId
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+class LazyMo(object):
+    """stands in for a ucsmsdk class and imports it on first use.
+
+       LazyMo("IppoolPool") is the managed object class of that class id,
+       LazyMo("ucshandle", "UcsHandle") any other name from a ucsmsdk
+       module.  Calling it or reading an attribute loads the real thing."""
+
+    def __init__(self, name, attr=None):
+        self._name = name
+        self._attr = attr
+        self._target = None
+
+    def _load(self):
+        if self._target is None:
+            if self._attr is None:
+                from ucsmsdk.ucscoreutils import load_class
+                self._target = load_class(self._name)
+            else:
+                module = importlib.import_module("ucsmsdk." + self._name)
+                self._target = getattr(module, self._attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+UcsHandle = LazyMo("ucshandle", "UcsHandle")
+OrgOrg = LazyMo("OrgOrg")
 
 HANDLE_LIST = []
+HANDLE_LOCK = threading.Lock()
 
-def get_handle(module):
-    """get a handle by parsing the modules params, if the handle is already
-       open, then give the caller that handle, else try and open a new one
-       let the module handle any login failures"""
+ORG_CACHE_DIR = os.environ.get(
+    "UCS_ORG_CACHE_DIR", os.path.expanduser("~/.ansible/tmp/ucs_org_cache"))
+ORG_CACHE_TTL = int(os.environ.get("UCS_ORG_CACHE_TTL", 300))
 
-    ucsm = module.params['hostname']
-    ucs_user = module.params['username']
-    ucs_password = module.params['password']
-    port = module.params['port']
-    secure = module.params['secure']
+MO_CACHE_TTL = int(os.environ.get("UCS_MO_CACHE_TTL", 60))
+MO_CACHE_BYTES = int(os.environ.get("UCS_MO_CACHE_BYTES", 32 * 1024 * 1024))
 
-    for handle in HANDLE_LIST:
-        if handle.ip == ucsm or handle.name == ucsm:
-            return handle
+POOL_SIZE = int(os.environ.get("UCS_POOL_SIZE", 4))
+
+COMMIT_CHUNK_SIZE = int(os.environ.get("UCS_COMMIT_CHUNK_SIZE", 0))
+COMMIT_RETRIES = int(os.environ.get("UCS_COMMIT_RETRIES", 3))
+COMMIT_BACKOFF = float(os.environ.get("UCS_COMMIT_BACKOFF", 1))
+TRANSIENT_RE = re.compile(r"busy|timed? ?out|try again|temporar", re.I)
+
+CONCURRENCY = int(os.environ.get("UCS_CONCURRENCY", 10))
+
+UCS_TIMING = os.environ.get("UCS_TIMING", "").lower() in ("1", "true", "yes")
+TRACE_FILE = os.environ.get("UCS_TRACE_FILE")
+TRACE_METHOD_RE = re.compile(r"<(\w+)")
+TRACE_ATTR_RE = re.compile(r'\b(dn|inDn|classId)="([^"]*)"')
+TRACE_ERROR_RE = re.compile(r'errorCode="([^"]*)"')
+
+def _broker_call(socket_path, request):
+    """send one request to the session broker listening on socket_path,
+       returns its reply or None if no broker is listening there"""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (IOError, OSError):
+        sock.close()
+        return None
+
+    try:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        reply = sock.makefile("r").readline()
+    finally:
+        sock.close()
+
+    return json.loads(reply)
+
+def get_broker_session(socket_path, ucsm, ucs_user, ucs_password, port,
+                       secure):
+    """ask the session broker listening on socket_path for a frozen handle,
+       returns None if no broker is listening there"""
 
-    handle = UcsHandle(ucsm, ucs_user, ucs_password, secure=bool(secure),
-                       port=port)
+    request = dict(op="session", hostname=ucsm, username=ucs_user,
+                   password=ucs_password, port=port, secure=bool(secure))
+
+    reply = _broker_call(socket_path, request)
+    if reply is None:
+        return None
+    if not reply.get('ok'):
+        raise Exception(reply.get('error', 'session broker refused request'))
+
+    return reply['handle']
+
+def _logout_quietly(handle):
+    """release a session this process logged in itself"""
 
     try:
+        handle.logout()
+    except Exception:
+        pass
+
+def _own_tx_lock(handle):
+    """ucsmsdk serialises every request in the process on one global lock,
+       which would run the domains of run_on_domains one at a time.  Order
+       only matters within a session, so give each handle a lock of its own"""
+
+    lock = threading.Lock()
+
+    def acquire(elem):
+        if elem.tag != "aaaLogout":
+            lock.acquire()
+
+    def release(elem):
+        if elem.tag != "aaaLogout":
+            lock.release()
+
+    handle._tx_lock_acquire_conditional = acquire
+    handle._tx_lock_release_conditional = release
+    return handle
+
+class _ResumingContext(object):
+    """ssl context handing the tls session of earlier connections to new
+       ones, so a reconnect resumes it instead of a full handshake"""
+
+    def __init__(self, context, resume):
+        self.context = context
+        self.resume = resume
+        self.session = None
+        self.resumed = 0
+
+    def wrap_socket(self, sock, server_hostname=None, **kwargs):
+        session = self.session if self.resume else None
+        sock = self.context.wrap_socket(sock, server_hostname=server_hostname,
+                                        session=session)
+        if sock.session_reused:
+            self.resumed += 1
+        return sock
+
+    def wrap_bio(self, incoming, outgoing, server_side=False,
+                 server_hostname=None):
+        # asyncio's connections, whose handshake is yet to come
+        session = self.session if self.resume else None
+        return self.context.wrap_bio(incoming, outgoing,
+                                     server_side=server_side,
+                                     server_hostname=server_hostname,
+                                     session=session)
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+class _PooledResponse(object):
+    """a response read lazily, its connection going back to the pool only
+       once the body has been read to the end"""
+
+    def __init__(self, driver, key, conn, response):
+        self.driver = driver
+        self.key = key
+        self.conn = conn
+        self.response = response
+
+    def read(self, *args):
+        return self.response.read(*args)
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.response.isclosed():
+            self.driver._release(self.key, self.conn, self.response)
+        else:
+            self.conn.close()
+        self.conn = None
+
+class PooledDriver(object):
+    """stands in for ucsmsdk's UcsDriver, which opens a new connection and
+       does a full tls handshake for every request.  Up to pool_size idle
+       keep-alive connections per host are kept and reused, new connections
+       resume the tls session of earlier ones, and timeout (seconds) bounds
+       every request.  Certificates are not verified, as with UcsDriver."""
+
+    def __init__(self, pool_size=POOL_SIZE, keep_alive=True, tls_resume=True,
+                 timeout=None):
+        import ssl
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        self.context = _ResumingContext(context, tls_resume)
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.headers = {}
+        self.redirect_uri = None
+        self.stats = dict(requests=0, connects=0, reused=0)
+
+    def add_header(self, header_prop, header_value):
+        self.headers[header_prop] = header_value
+
+    def remove_header(self, header_prop):
+        self.headers.pop(header_prop, None)
+
+    def update_handlers(self, tls_proto=None):
+        pass
+
+    @property
+    def tls_resumed(self):
+        return self.context.resumed
+
+    def _connect(self, key, timeout):
+        try:
+            import http.client as http_client
+        except ImportError:
+            import httplib as http_client
+
+        scheme, host, port = key
+        self.stats['connects'] += 1
+        if scheme == "https":
+            return http_client.HTTPSConnection(host, port, timeout=timeout,
+                                               context=self.context)
+        return http_client.HTTPConnection(host, port, timeout=timeout)
+
+    def _acquire(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                self.stats['reused'] += 1
+                return idle.pop(), True
+        return None, False
+
+    def _remember_session(self, conn):
+        session = getattr(conn.sock, "session", None)
+        if session is not None:
+            self.context.session = session
+
+    def _release(self, key, conn, response):
+        if not self.keep_alive or response.will_close or conn.sock is None:
+            conn.close()
+            return
+        with self.lock:
+            self._remember_session(conn)
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """close every idle connection"""
+
+        with self.lock:
+            conns = [conn for idle in self.idle.values() for conn in idle]
+            self.idle = {}
+        for conn in conns:
+            conn.close()
+
+    def post(self, uri, data=None, dump_xml=False, read=True, timeout=None):
+        """send data to uri and return the body, or with read unset a file
+           like response to be closed by the caller"""
+
+        try:
+            from urllib.parse import urlsplit
+            from urllib.error import HTTPError
+        except ImportError:
+            from urlparse import urlsplit
+            from urllib2 import HTTPError
+
+        parts = urlsplit(self.redirect_uri or uri)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == "https" else 80))
+        path = parts.path or "/"
+        timeout = self.timeout or timeout
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+        if isinstance(data, type(u"")):
+            data = data.encode("utf-8")
+
+        self.stats['requests'] += 1
+        conn, reused = self._acquire(key)
+        while True:
+            if conn is None:
+                conn = self._connect(key, timeout)
+            elif conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request("POST", path, data, headers)
+                response = conn.getresponse()
+                # tls 1.3 tickets arrive after the handshake, so take the
+                # session now, before a closing response drops the socket
+                self._remember_session(conn)
+                break
+            except (IOError, OSError) as pooled_exception:
+                conn.close()
+                # an idle connection the server has since closed, only
+                # ever retried when nothing came back on it
+                if not reused or isinstance(pooled_exception,
+                                            socket.timeout):
+                    raise
+                conn, reused = None, False
+
+        if response.status in (301, 302, 307) and \
+                response.getheader("Location"):
+            response.read()
+            self._release(key, conn, response)
+            self.redirect_uri = response.getheader("Location")
+            return self.post(uri, data, dump_xml, read, timeout)
+        if response.status >= 400:
+            response.read()
+            self._release(key, conn, response)
+            raise HTTPError(uri, response.status, response.reason,
+                            response.msg, None)
+
+        if not read:
+            return _PooledResponse(self, key, conn, response)
+        body = response.read()
+        self._release(key, conn, response)
+        return body.decode("utf-8")
+
+def use_pooled_driver(handle, params):
+    """give handle a PooledDriver for every request it sends"""
+
+    handle._UcsSession__driver = PooledDriver(
+        pool_size=params.get('pool_size'),
+        keep_alive=params.get('keep_alive', True),
+        tls_resume=params.get('tls_resume', True),
+        timeout=params.get('request_timeout'))
+    return handle
+
+class Tracer(object):
+    """records a span for every round trip a handle makes, nested under
+       the spans opened with span().  Spans are kept as dicts holding the
+       name, parent, start and end times (epoch seconds) and attrs."""
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or _span_id(16)
+        self.spans = []
+        self.stack = []
+        self.lock = threading.Lock()
+
+    def start(self, name, kind="internal", **attrs):
+        span = dict(id=_span_id(8), name=name, kind=kind, start=time.time(),
+                    end=None, attrs=attrs, error=None,
+                    parent=self.stack[-1]['id'] if self.stack else None)
+        with self.lock:
+            self.spans.append(span)
+        return span
+
+    def end(self, span, error=None, **attrs):
+        span['attrs'].update(attrs)
+        span['error'] = span['error'] or error
+        span['end'] = time.time()
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """a span around the block, the parent of every span opened in it"""
+
+        span = self.start(name, **attrs)
+        self.stack.append(span)
+        try:
+            yield span
+        except Exception as span_exception:
+            self.end(span, error=str(span_exception))
+            raise
+        finally:
+            self.stack.remove(span)
+            if span['end'] is None:
+                self.end(span)
+
+    def summary(self):
+        """the spans in the form the ucs_timing result key takes, times in
+           seconds from the first span"""
+
+        with self.lock:
+            spans = [span for span in self.spans if span['end'] is not None]
+        if not spans:
+            return dict(seconds=0, requests=0, spans=[])
+
+        origin = min(span['start'] for span in spans)
+        requests = [span for span in spans if span['kind'] == "client"]
+        methods = {}
+        for span in requests:
+            entry = methods.setdefault(span['attrs'].get('method'),
+                                       dict(calls=0, seconds=0))
+            entry['calls'] += 1
+            entry['seconds'] += span['end'] - span['start']
+        for entry in methods.values():
+            entry['seconds'] = round(entry['seconds'], 3)
+
+        listed = []
+        for span in spans:
+            entry = dict(span['attrs'], name=span['name'], id=span['id'],
+                         parent=span['parent'],
+                         start=round(span['start'] - origin, 3),
+                         seconds=round(span['end'] - span['start'], 3))
+            if span['error']:
+                entry['error'] = span['error']
+            listed.append(entry)
+
+        return dict(
+            seconds=round(max(span['end'] for span in spans) - origin, 3),
+            requests=len(requests),
+            request_bytes=sum(span['attrs'].get('request_bytes', 0)
+                              for span in requests),
+            response_bytes=sum(span['attrs'].get('response_bytes', 0)
+                               for span in requests),
+            methods=methods, spans=listed)
+
+    def otlp(self, **resource):
+        """the spans as an OTLP/JSON ExportTraceServiceRequest"""
+
+        def value(attr):
+            if isinstance(attr, bool):
+                return dict(boolValue=attr)
+            if isinstance(attr, int):
+                return dict(intValue=str(attr))
+            if isinstance(attr, float):
+                return dict(doubleValue=attr)
+            return dict(stringValue=str(attr))
+
+        def attributes(attrs, prefix):
+            return [dict(key=prefix + key, value=value(attr))
+                    for key, attr in sorted(attrs.items())
+                    if attr is not None]
+
+        with self.lock:
+            spans = [span for span in self.spans if span['end'] is not None]
+
+        otlp_spans = []
+        for span in spans:
+            otlp_span = dict(
+                traceId=self.trace_id, spanId=span['id'], name=span['name'],
+                kind=3 if span['kind'] == "client" else 1,
+                startTimeUnixNano=str(int(span['start'] * 1e9)),
+                endTimeUnixNano=str(int(span['end'] * 1e9)),
+                attributes=attributes(span['attrs'], "ucs."),
+                status=dict(code=2, message=span['error'])
+                if span['error'] else dict(code=1))
+            if span['parent']:
+                otlp_span['parentSpanId'] = span['parent']
+            otlp_spans.append(otlp_span)
+
+        return dict(resourceSpans=[dict(
+            resource=dict(attributes=attributes(
+                dict(resource, **{"service.name": "ansible-ucs"}), "")),
+            scopeSpans=[dict(scope=dict(name="ucs"), spans=otlp_spans)])])
+
+def _span_id(size):
+    return "".join("{0:02x}".format(byte)
+                   for byte in bytearray(os.urandom(size)))
+
+class _TracedResponse(object):
+    """a response read lazily, its span ending when it is closed"""
+
+    def __init__(self, tracer, span, response):
+        self.tracer = tracer
+        self.span = span
+        self.response = response
+        self.size = 0
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self.response.close()
+        if self.span['end'] is None:
+            self.tracer.end(self.span, response_bytes=self.size)
+
+def _request_attrs(xml_str):
+    """what a request is after, read off its xml without parsing it"""
+
+    if not isinstance(xml_str, type(u"")):
+        xml_str = xml_str.decode("utf-8")
+
+    head = xml_str[:512]
+    attrs = dict(request_bytes=len(xml_str.encode("utf-8")),
+                 method=TRACE_METHOD_RE.search(head).group(1)
+                 if TRACE_METHOD_RE.search(head) else None)
+    for key, found in TRACE_ATTR_RE.findall(head):
+        attrs.setdefault(dict(inDn="dn", classId="class_id").get(key, key),
+                         found)
+    if attrs['method'] == "configResolveDns":
+        attrs['dns'] = xml_str.count("<dn ")
+    elif attrs['method'] == "configConfMos":
+        attrs['objects'] = xml_str.count("<pair ")
+    return attrs
+
+def trace_handle(handle, tracer):
+    """record every request handle posts as a span of tracer"""
+
+    handle.tracer = tracer
+    if getattr(handle, "offline", False) or \
+            "post_xml" in getattr(handle, "__dict__", {}):
+        return handle
+
+    post_xml = handle.post_xml
+
+    def traced_post_xml(xml_str, read=True, timeout=None):
+        tracer = handle.tracer
+        span = tracer.start("ucs.request", kind="client",
+                            **_request_attrs(xml_str))
+        try:
+            response = post_xml(xml_str, read=read, timeout=timeout)
+        except Exception as post_exception:
+            tracer.end(span, error=str(post_exception))
+            raise
+        if not read:
+            return _TracedResponse(tracer, span, response)
+        error = TRACE_ERROR_RE.search(response[:512])
+        tracer.end(span, error=error.group(1) if error else None,
+                   response_bytes=len(response))
+        return response
+
+    handle.post_xml = traced_post_xml
+    return handle
+
+@contextlib.contextmanager
+def trace_span(handle, name, **attrs):
+    """a span around a block of work on handle, nothing when the task is
+       not traced"""
+
+    tracer = getattr(handle, "tracer", None)
+    if tracer is None:
+        yield None
+        return
+    with tracer.span(name, **attrs) as span:
+        yield span
+
+def write_trace(path, tracers, **resource):
+    """append the spans of each tracer to path as one OTLP/JSON line"""
+
+    lines = "".join(json.dumps(tracer.otlp(**resource), sort_keys=True) +
+                    "\n" for tracer in tracers)
+    # one write on an O_APPEND file, so tasks running at once do not mix
+    # up their lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, lines.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+def open_handle(params, tracer=None):
+    """return a logged in handle for the connection params, reusing one this
+       process already has open, raises if the login fails.  With snapshot
+       set it is the SnapshotHandle of that backup file or ucs_snapshot
+       export instead, a dest holding several domains picking this one's.
+       With a tracer every request the handle sends is traced to it."""
+
+    if params.get('snapshot'):
+        path = params['snapshot']
+        if os.path.isdir(path) and \
+                not os.path.exists(os.path.join(path, "meta.json")):
+            path = domain_dir(path, params)
+        handle = open_snapshot(path)
+        if tracer is not None:
+            handle.tracer = tracer
+        return handle
+
+    ucsm = params['hostname']
+    ucs_user = params['username']
+    ucs_password = params['password']
+    port = params['port']
+    secure = params['secure']
+    broker_socket = params.get('broker_socket')
+
+    with HANDLE_LOCK:
+        for handle in HANDLE_LIST:
+            if (handle.ip == ucsm or handle.name == ucsm) and \
+                    handle.username == ucs_user and \
+                    handle.uri.endswith(":{0}".format(port)):
+                if tracer is not None:
+                    trace_handle(handle, tracer)
+                return handle
+
+    if broker_socket:
+        frozen = get_broker_session(broker_socket, ucsm, ucs_user,
+                                    ucs_password, port, secure)
+        if frozen:
+            # the broker owns this session, so never log it out here
+            handle = _own_tx_lock(UcsHandle.unfreeze(frozen))
+            if params.get('pool_size'):
+                use_pooled_driver(handle, params)
+            if tracer is not None:
+                trace_handle(handle, tracer)
+            cache = get_mo_cache(handle, params.get('mo_cache_ttl'))
+            cache.broker = (broker_socket, dict(
+                hostname=ucsm, username=ucs_user, password=ucs_password,
+                port=port))
+            with HANDLE_LOCK:
+                HANDLE_LIST.append(handle)
+            return handle
+
+    handle = _own_tx_lock(UcsHandle(ucsm, ucs_user, ucs_password,
+                                    secure=bool(secure), port=port,
+                                    timeout=params.get('domain_timeout')))
+    if params.get('pool_size'):
+        use_pooled_driver(handle, params)
+    if tracer is not None:
+        trace_handle(handle, tracer)
+    with trace_span(handle, "ucs.login", domain=ucsm):
         handle.login()
+    get_mo_cache(handle, params.get('mo_cache_ttl'))
+    with HANDLE_LOCK:
         HANDLE_LIST.append(handle)
-    except Exception as handle_exception:
-        module.fail_json(msg=handle_exception)
+    atexit.register(_logout_quietly, handle)
 
     return handle
 
+def get_handle(module, tracer=None):
+    """get a handle by parsing the modules params, if the handle is already
+       open, then give the caller that handle, else try and open a new one
+       let the module handle any login failures"""
+
+    try:
+        return open_handle(module.params, tracer)
+    except Exception as handle_exception:
+        module.fail_json(msg=str(handle_exception))
+
+def _load_inventory(path):
+    """read a domain inventory: json or yaml holding a list (or a dict with
+       a domains list), or plain text with one hostname per line"""
+
+    with open(path) as inventory_file:
+        content = inventory_file.read()
+
+    try:
+        domains = json.loads(content)
+    except ValueError:
+        import yaml
+        domains = yaml.safe_load(content)
+
+    if isinstance(domains, dict):
+        domains = domains.get('domains', [])
+    if isinstance(domains, str):
+        domains = domains.split()
+    return domains or []
+
+def get_domains(params):
+    """the connection params of every ucs domain the task targets, an empty
+       list when the task only targets hostname"""
+
+    entries = list(params.get('hostnames') or [])
+    if params.get('ucs_inventory'):
+        entries.extend(_load_inventory(params['ucs_inventory']))
+
+    domains = []
+    for entry in entries:
+        domain = dict(params)
+        if isinstance(entry, dict):
+            domain.update(entry)
+        elif ':' in str(entry):
+            domain['hostname'], domain['port'] = str(entry).rsplit(':', 1)
+        else:
+            domain['hostname'] = str(entry)
+        domain['port'] = int(domain['port'])
+        domains.append(domain)
+
+    return domains
+
+def domain_dir(dest, params):
+    """the directory below dest that ucs_snapshot exports a domain to"""
+
+    name = params['hostname']
+    if int(params['port']) not in (80, 443):
+        name = "{0}_{1}".format(name, params['port'])
+    return os.path.join(dest, re.sub(r'[^A-Za-z0-9_.-]', '_', name))
+
+def _domain_name(domain):
+    if int(domain['port']) in (80, 443):
+        return domain['hostname']
+    return "{0}:{1}".format(domain['hostname'], domain['port'])
+
+def run_on_domains(module, func):
+    """run func(handle, params) against the task's ucs domain, or against
+       every domain in hostnames/ucs_inventory concurrently on at most
+       max_workers threads.  A domain that fails or runs past
+       domain_timeout only fails its own entry in the per-domain results.
+       params carries check_mode, func passes params on to commit_changes;
+       a CommitError fails the result, with the chunks committed before it
+       as commits.
+       With ucs_timing set each result carries the round trips its domain
+       made under ucs_timing, with trace_file they are written there."""
+
+    params = dict(module.params, check_mode=module.check_mode)
+    domains = get_domains(params)
+    tracing = params.get('ucs_timing') or params.get('trace_file')
+    trace_id = _span_id(16)
+    tracers = []
+
+    def traced(handle_params, name, open_func):
+        tracer = None
+        if tracing:
+            tracer = Tracer(trace_id)
+            tracers.append(tracer)
+        handle = open_func(tracer)
+        with trace_span(handle, "ucs.task", domain=name):
+            try:
+                result = func(handle, handle_params)
+            except CommitError as commit_exception:
+                # the chunks before the failing one did commit
+                result = dict(changed=bool(commit_exception.chunks),
+                              failed=True, msg=str(commit_exception),
+                              commits=commit_exception.chunks)
+        if tracer is not None and params.get('ucs_timing'):
+            result['ucs_timing'] = tracer.summary()
+        return result
+
+    if not domains:
+        try:
+            return traced(params, params['hostname'],
+                          lambda tracer: get_handle(module, tracer))
+        except Exception as domain_exception:
+            # fail the way one of many domains does
+            return dict(changed=False, failed=True,
+                        msg=str(domain_exception))
+        finally:
+            if params.get('trace_file') and tracers:
+                write_trace(params['trace_file'], tracers,
+                            **{"ucs.module": getattr(module, "_name", None)})
+
+    timeout = module.params['domain_timeout']
+    results = {}
+    lock = threading.Lock()
+    pending = list(domains)
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                domain = pending.pop(0)
+            name = _domain_name(domain)
+            start = time.time()
+            try:
+                result = traced(domain, name,
+                                lambda tracer: open_handle(domain, tracer))
+            except Exception as domain_exception:
+                result = dict(changed=False, failed=True,
+                              msg=str(domain_exception))
+            result['elapsed'] = round(time.time() - start, 3)
+            with lock:
+                results[name] = result
+
+    # daemon threads, so a domain that hangs cannot keep the task alive
+    workers = []
+    for _ in range(min(module.params['max_workers'], len(domains))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+
+    deadline = time.time() + timeout
+    for thread in workers:
+        thread.join(max(0, deadline - time.time()))
+
+    with lock:
+        pending[:] = []
+        for domain in domains:
+            results.setdefault(_domain_name(domain), dict(
+                changed=False, failed=True,
+                msg="timed out after {0}s".format(timeout)))
+        results = dict(results)
+
+    if params.get('trace_file') and tracers:
+        write_trace(params['trace_file'], list(tracers),
+                    **{"ucs.module": getattr(module, "_name", None)})
+
+    failed = sorted(name for name, result in results.items()
+                    if result.get('failed'))
+    ret_val = dict(changed=any(result.get('changed')
+                               for result in results.values()),
+                   domains=results)
+    if failed:
+        ret_val.update(failed=True,
+                       msg="{0} of {1} domains failed: {2}".format(
+                           len(failed), len(results), ", ".join(failed)))
+    return ret_val
+
 def get_ucs_argument_spec(**kwargs):
     """Get the base argument spec for connecting to ucsm"""
 
@@ -41,6 +806,16 @@ def get_ucs_argument_spec(**kwargs):
     ucsm_password = os.environ.get("UCSM_PASSWORD", "password")
     ucsm_port = os.environ.get("UCSM_PORT", 443)
     ucsm_secure = os.environ.get("UCSM_SECURE", "true")
+    ucsm_broker = os.environ.get("UCS_BROKER_SOCKET")
+    ucsm_org_cache_ttl = ORG_CACHE_TTL
+    ucsm_mo_cache_ttl = MO_CACHE_TTL
+    ucsm_pool_size = POOL_SIZE
+    ucsm_commit_chunk_size = COMMIT_CHUNK_SIZE
+    ucsm_commit_retries = COMMIT_RETRIES
+    ucsm_commit_backoff = COMMIT_BACKOFF
+    ucsm_concurrency = CONCURRENCY
+    ucsm_timing = UCS_TIMING
+    ucsm_trace_file = TRACE_FILE
 
 
     spec = dict(
@@ -54,7 +829,8 @@ def get_ucs_argument_spec(**kwargs):
         ),
         password=dict(
             type="str",
-            default=ucsm_password
+            default=ucsm_password,
+            no_log=True
         ),
         port=dict(
             required=False,
@@ -66,19 +842,958 @@ def get_ucs_argument_spec(**kwargs):
             type="bool",
             default=ucsm_secure
         ),
+        broker_socket=dict(
+            required=False,
+            type="path",
+            default=ucsm_broker
+        ),
+        org_cache_ttl=dict(
+            required=False,
+            type="int",
+            default=ucsm_org_cache_ttl
+        ),
+        mo_cache_ttl=dict(
+            required=False,
+            type="int",
+            default=ucsm_mo_cache_ttl
+        ),
+        hostnames=dict(
+            required=False,
+            type="list"
+        ),
+        ucs_inventory=dict(
+            required=False,
+            type="path"
+        ),
+        max_workers=dict(
+            required=False,
+            type="int",
+            default=8
+        ),
+        domain_timeout=dict(
+            required=False,
+            type="int",
+            default=600
+        ),
+        snapshot=dict(
+            required=False,
+            type="path"
+        ),
+        pool_size=dict(
+            required=False,
+            type="int",
+            default=ucsm_pool_size
+        ),
+        keep_alive=dict(
+            required=False,
+            type="bool",
+            default=True
+        ),
+        tls_resume=dict(
+            required=False,
+            type="bool",
+            default=True
+        ),
+        request_timeout=dict(
+            required=False,
+            type="int"
+        ),
+        commit_chunk_size=dict(
+            required=False,
+            type="int",
+            default=ucsm_commit_chunk_size
+        ),
+        commit_retries=dict(
+            required=False,
+            type="int",
+            default=ucsm_commit_retries
+        ),
+        commit_backoff=dict(
+            required=False,
+            type="float",
+            default=ucsm_commit_backoff
+        ),
+        concurrency=dict(
+            required=False,
+            type="int",
+            default=ucsm_concurrency
+        ),
+        ucs_timing=dict(
+            required=False,
+            type="bool",
+            default=ucsm_timing
+        ),
+        trace_file=dict(
+            required=False,
+            type="path",
+            default=ucsm_trace_file
+        ),
     )
 
     spec.update(kwargs)
     return spec
 
-def get_org(handle, org_name):
-    """check if the org exists and return it if does"""
+def org_dn(org_path):
+    """turn an org path (root/HR/Prod, HR/Prod or root) into its dn"""
 
-    ret_val = None
-    filt_str = '(name , "{0}", type="eq")'.format(org_name)
-    org_list = handle.query_classid(NamingId.ORG_ORG, filter_str=filt_str)
-    for org in org_list:
-        if org.name == org_name:
-            ret_val = org
+    names = [name for name in org_path.split('/') if name]
+    if names and names[0] == "root":
+        names = names[1:]
+    return "/".join(["org-root"] + ["org-" + name for name in names])
 
-    return ret_val
+def _org_cache_file(handle):
+    host = re.sub(r'[^A-Za-z0-9_.-]', '_', str(handle.ip))
+    return os.path.join(ORG_CACHE_DIR, host + ".json")
+
+def load_org_index(handle, cache_ttl=None):
+    """return the cached list of org dns for this ucsm, or None if there is
+       no index younger than cache_ttl seconds"""
+
+    cache_ttl = ORG_CACHE_TTL if cache_ttl is None else cache_ttl
+    if cache_ttl <= 0 or getattr(handle, "offline", False):
+        return None
+
+    try:
+        with open(_org_cache_file(handle)) as cache_file:
+            index = json.load(cache_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if time.time() - index.get('built', 0) > cache_ttl:
+        return None
+    return index.get('orgs')
+
+def save_org_index(handle, org_dns):
+    """write the org index atomically so concurrent tasks never see half"""
+
+    if not os.path.isdir(ORG_CACHE_DIR):
+        os.makedirs(ORG_CACHE_DIR)
+
+    cache_path = _org_cache_file(handle)
+    fd, tmp_path = tempfile.mkstemp(dir=ORG_CACHE_DIR)
+    with os.fdopen(fd, "w") as cache_file:
+        json.dump(dict(built=time.time(), orgs=sorted(org_dns)), cache_file)
+    os.rename(tmp_path, cache_path)
+
+def build_org_index(handle):
+    """read every org dn from ucsm once and cache it on disk"""
+
+    org_dns = [org.dn for org in handle.query_classid("OrgOrg")]
+    if getattr(handle, "offline", False):
+        return org_dns
+    try:
+        save_org_index(handle, org_dns)
+    except (IOError, OSError):
+        pass
+    return org_dns
+
+def _org_from_dn(dn):
+    """build the org mo locally, the dn is all callers need from it"""
+
+    parent_dn, _, rn = dn.rpartition('/')
+    return OrgOrg(parent_mo_or_dn=parent_dn, name=rn[len("org-"):])
+
+def get_org(handle, org_name, cache_ttl=None):
+    """check if the org exists and return it if does
+
+       org_name is either a path (root/HR/Prod) resolved straight to its dn,
+       or a bare org name looked up in the org index.  Both consult the on
+       disk index first so repeated tasks need no round trip at all.  A bare
+       name found in more than one place raises ValueError, use a path."""
+
+    with trace_span(handle, "ucs.get_org", org=org_name):
+        return _get_org(handle, org_name, cache_ttl)
+
+def _get_org(handle, org_name, cache_ttl):
+    org_dns = load_org_index(handle, cache_ttl)
+
+    if '/' in org_name or org_name == "root":
+        dn = org_dn(org_name)
+        if org_dns is not None and dn in org_dns:
+            return _org_from_dn(dn)
+        return cache_query_dn(handle, dn)
+
+    rn = "org-" + org_name
+    matches = []
+    if org_dns is not None:
+        matches = [dn for dn in org_dns if dn.rsplit('/', 1)[-1] == rn]
+    if not matches:
+        # a miss may just mean the cached index predates the org
+        org_dns = build_org_index(handle)
+        matches = [dn for dn in org_dns if dn.rsplit('/', 1)[-1] == rn]
+    if not matches:
+        return None
+    if len(matches) > 1:
+        raise ValueError("org name {0} is ambiguous ({1}), give the full "
+                         "org path instead".format(org_name,
+                                                   ", ".join(matches)))
+    return _org_from_dn(matches[0])
+
+def query_dns_hierarchy(handle, dns):
+    """resolve several dns with all their descendants in one round trip,
+       returns a flat list of managed objects (query_dns has no hierarchy)"""
+
+    if getattr(handle, "offline", False):
+        return handle.query_dns_hierarchy(dns)
+
+    from ucsmsdk.ucsbasetype import DnSet, Dn
+    from ucsmsdk.ucscoreutils import extract_molist_from_method_response
+    from ucsmsdk.ucsexception import UcsException
+    from ucsmsdk.ucsmethodfactory import config_resolve_dns
+
+    dn_set = DnSet()
+    for dn in dns:
+        dn_obj = Dn()
+        dn_obj.value = dn
+        dn_set.child_add(dn_obj)
+
+    elem = config_resolve_dns(cookie=handle.cookie, in_dns=dn_set,
+                              in_hierarchical=True)
+    response = handle.post_elem(elem)
+    if response.error_code != 0:
+        raise UcsException(response.error_code, response.error_descr)
+
+    return extract_molist_from_method_response(response, True)
+
+def parse_mos(source):
+    """yield (class, attrs) for every managed object of a resolve response,
+       a file like object, as it is read.  Each object is dropped once
+       yielded, so memory stays flat however large the response.  attrs
+       always carries the dn."""
+
+    import xml.etree.ElementTree as ET
+    from ucsmsdk.ucsexception import UcsException
+
+    stack = []
+    dns = []
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if not stack and elem.get('errorCode'):
+                raise UcsException(elem.get('errorCode'),
+                                   elem.get('errorDescr'))
+            stack.append(elem)
+            dn = elem.get('dn')
+            if not dn and elem.get('rn') and dns and dns[-1]:
+                dn = dns[-1] + "/" + elem.get('rn')
+            dns.append(dn if len(stack) > 2 else None)
+            if dns[-1]:
+                yield elem.tag, dict(elem.attrib, dn=dns[-1])
+            continue
+        stack.pop()
+        dns.pop()
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+def stream_mos(handle, request):
+    """post a resolve request (an xml string) and parse_mos the response
+       while it is still arriving"""
+
+    response = handle.post_xml(request.encode("utf-8"), read=False)
+    try:
+        for mo in parse_mos(response):
+            yield mo
+    finally:
+        response.close()
+
+def class_request(handle, class_id, filter_xml=""):
+    """a configResolveClass for every object of class_id, optionally
+       narrowed by an inFilter body such as
+       <gt class="aaaModLR" property="id" value="9"/>"""
+
+    from xml.sax.saxutils import quoteattr
+
+    return (
+        '<configResolveClass cookie={0} classId={1} inHierarchical="false">'
+        '<inFilter>{2}</inFilter></configResolveClass>').format(
+            quoteattr(handle.cookie), quoteattr(class_id), filter_xml)
+
+def dns_request(handle, dns, hierarchy=False):
+    """a configResolveDns for several dns, with everything below them when
+       hierarchy is set"""
+
+    from xml.sax.saxutils import quoteattr
+
+    return (
+        '<configResolveDns cookie={0} inHierarchical={1}><inDns>{2}</inDns>'
+        '</configResolveDns>').format(
+            quoteattr(handle.cookie), quoteattr(str(bool(hierarchy)).lower()),
+            "".join('<dn value={0}/>'.format(quoteattr(dn)) for dn in dns))
+
+def stream_class(handle, class_id, filter_xml=""):
+    """stream_mos over every object of class_id"""
+
+    return stream_mos(handle, class_request(handle, class_id, filter_xml))
+
+def stream_dns(handle, dns, hierarchy=False):
+    """stream_mos over several dns, or read them off an offline snapshot"""
+
+    if getattr(handle, "offline", False):
+        return handle.stream_dns(dns, hierarchy)
+    return stream_mos(handle, dns_request(handle, dns, hierarchy))
+
+def post_many(handle, requests, concurrency=None):
+    """post several requests (xml strings) of handle's session at once, at
+       most concurrency (UCS_CONCURRENCY) in flight, returns the response
+       bodies in order.  Without asyncio (python 2) they go one by one."""
+
+    concurrency = concurrency or CONCURRENCY
+    if concurrency > 1 and len(requests) > 1:
+        try:
+            from ucs_async import post_concurrently
+        except (ImportError, SyntaxError):
+            pass
+        else:
+            return post_concurrently(handle, requests, concurrency)
+    return [handle.post_xml(request) for request in requests]
+
+def read_classes(handle, class_ids, concurrency=None, filters=None):
+    """every object of several classes, the classes read concurrently
+       through post_many, yields (class, attrs) as stream_class does.
+       filters maps a class to an inFilter body narrowing it, which a
+       snapshot does not apply."""
+
+    import io
+
+    if getattr(handle, "offline", False):
+        for class_id in class_ids:
+            for mo in handle.stream_class(class_id):
+                yield mo
+        return
+
+    filters = filters or {}
+    bodies = post_many(handle, [class_request(handle, class_id,
+                                              filters.get(class_id, ""))
+                                for class_id in class_ids], concurrency)
+    for body in bodies:
+        for mo in parse_mos(io.BytesIO(body.encode("utf-8"))):
+            yield mo
+
+def diff_props(mo, desired):
+    """return the desired properties whose value differs on mo, properties
+       set to None in desired are not managed and never differ"""
+
+    changed = {}
+    for prop, value in desired.items():
+        if value is None:
+            continue
+        current = getattr(mo, prop, None) if mo is not None else None
+        if current is None or str(current) != str(value):
+            changed[prop] = value
+    return changed
+
+def mo_props(mo, props):
+    """the given properties of mo as a plain dict, for diffs and results"""
+
+    if mo is None:
+        return {}
+    return dict((prop, getattr(mo, prop, None)) for prop in props)
+
+def dry_run(handle, params):
+    """whether changes are only worked out, not committed: in check mode or
+       against an offline snapshot"""
+
+    return bool(params.get('check_mode')) or getattr(handle, "offline", False)
+
+class CommitError(Exception):
+    """a chunk of changes ucsm would not take, chunks holds the report of
+       the chunks committed before it"""
+
+    def __init__(self, msg, chunks):
+        Exception.__init__(self, msg)
+        self.chunks = chunks
+
+def order_changes(changes):
+    """adds parents first and removes children first, so that no change
+       depends on one committed after it"""
+
+    adds = [change for change in changes if change[0] != "remove"]
+    removes = [change for change in changes if change[0] == "remove"]
+    adds.sort(key=lambda change: change[1].dn.count('/'))
+    removes.sort(key=lambda change: -change[1].dn.count('/'))
+    return adds + removes
+
+def chunk_changes(changes, chunk_size):
+    """split changes into lists of at most chunk_size objects, counting the
+       children staged below each, 0 for a single list.  A change is never
+       split, one larger than chunk_size makes a chunk of its own."""
+
+    if not chunk_size:
+        return [changes]
+
+    chunks = []
+    size = 0
+    for change in changes:
+        change_size = len(_mo_tree(change[1]))
+        if chunks and size + change_size <= chunk_size:
+            chunks[-1].append(change)
+            size += change_size
+        else:
+            chunks.append([change])
+            size = change_size
+    return chunks
+
+def is_transient(exception):
+    """whether a failed commit is worth retrying: the connection failed or
+       timed out, or ucsm was too busy to take it"""
+
+    from ucsmsdk.ucsexception import UcsException
+
+    if isinstance(exception, UcsException):
+        return bool(TRANSIENT_RE.search(str(exception.error_descr)))
+    code = getattr(exception, "code", None)
+    if isinstance(code, int):
+        return code >= 500 or code == 429
+    return isinstance(exception, (IOError, OSError))
+
+def conf_mos_request(handle, changes):
+    """a configConfMos (an xml string) pushing the changes in one go and
+       asking for everything they leave behind in the response"""
+
+    from ucsmsdk import ucsxmlcodec as xc
+    from ucsmsdk.ucsbasetype import ConfigMap, Pair
+    from ucsmsdk.ucsmethodfactory import config_conf_mos
+
+    # one pair per dn, the last change to a dn winning as in the sdk buffer
+    staged = OrderedDict()
+    for operation, mo in changes:
+        if operation == "remove":
+            mo.status = "deleted"
+            if mo.parent_mo:
+                mo.parent_mo.child_remove(mo)
+        else:
+            mo.status = "created,modified"
+        staged[mo.dn] = mo
+
+    config_map = ConfigMap()
+    for dn, mo in staged.items():
+        pair = Pair()
+        pair.key = dn
+        pair.child_add(mo)
+        config_map.child_add(pair)
+
+    xml_str = xc.to_xml_str(config_conf_mos(handle.cookie, config_map, True))
+    return xml_str.decode("utf-8") if isinstance(xml_str, bytes) else xml_str
+
+def check_committed(changes, committed):
+    """raise ValueError for a change the configConfMos response, committed
+       as {dn: attrs}, shows did not take"""
+
+    for operation, mo in changes:
+        attrs = committed.get(mo.dn)
+        deleted = attrs is not None and \
+            "deleted" in attrs.get('status', "")
+        if operation == "remove" and attrs is not None and not deleted:
+            raise ValueError("{0} is still present".format(mo.dn))
+        if operation != "remove" and (attrs is None or deleted):
+            raise ValueError("{0} is missing from the commit "
+                             "response".format(mo.dn))
+
+def _commit_chunk(handle, changes, retries, backoff):
+    """commit one chunk, retrying transient failures after an exponential
+       backoff with jitter, returns (attempts, {dn: attrs} of every object
+       the commit left behind, removed ones with status deleted)"""
+
+    dns = []
+    class_ids = set()
+    for operation, mo in changes:
+        if operation == "remove":
+            # the children going with it are unknown, so are their classes
+            class_ids = None
+        for changed in _mo_tree(mo):
+            dns.append(changed.dn)
+            if class_ids is not None:
+                class_ids.add(changed.get_class_id())
+    request = conf_mos_request(handle, changes)
+
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # the response carries the committed objects, so unlike the
+            # sdk's commit() nothing needs resolving again afterwards
+            committed = dict((attrs['dn'], attrs) for _, attrs in
+                             stream_mos(handle, request))
+            return attempt, committed
+        except Exception as commit_exception:
+            if attempt > retries or not is_transient(commit_exception):
+                raise
+        finally:
+            invalidate_mos(handle, dns, class_ids)
+
+        time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+def commit_changes(handle, changes, params=None):
+    """stage a list of ('add', mo) and ('remove', mo) changes and push them
+       to ucsm, doing nothing for an empty list, in check mode or against an
+       offline snapshot.
+
+       Changes go out parents first, in chunks of at most commit_chunk_size
+       objects (0 for a single commit).  A chunk failing transiently is
+       retried up to commit_retries times, waiting commit_backoff seconds
+       doubled on every retry.  Success is read off the configConfMos
+       response, which also carries the attributes of every object the
+       commit left behind, so nothing is queried again.  Returns a report of
+       each chunk committed, with those attributes as mos ({dn: attrs}),
+       raises CommitError carrying that report when a chunk fails."""
+
+    params = params or {}
+    if not changes or dry_run(handle, params):
+        return []
+
+    chunk_size = params.get('commit_chunk_size')
+    retries = params.get('commit_retries')
+    backoff = params.get('commit_backoff')
+    chunks = chunk_changes(order_changes(changes), COMMIT_CHUNK_SIZE
+                           if chunk_size is None else chunk_size)
+
+    report = []
+    for number, chunk in enumerate(chunks):
+        start = time.time()
+        try:
+            with trace_span(handle, "ucs.commit", chunk=number + 1,
+                            chunks=len(chunks)) as span:
+                attempts, committed = _commit_chunk(
+                    handle, chunk,
+                    COMMIT_RETRIES if retries is None else retries,
+                    COMMIT_BACKOFF if backoff is None else backoff)
+                check_committed(chunk, committed)
+                if span is not None:
+                    span['attrs']['attempts'] = attempts
+        except Exception as commit_exception:
+            raise CommitError("commit of chunk {0} of {1} failed, {2} "
+                              "committed before it: {3}".format(
+                                  number + 1, len(chunks), len(report),
+                                  commit_exception), report)
+        report.append(dict(objects=sum(len(_mo_tree(mo)) for _, mo in chunk),
+                           attempts=attempts,
+                           seconds=round(time.time() - start, 3),
+                           mos=committed))
+    return report
+
+def _mo_tree(mo):
+    """mo followed by all the children staged below it"""
+
+    mos = [mo]
+    for child in mo.child:
+        mos.extend(_mo_tree(child))
+    return mos
+
+def _mo_xml(mo):
+    """one managed object as xml, without its children"""
+
+    from ucsmsdk import ucsxmlcodec as xc
+
+    elem = mo.to_xml()
+    for child in list(elem):
+        elem.remove(child)
+    xml_str = xc.to_xml_str(elem)
+    return xml_str.decode("utf-8") if isinstance(xml_str, bytes) else xml_str
+
+def _class_key(class_id):
+    return "class:" + class_id[0].lower() + class_id[1:]
+
+def _covers(key, dns, class_keys):
+    """whether a change to dns (and class_keys, None for any class) makes
+       the cache entry key stale"""
+
+    kind, _, name = key.partition(":")
+    if kind == "class":
+        return class_keys is None or key in class_keys
+    if kind == "tree":
+        return any(name == dn or dn.startswith(name + "/") or
+                   name.startswith(dn + "/") for dn in dns)
+    return any(name == dn or name.startswith(dn + "/") for dn in dns)
+
+class MoCache(object):
+    """managed objects read from one ucsm, as xml, least recently used
+       first out once they take more than max_bytes.
+
+       Entries are keyed dn:<dn>, tree:<dn> (the dn and everything below)
+       or class:<classId>.  An entry is fresh for ttl seconds, or for as
+       long as the ucsm event channel has been watched since it was read;
+       changes seen on the channel or committed through commit_changes
+       drop the entries they touch.  A read that started before a change
+       to its objects is never stored."""
+
+    def __init__(self, ttl=MO_CACHE_TTL, max_bytes=MO_CACHE_BYTES,
+                 history=1000):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.history = history
+        self.entries = OrderedDict()
+        self.size = 0
+        self.watching_since = None
+        self.changes = []
+        self.floor = 0
+        self.broker = None
+        self.lock = threading.RLock()
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def _fresh(self, read_at, now):
+        if self.watching_since is not None and \
+                read_at >= self.watching_since:
+            return True
+        return now - read_at <= self.ttl
+
+    def _changed_since(self, key, read_at):
+        if read_at < self.floor:
+            return True
+        for when, dns, class_keys in reversed(self.changes):
+            if when < read_at:
+                break
+            if _covers(key, dns, class_keys):
+                return True
+        return False
+
+    def get(self, keys):
+        """the fresh entries among keys, as {key: [xml]}"""
+
+        now = time.time()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if not self._fresh(entry[0], now):
+                    self._drop(key)
+                    continue
+                # reinsert to mark it most recently used
+                self.entries[key] = self.entries.pop(key)
+                found[key] = entry[1]
+        return found
+
+    def put(self, key, read_at, xmls):
+        """store the objects of key as read from ucsm at read_at"""
+
+        size = len(key) + sum(len(xml) for xml in xmls)
+        with self.lock:
+            if size > self.max_bytes or self._changed_since(key, read_at):
+                return False
+            self._drop(key)
+            self.entries[key] = (read_at, list(xmls), size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+        return True
+
+    def invalidate(self, dns, class_ids=None):
+        """drop the entries a change to dns touches, and the class entries
+           of class_ids or of every class when class_ids is None"""
+
+        class_keys = None
+        if class_ids is not None:
+            class_keys = set(_class_key(class_id) for class_id in class_ids)
+        with self.lock:
+            self.changes.append((time.time(), list(dns), class_keys))
+            if len(self.changes) > self.history:
+                self.floor = self.changes.pop(0)[0]
+            for key in [key for key in self.entries
+                        if _covers(key, dns, class_keys)]:
+                self._drop(key)
+
+    def watching(self, active):
+        """record whether the ucsm event channel is being followed"""
+
+        with self.lock:
+            self.watching_since = time.time() if active else None
+
+def get_mo_cache(handle, cache_ttl=None):
+    """the MoCache of handle, made on first use"""
+
+    cache = getattr(handle, "mo_cache", None)
+    if cache is None:
+        cache = MoCache(ttl=MO_CACHE_TTL if cache_ttl is None else cache_ttl)
+        handle.mo_cache = cache
+    return cache
+
+def _cached(handle, keys, fetch):
+    """look keys up in the handle's cache, then in the session broker's,
+       and fetch whatever is left from ucsm with one call.  fetch(missing)
+       returns {key: [mo]}.  Returns {key: [mo]} for every key."""
+
+    from ucsmsdk import ucsxmlcodec as xc
+
+    cache = get_mo_cache(handle)
+    if cache.ttl <= 0:
+        return fetch(keys)
+
+    found = cache.get(keys)
+    missing = [key for key in keys if key not in found]
+
+    if missing and cache.broker:
+        reply = _broker_call(cache.broker[0], dict(
+            cache.broker[1], op="cache_get", keys=missing))
+        if reply and reply.get('ok'):
+            now = time.time()
+            for key, xmls in reply['entries'].items():
+                cache.put(key, now, xmls)
+                found[key] = xmls
+            missing = [key for key in missing if key not in found]
+
+    result = dict((key, [xc.from_xml_str(xml) for xml in xmls])
+                  for key, xmls in found.items())
+    if not missing:
+        return result
+
+    read_at = time.time()
+    fetched = fetch(missing)
+    stored = []
+    for key in missing:
+        xmls = [_mo_xml(mo) for mo in fetched[key]]
+        if cache.put(key, read_at, xmls):
+            stored.append([key, read_at, xmls])
+    if stored and cache.broker:
+        _broker_call(cache.broker[0], dict(cache.broker[1], op="cache_put",
+                                           entries=stored))
+
+    result.update(fetched)
+    return result
+
+def invalidate_mos(handle, dns, class_ids=None):
+    """tell the handle's cache, and the broker's, that dns changed"""
+
+    cache = get_mo_cache(handle)
+    cache.invalidate(dns, class_ids)
+    if cache.broker:
+        _broker_call(cache.broker[0], dict(
+            cache.broker[1], op="cache_invalidate", dns=list(dns),
+            class_ids=None if class_ids is None else list(class_ids)))
+
+def cache_query_dns(handle, dns):
+    """query_dns through the cache, the misses resolved in one round trip,
+       returns {dn: mo or None}"""
+
+    def fetch(keys):
+        mos = handle.query_dns([key[len("dn:"):] for key in keys])
+        return dict((key, [mo for mo in [mos.get(key[len("dn:"):])]
+                           if mo is not None]) for key in keys)
+
+    found = _cached(handle, ["dn:" + dn for dn in dns], fetch)
+    return dict((dn, (found["dn:" + dn] or [None])[0]) for dn in dns)
+
+def cache_query_dns_hierarchy(handle, dns):
+    """query_dns_hierarchy through the cache, the misses resolved in one
+       round trip, returns a flat list of managed objects"""
+
+    def fetch(keys):
+        tree_dns = [key[len("tree:"):] for key in keys]
+        mos = query_dns_hierarchy(handle, tree_dns)
+        return dict(("tree:" + dn, [mo for mo in mos if mo.dn == dn or
+                                    mo.dn.startswith(dn + "/")])
+                    for dn in tree_dns)
+
+    found = _cached(handle, ["tree:" + dn for dn in dns], fetch)
+    return [mo for dn in dns for mo in found["tree:" + dn]]
+
+def cache_query_dn(handle, dn, hierarchy=False):
+    """query_dn through the cache"""
+
+    if hierarchy:
+        return cache_query_dns_hierarchy(handle, [dn])
+    return cache_query_dns(handle, [dn])[dn]
+
+def cache_query_classids(handle, class_ids):
+    """query_classids through the cache, the misses resolved in one round
+       trip, returns {class_id: [mo]}"""
+
+    by_key = dict((_class_key(class_id), class_id) for class_id in class_ids)
+
+    def fetch(keys):
+        mos = handle.query_classids([by_key[key] for key in keys])
+        found = dict((_class_key(class_id), found_mos)
+                     for class_id, found_mos in mos.items())
+        return dict((key, found.get(key, [])) for key in keys)
+
+    found = _cached(handle, list(by_key), fetch)
+    return dict((class_id, found[_class_key(class_id)])
+                for class_id in class_ids)
+
+def cache_query_classid(handle, class_id):
+    """query_classid through the cache"""
+
+    return cache_query_classids(handle, [class_id])[class_id]
+
+class SnapshotHandle(object):
+    """answers the queries the modules make from a ucsm backup xml file, a
+       ucs_snapshot export directory or objects added one by one, instead
+       of a live session, so tasks can be checked offline.
+
+       The backup nests managed objects the way ucsm does, each naming
+       itself with rn (or dn) below its parent.  Objects are kept as
+       (class, attributes) indexed by dn, parent and class, and only built
+       into mos when queried.  There is no session, and commit_changes
+       never commits against it."""
+
+    offline = True
+
+    def __init__(self, path=None, name=None):
+        self.path = path
+        self.ip = self.name = name or path
+        self.username = None
+        self.uri = "file://{0}".format(path or name)
+        self.cookie = None
+        self.mos = OrderedDict()
+        self.built = {}
+        self.children = {}
+        self.classes = {}
+        self.mo_cache = MoCache(ttl=0)
+
+        if path and os.path.isdir(path):
+            self._load_export(path)
+        elif path:
+            import xml.etree.ElementTree as ET
+            self._index(ET.parse(path).getroot(), "")
+
+    def add(self, class_id, attrs, parent_dn=None):
+        """index one object, attrs carrying its dn"""
+
+        dn = attrs['dn']
+        if parent_dn is None:
+            parent_dn = dn.rsplit('/', 1)[0] if '/' in dn else ""
+        if dn not in self.mos:
+            self.children.setdefault(parent_dn, []).append(dn)
+            self.classes.setdefault(class_id.lower(), []).append(dn)
+        self.mos[dn] = (class_id, attrs)
+        self.built.pop(dn, None)
+
+    def _load_export(self, path):
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.endswith(".jsonl"):
+                continue
+            class_id = file_name[:-len(".jsonl")]
+            with open(os.path.join(path, file_name)) as export_file:
+                for line in export_file:
+                    entry = json.loads(line)
+                    self.add(class_id, dict(entry['attrs'], dn=entry['dn']))
+
+    def _index(self, elem, parent_dn):
+        dn = elem.get('dn')
+        if not dn and elem.get('rn'):
+            dn = parent_dn + "/" + elem.get('rn') if parent_dn \
+                else elem.get('rn')
+        if dn:
+            attrs = dict(elem.attrib, dn=dn)
+            attrs.pop('rn', None)
+            self.add(elem.tag, attrs, parent_dn)
+        for child in elem:
+            self._index(child, dn or parent_dn)
+
+    def _mo(self, dn):
+        import xml.etree.ElementTree as ET
+        from ucsmsdk.ucscoreutils import get_ucs_obj
+        from ucsmsdk.ucsgenutils import word_u
+
+        if dn not in self.built:
+            tag, attrs = self.mos[dn]
+            elem = ET.Element(tag, attrs)
+            mo = get_ucs_obj(word_u(tag), elem)
+            mo.from_xml(elem)
+            self.built[dn] = mo
+        return self.built[dn]
+
+    def _tree(self, dn):
+        dns = [dn]
+        for child_dn in self.children.get(dn, []):
+            dns.extend(self._tree(child_dn))
+        return dns
+
+    def _class_dns(self, class_id, filter_str):
+        if filter_str:
+            raise ValueError("filters are not supported against a snapshot")
+        return self.classes.get(class_id.lower(), [])
+
+    def stream_class(self, class_id):
+        """(class, attrs) of every object of class_id, as ucs.stream_class
+           yields them"""
+
+        for dn in self._class_dns(class_id, None):
+            tag, attrs = self.mos[dn]
+            yield tag, attrs
+
+    def stream_dns(self, dns, hierarchy=False):
+        """(class, attrs) of the dns, and with hierarchy of everything below
+           them, as ucs.stream_dns yields them"""
+
+        for dn in dns:
+            if dn not in self.mos:
+                continue
+            for found in self._tree(dn) if hierarchy else [dn]:
+                tag, attrs = self.mos[found]
+                yield tag, attrs
+
+    def login(self, *args, **kwargs):
+        return True
+
+    def logout(self, *args, **kwargs):
+        return True
+
+    def query_dn(self, dn, hierarchy=False, **kwargs):
+        if hierarchy:
+            return self.query_dns_hierarchy([dn])
+        return self._mo(dn) if dn in self.mos else None
+
+    def query_dns(self, *dns):
+        flat = []
+        for dn in dns:
+            flat.extend(dn if isinstance(dn, (list, tuple, set)) else [dn])
+        return dict((dn, self._mo(dn) if dn in self.mos else None)
+                    for dn in flat)
+
+    def query_dns_hierarchy(self, dns):
+        return [self._mo(found) for dn in dns if dn in self.mos
+                for found in self._tree(dn)]
+
+    def query_classid(self, class_id=None, filter_str=None, hierarchy=False,
+                      **kwargs):
+        dns = self._class_dns(class_id, filter_str)
+        if hierarchy:
+            return self.query_dns_hierarchy(dns)
+        return [self._mo(dn) for dn in dns]
+
+    def query_classids(self, *class_ids):
+        flat = []
+        for class_id in class_ids:
+            flat.extend(class_id if isinstance(class_id, (list, tuple, set))
+                        else [class_id])
+        return dict((class_id, self.query_classid(class_id))
+                    for class_id in flat)
+
+    def query_children(self, in_mo=None, in_dn=None, class_id=None,
+                       filter_str=None, hierarchy=False, **kwargs):
+        parent_dn = in_mo.dn if in_mo is not None else in_dn
+        dns = self.children.get(parent_dn, [])
+        if class_id:
+            dns = [dn for dn in dns if dn in set(self._class_dns(class_id,
+                                                                 filter_str))]
+        if hierarchy:
+            return self.query_dns_hierarchy(dns)
+        return [self._mo(dn) for dn in dns]
+
+    def add_mo(self, mo, modify_present=False):
+        raise ValueError("{0} is an offline snapshot".format(self.path))
+
+    def remove_mo(self, mo):
+        raise ValueError("{0} is an offline snapshot".format(self.path))
+
+    def set_mo(self, mo):
+        raise ValueError("{0} is an offline snapshot".format(self.path))
+
+    def commit(self):
+        raise ValueError("{0} is an offline snapshot".format(self.path))
+
+SNAPSHOTS = {}
+
+def open_snapshot(path):
+    """the SnapshotHandle of a backup file, parsed once per process"""
+
+    path = os.path.abspath(path)
+    with HANDLE_LOCK:
+        if path not in SNAPSHOTS:
+            SNAPSHOTS[path] = SnapshotHandle(path)
+        return SNAPSHOTS[path]
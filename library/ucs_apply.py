@@ -0,0 +1,328 @@
+#!/usr/bin/python
+
+from ip_pool import IppoolPool, build_ip_pool, desired_blocks
+from ucs_lan_conn import build_vcon
+from ucs_san_conn import build_san_con
+from ucs_service_profile_template import build_sp_template
+from ucs_vsan_assign import build_port_assignment, query_vsan_ports
+
+DOCUMENTATION = '''
+---
+module: ucs_apply
+short_description: Apply many ucs objects in one transaction
+author:  "Kyle Jones (@excilsploft)"
+version_added: "<version_tag>"
+description:
+    - Converge a list of heterogeneous ucs objects (lan and san connection
+      policies, vsan port assignments, ip pools and service profile
+      templates) with a single login, a single lookup per parent org or vsan
+      and a single commit.  Each object is diffed
+      with the builder of its own module, so the result matches running
+      the modules one by one.
+notes:
+    - Objects are planned and committed pools first, then policies, then
+      service profile templates, and a template may name a pool or policy
+      created in the same batch.  Results keep the order of objects.
+    - The blocks of every ip_pool object are checked against those of the
+      other ip_pool objects in the batch as well as against ucsm, an
+      overlap fails each pool involved.
+    - An object missing a required option fails on its own.
+    - Objects whose changes end up in a commit that ucsm rejects are
+      reported as failed, objects in later chunks as skipped.  A commit that
+      fails because ucsm is busy or the connection dropped is retried first
+      (commit_retries, commit_backoff).
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    objects:
+      description:
+        - "a list of object dictionaries, each with a type and the options
+           the module for that type takes
+           type: lan_conn (ucs_lan_conn), san_conn (ucs_san_conn),
+                 vsan_assign (ucs_vsan_assign), ip_pool (ucs_ip_pool) or
+                 sp_template (ucs_service_profile_template)"
+      required: true
+      default: None
+    chunk_size:
+      description:
+        - "commit after this many changed objects instead of all at once,
+           0 commits everything in one transaction"
+      required: false
+      default: 0
+'''
+
+EXAMPLES = '''
+# Build the exchange tenant in one commit
+- ucs_apply:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    objects:
+      - type: lan_conn
+        org_name: root/exchange
+        lan_con_name: exchange
+        vnics:
+          - name: nic1
+            order: 1
+            templ: exchange_a
+            policy: Windows
+      - type: san_conn
+        org_name: root/exchange
+        san_con_name: exchange
+        wwnn_pool: exchange_fc_pool
+        hbas:
+          - name: hba1
+            order: 1
+            templ: exchange_a
+            policy: Windows
+      - type: vsan_assign
+        vsan_id: 1020
+        switch_id: A
+        ports:
+          - 4/13
+          - 4/14
+      - type: ip_pool
+        org_name: root/exchange
+        ip_pool_name: exchange_mgmt
+        ip_v4_pool_block:
+          - name: first
+            starting_address: 10.20.0.10
+            number_of_ip: 100
+            subnet_mask: 255.255.255.0
+            default_route: 10.20.0.1
+      - type: sp_template
+        org_name: root/exchange
+        service_profile_name: exchange
+        management_ip: exchange_mgmt
+        lan_con_policy: exchange
+        san_con_policy: exchange
+'''
+
+
+def org_parent(handle, params):
+    """resolve the org an object lives in"""
+
+    return get_org(handle, params['org_name'], params.get('org_cache_ttl'))
+
+
+def switch_ids(params):
+    """switch_id as a list, it may be given as A, "A,B" or [A, B]"""
+
+    if isinstance(params['switch_id'], list):
+        return params['switch_id']
+    return [switch_id.strip() for switch_id in
+            str(params['switch_id']).split(',')]
+
+
+def vsan_parent(handle, params):
+    """resolve the vsan a port assignment lives in, on every fabric"""
+
+    return query_vsan_ports(handle, params['vsan_id'], switch_ids(params))
+
+
+# type: dependency level, pools before policies before the templates naming
+# them
+LEVELS = dict(ip_pool=0, lan_conn=1, san_conn=1, vsan_assign=1,
+              sp_template=2)
+
+# type: the policy class a template names an object of that type by
+POLICY_CLASSES = dict(ip_pool="IppoolPool", lan_conn="VnicLanConnPolicy",
+                      san_conn="VnicSanConnPolicy")
+
+# type: (builder, parent resolver, parent cache key, object name, defaults)
+OBJECT_TYPES = dict(
+    lan_conn=(build_vcon, org_parent,
+              lambda params: ("org", params['org_name']),
+              lambda params: params['lan_con_name'],
+              dict(lan_con_descr=None, vnics=None)),
+    san_conn=(build_san_con, org_parent,
+              lambda params: ("org", params['org_name']),
+              lambda params: params['san_con_name'],
+              dict(san_con_descr=None, hbas=None)),
+    vsan_assign=(build_port_assignment, vsan_parent,
+                 lambda params: ("vsan", ",".join(switch_ids(params)),
+                                 str(params['vsan_id'])),
+                 lambda params: "{0}/{1}".format(",".join(switch_ids(params)),
+                                                 params['vsan_id']),
+                 dict(ports=None, exclusive=False)),
+    ip_pool=(build_ip_pool, org_parent,
+             lambda params: ("org", params['org_name']),
+             lambda params: params['ip_pool_name'],
+             dict(ip_pool_descr=None, ip_v4_pool_block=None)),
+    sp_template=(build_sp_template, org_parent,
+                 lambda params: ("org", params['org_name']),
+                 lambda params: params['service_profile_name'],
+                 dict(template_descr=None, template_type="updating-template",
+                      uuid=None, bios_policy=None, boot_policy=None,
+                      firmware_policy=None, disk_policy=None,
+                      management_ip=None, maintenance_policy=None,
+                      kvm_policy=None, lan_con_policy=None,
+                      san_con_policy=None)),
+)
+
+
+def resolve(handle, parents, obj_type, obj_params):
+    """the parent of an object, each parent resolved only once, raises
+       ValueError when it is ambiguous or not found"""
+
+    _, resolve_parent, parent_key, _, _ = OBJECT_TYPES[obj_type]
+    key = parent_key(obj_params)
+    if key not in parents:
+        parents[key] = resolve_parent(handle, obj_params)
+    if not parents[key]:
+        raise ValueError("{0} {1} not found".format(key[0],
+                                                    "/".join(key[1:])))
+    return parents[key]
+
+
+def batch_blocks(handle, parents, pools):
+    """{pool dn: [(from, to)]} of the blocks each ip_pool object of a batch
+       wants, for build_ip_pool to check the pools against each other.  A
+       pool with an invalid org or blocks is left out, it fails on its own."""
+
+    batch = {}
+    for obj_params in pools:
+        if obj_params.get('ip_v4_pool_block') is None:
+            continue
+        try:
+            org_obj = resolve(handle, parents, "ip_pool", obj_params)
+            batch[IppoolPool(parent_mo_or_dn=org_obj,
+                             name=obj_params['ip_pool_name']).dn] = \
+                list(desired_blocks(obj_params))
+        except (KeyError, ValueError):
+            continue
+    return batch
+
+
+def plan_objects(handle, params):
+    """diff every object against ucsm, resolving each parent only once and
+       pools and policies before the templates naming them, returns a list
+       of (result, changes) in the order of objects"""
+
+    parents = {}
+    objects = []
+    planned = {}
+    for position, obj in enumerate(params['objects'], 1):
+        obj_type = obj.get('type')
+        if obj_type not in OBJECT_TYPES:
+            planned[position] = (dict(type=obj_type, status="failed",
+                                      msg="unknown object type {0}".format(
+                                          obj_type)), [])
+            continue
+        obj_params = dict(OBJECT_TYPES[obj_type][4])
+        obj_params['org_cache_ttl'] = params.get('org_cache_ttl')
+        obj_params.update(obj)
+        objects.append((position, obj_params))
+    objects.sort(key=lambda item: LEVELS[item[1]['type']])
+
+    batch = batch_blocks(handle, parents, [
+        obj_params for _, obj_params in objects
+        if obj_params['type'] == "ip_pool"])
+    # (parent dn, name) of the pools and policies planned so far, by class,
+    # the templates after them find them as if they were committed
+    policies = {}
+
+    for position, obj_params in objects:
+        obj_type = obj_params['type']
+        builder, _, _, obj_name, _ = OBJECT_TYPES[obj_type]
+        result = dict(type=obj_type)
+        extra = {}
+        if obj_type == "ip_pool":
+            extra['batch'] = batch
+        elif obj_type == "sp_template":
+            extra['planned'] = policies
+        try:
+            result['name'] = obj_name(obj_params)
+            # an ambiguous org name fails only the objects naming it
+            parent = resolve(handle, parents, obj_type, obj_params)
+            changes, diff = builder(handle, parent, obj_params, **extra)
+        except KeyError as key_exception:
+            result.update(status="failed", msg="object {0} has no {1}"
+                          .format(position, key_exception.args[0]))
+            planned[position] = (result, [])
+            continue
+        except ValueError as build_exception:
+            result.update(status="failed", msg=str(build_exception))
+            planned[position] = (result, [])
+            continue
+        if obj_type in POLICY_CLASSES:
+            policies.setdefault(POLICY_CLASSES[obj_type], set()).add(
+                (parent.dn, result['name']))
+        result.update(status="changed" if changes else "unchanged",
+                      diff=diff)
+        planned[position] = (result, changes)
+
+    return [planned[position] for position in sorted(planned)]
+
+
+def apply_objects(handle, params):
+    """plan every object, then push all the changes in as few commits as
+       chunk_size allows"""
+
+    planned = plan_objects(handle, params)
+    # pools and policies go out before the templates naming them
+    pending = sorted([(result, changes) for result, changes in planned
+                      if changes],
+                     key=lambda item: LEVELS[item[0]['type']])
+    chunk_size = params['chunk_size'] or len(pending) or 1
+    # chunk_size already splits by object, one commit per chunk keeps a
+    # failure on the objects that caused it
+    commit_params = dict(params, commit_chunk_size=0)
+
+    commits = []
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        changes = [change for _, object_changes in chunk
+                   for change in object_changes]
+        try:
+            commits.extend(commit_changes(handle, changes, commit_params))
+        except Exception as commit_exception:
+            for result, _ in chunk:
+                result.update(status="failed", msg=str(commit_exception))
+            for result, _ in pending[start + chunk_size:]:
+                result['status'] = "skipped"
+            break
+
+    results = [result for result, _ in planned]
+    failed = [result for result in results if result['status'] == "failed"]
+    ret_val = dict(changed=any(result['status'] == "changed"
+                               for result in results),
+                   results=results, commits=commits)
+    if failed:
+        ret_val.update(failed=True,
+                       msg="{0} of {1} objects failed".format(len(failed),
+                                                             len(results)))
+    return ret_val
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        objects=dict(
+            required=True,
+            type="list"
+        ),
+        chunk_size=dict(
+            required=False,
+            type="int",
+            default=0
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
+
+    result = run_on_domains(module, apply_objects)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
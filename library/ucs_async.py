@@ -0,0 +1,237 @@
+"""Concurrent UCSM requests over one session, on an asyncio event loop.
+
+UcsHandle sends one request at a time and waits for each response before the
+next, so reading dozens of classes or resolving hundreds of dns in separate
+requests costs the sum of their latencies.  AsyncUcsClient posts them over
+the session of a logged in handle at the same time, at most concurrency in
+flight, each on a keep-alive connection of its own taken from a small pool.
+The handle keeps its client between calls, and the client takes the tls
+context, headers, timeout and redirect_uri of the handle's PooledDriver, so
+its connections resume the session's tls session and follow a redirect as
+every other request of the handle does.
+
+The modules do not use this directly but through ucs.post_many, which runs
+the requests to completion and hands back the response bodies, falling back
+to sending them one after another where asyncio is not available:
+
+    bodies = post_many(handle, [request_xml, ...], concurrency=10)
+
+This file needs python 3; ucs.py only imports it from post_many.
+"""
+
+import asyncio
+import atexit
+import ssl
+import threading
+
+from urllib.parse import urlsplit
+
+from ucs import _request_attrs
+
+
+class AsyncUcsClient(object):
+    """posts requests of one ucsm session concurrently on an event loop of
+       its own, kept with its idle connections from one call to the next.
+       Given the handle's PooledDriver the connections take its tls context,
+       resuming the tls session its own connections hold, and its headers,
+       timeout and redirect_uri.  Certificates are not verified, as with
+       ucsmsdk's driver."""
+
+    def __init__(self, uri, driver, tracer=None):
+        self.uri = uri
+        self.driver = driver
+        self.context = getattr(driver, "context", None)
+        if self.context is None and urlsplit(uri).scheme == "https":
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self.timeout = getattr(driver, "timeout", None)
+        self.tracer = tracer
+        self.loop = asyncio.new_event_loop()
+        self.lock = threading.Lock()
+        self.idle = []
+        self.stats = dict(requests=0, connects=0, reused=0)
+
+    def _target(self):
+        """(scheme, host, port, path) requests go to, the driver's
+           redirect_uri once ucsm has sent it elsewhere"""
+
+        parts = urlsplit(getattr(self.driver, "redirect_uri", None) or
+                         self.uri)
+        return (parts.scheme, parts.hostname,
+                parts.port or (443 if parts.scheme == "https" else 80),
+                parts.path or "/")
+
+    async def _connect(self, target):
+        self.stats['connects'] += 1
+        driver_stats = getattr(self.driver, "stats", {})
+        if "connects" in driver_stats:
+            driver_stats['connects'] += 1
+        context = self.context if target[0] == "https" else None
+        reader, writer = await asyncio.open_connection(
+            target[1], target[2], ssl=context)
+        ssl_object = writer.get_extra_info("ssl_object")
+        if ssl_object is not None and ssl_object.session_reused and \
+                hasattr(context, "resumed"):
+            context.resumed += 1
+        return reader, writer, target
+
+    def _remember_session(self, conn):
+        """hand the tls session of conn to later connections, the driver's
+           included"""
+
+        ssl_object = conn[1].get_extra_info("ssl_object")
+        session = getattr(ssl_object, "session", None)
+        if session is not None and hasattr(self.context, "session"):
+            self.context.session = session
+
+    async def _exchange(self, conn, body):
+        """send one request on conn, returns (status, headers, body)"""
+
+        reader, writer, target = conn
+        headers = "".join("{0}: {1}\r\n".format(key, value) for key, value
+                          in getattr(self.driver, "headers", {}).items())
+        writer.write((
+            "POST {0} HTTP/1.1\r\nHost: {1}:{2}\r\n{3}"
+            "Content-Type: application/x-www-form-urlencoded\r\n"
+            "Content-Length: {4}\r\n\r\n").format(
+                target[3], target[1], target[2], headers,
+                len(body)).encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by ucsm")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            headers['connection'] = "close"
+        return status, headers, data
+
+    async def post(self, body, semaphore):
+        """post one request (an xml string) once semaphore lets it, returns
+           the response body"""
+
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        async with semaphore:
+            span = None
+            if self.tracer is not None:
+                span = self.tracer.start("ucs.request", kind="client",
+                                         **_request_attrs(body))
+            try:
+                data = await asyncio.wait_for(self._post(body), self.timeout)
+            except Exception as post_exception:
+                if span is not None:
+                    self.tracer.end(span, error=str(post_exception) or
+                                    type(post_exception).__name__)
+                raise
+            if span is not None:
+                self.tracer.end(span, response_bytes=len(data))
+        return data.decode("utf-8")
+
+    def _acquire(self, target):
+        """an idle connection to target, idle ones to anywhere else closed"""
+
+        while self.idle:
+            conn = self.idle.pop()
+            if conn[2] == target:
+                self.stats['reused'] += 1
+                return conn
+            conn[1].close()
+        return None
+
+    async def _post(self, body):
+        self.stats['requests'] += 1
+        target = self._target()
+        conn = self._acquire(target)
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = await self._connect(target)
+            try:
+                status, headers, data = await self._exchange(conn, body)
+            except (OSError, asyncio.IncompleteReadError):
+                conn[1].close()
+                # an idle connection ucsm has since closed, only ever
+                # retried on a connection that was reused
+                if not reused:
+                    raise
+                conn, reused = None, False
+                continue
+            self._remember_session(conn)
+            if headers.get("connection", "").lower() == "close":
+                conn[1].close()
+            else:
+                self.idle.append(conn)
+            if status not in (301, 302, 307) or "location" not in headers:
+                break
+            # as PooledDriver does, every later request goes there too
+            self.driver.redirect_uri = headers['location']
+            target = self._target()
+            conn, reused = self._acquire(target), False
+
+        if status >= 400:
+            raise IOError("ucsm answered {0} to a request".format(status))
+        return data
+
+    async def _gather(self, bodies, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*[self.post(body, semaphore)
+                                      for body in bodies])
+
+    def gather(self, bodies, concurrency=10):
+        """post every request at once, at most concurrency in flight,
+           returns the response bodies in order, raises the first failure"""
+
+        with self.lock:
+            return self.loop.run_until_complete(
+                self._gather(bodies, concurrency))
+
+    def close(self):
+        """close every idle connection and the event loop"""
+
+        with self.lock:
+            if self.loop.is_closed():
+                return
+            conns, self.idle = self.idle, []
+            for conn in conns:
+                conn[1].close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+
+def post_concurrently(handle, bodies, concurrency=10):
+    """post every request over handle's session, at most concurrency in
+       flight, returns the response bodies in order.  The handle keeps one
+       client, and its connections, for every call."""
+
+    driver = handle._UcsSession__driver
+    client = getattr(handle, "_async_client", None)
+    if client is None or client.driver is not driver:
+        client = AsyncUcsClient(handle.uri + "/nuova", driver)
+        handle._async_client = client
+        atexit.register(client.close)
+    client.tracer = getattr(handle, "tracer", None)
+    return client.gather(bodies, concurrency)
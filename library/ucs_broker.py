@@ -0,0 +1,437 @@
+#!/usr/bin/python
+"""Long lived UCSM session broker for the control node.
+
+Every ansible task runs in a fresh python process, so without help each task
+logs in to UCSM and (since nothing logs out) leaks a session.  Run this once
+per control node:
+
+    python library/ucs_broker.py --socket ~/.ansible/ucs_broker.sock
+
+and point the modules at it with ``broker_socket`` (or UCS_BROKER_SOCKET).
+The broker keeps one authenticated UcsHandle per hostname/username/port,
+refreshes it before UCSM expires it and hands tasks a frozen copy of the
+session instead of a new login.  Idle sessions are logged out.
+
+Each session also carries a managed object cache the modules read through
+(see MoCache in ucs.py), so a play that reads the same org fifty times asks
+UCSM once.  The broker follows the UCSM event channel of every session and
+drops cached objects as soon as UCSM reports them changed; while it does,
+cached objects stay valid past --cache-ttl.
+
+The protocol is one json object per line over a unix socket:
+
+    {"op": "session", "hostname": ..., "username": ..., "password": ...,
+     "port": 443, "secure": true}      -> {"ok": true, "handle": "<frozen>"}
+    {"op": "status"}                   -> {"ok": true, "sessions": [...]}
+    {"op": "logout", "hostname": ..., "username": ..., "password": ...,
+     "port": 443}                      -> {"ok": true}
+    {"op": "shutdown"}                 -> {"ok": true}
+
+and for the cache, with the same hostname/username/password/port fields:
+
+    {"op": "cache_get", "keys": [...]} -> {"ok": true, "entries": {...}}
+    {"op": "cache_put", "entries": [[key, read_at, [xml]], ...]}
+    {"op": "cache_invalidate", "dns": [...], "class_ids": [...] or null}
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from ucsmsdk.ucshandle import UcsHandle
+
+from ucs import MO_CACHE_BYTES, MO_CACHE_TTL, MoCache
+
+
+class EventWatcher(threading.Thread):
+    """follows the event channel of one ucsm session and drops the cache
+       entries of every object it reports changed"""
+
+    def __init__(self, handle, cache):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.handle = handle
+        self.cache = cache
+
+    def run(self):
+        try:
+            stream = self.handle.post_xml(
+                '<eventSubscribe cookie="{0}"/>'.format(
+                    self.handle.cookie).encode("utf-8"), read=False)
+        except Exception:
+            return
+
+        self.cache.watching(True)
+        try:
+            # each event is its length on a line of its own, then the xml
+            while True:
+                length = stream.readline()
+                if not length.strip():
+                    break
+                self.changed(stream.read(int(length)))
+        except Exception:
+            pass
+        finally:
+            self.cache.watching(False)
+            stream.close()
+
+    def changed(self, event):
+        """invalidate the objects one event carries"""
+
+        dns = []
+        class_ids = set()
+        for elem in ET.fromstring(event).iter():
+            if 'dn' not in elem.attrib:
+                continue
+            dns.append(elem.attrib['dn'])
+            if class_ids is not None:
+                class_ids.add(elem.tag)
+            if "deleted" in elem.attrib.get('status', ""):
+                # its children went too, whatever class they were
+                class_ids = None
+        if dns:
+            self.cache.invalidate(dns, class_ids)
+
+
+class Session(object):
+    """an authenticated handle plus the bookkeeping the broker needs"""
+
+    def __init__(self, handle, digest, cache_ttl=MO_CACHE_TTL,
+                 cache_bytes=MO_CACHE_BYTES):
+        self.handle = handle
+        self.digest = digest
+        self.created = time.time()
+        self.last_used = self.created
+        self.lock = threading.Lock()
+        self.cache = MoCache(ttl=cache_ttl, max_bytes=cache_bytes)
+        self.watcher = None
+
+    def watch(self):
+        """(re)start following the event channel unless already doing so"""
+
+        if self.handle is not None and (self.watcher is None or
+                                        not self.watcher.is_alive()):
+            self.watcher = EventWatcher(self.handle, self.cache)
+            self.watcher.start()
+
+
+class SessionBroker(object):
+    """owns the UCSM sessions, keyed by (hostname, username, port)"""
+
+    def __init__(self, idle_timeout=1800, cache_ttl=MO_CACHE_TTL,
+                 cache_bytes=MO_CACHE_BYTES):
+        self.idle_timeout = idle_timeout
+        self.cache_ttl = cache_ttl
+        self.cache_bytes = cache_bytes
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.salt = os.urandom(16)
+
+    def _digest(self, password):
+        return hmac.new(self.salt, password.encode("utf-8"),
+                        hashlib.sha256).hexdigest()
+
+    def _login(self, request):
+        handle = UcsHandle(request['hostname'], request['username'],
+                           request['password'],
+                           secure=bool(request.get('secure', True)),
+                           port=request.get('port'))
+        # auto_refresh makes ucsmsdk send aaaRefresh before the cookie expires
+        handle.login(auto_refresh=True)
+        return handle
+
+    def _key(self, request):
+        return (request['hostname'], request['username'],
+                int(request.get('port') or 443))
+
+    def session(self, request):
+        """return a frozen handle for the requested ucsm, logging in once"""
+
+        key = self._key(request)
+        digest = self._digest(request['password'])
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = Session(None, digest, self.cache_ttl,
+                                  self.cache_bytes)
+                self.sessions[key] = session
+
+        with session.lock:
+            if session.handle is not None and \
+                    not hmac.compare_digest(session.digest, digest):
+                raise ValueError("credentials do not match the brokered "
+                                 "session for {0}".format(key[0]))
+
+            if session.handle is None or not session.handle.cookie:
+                try:
+                    session.handle = self._login(request)
+                except Exception:
+                    with self.lock:
+                        self.sessions.pop(key, None)
+                    raise
+                session.digest = digest
+                session.created = time.time()
+                session.watch()
+
+            session.last_used = time.time()
+            frozen = json.loads(session.handle.freeze())
+
+        # clients must not run their own refresh timers on a shared session
+        frozen['auto_refresh'] = False
+        return json.dumps(frozen)
+
+    def _find(self, request):
+        """the session matching the request's credentials, or None"""
+
+        key = self._key(request)
+        with self.lock:
+            session = self.sessions.get(key)
+        if session is not None and \
+                not hmac.compare_digest(session.digest,
+                                        self._digest(request['password'])):
+            raise ValueError("credentials do not match the brokered "
+                             "session for {0}".format(key[0]))
+        return session
+
+    def logout(self, request):
+        """drop and log out one brokered session"""
+
+        session = self._find(request)
+        if session is None:
+            return
+        with self.lock:
+            self.sessions.pop(self._key(request), None)
+        self._close(session)
+
+    def cache_get(self, request):
+        """the fresh cache entries among the requested keys"""
+
+        session = self._find(request)
+        if session is None:
+            return {}
+        session.last_used = time.time()
+        return session.cache.get(request.get('keys', []))
+
+    def cache_put(self, request):
+        """store entries a task read from ucsm"""
+
+        session = self._find(request)
+        if session is not None:
+            for key, read_at, xmls in request.get('entries', []):
+                session.cache.put(key, read_at, xmls)
+
+    def cache_invalidate(self, request):
+        """drop entries a task changed"""
+
+        session = self._find(request)
+        if session is not None:
+            session.cache.invalidate(request.get('dns', []),
+                                     request.get('class_ids'))
+
+    def status(self):
+        """describe the sessions held, without any secrets"""
+
+        now = time.time()
+        with self.lock:
+            return [dict(hostname=key[0], username=key[1], port=key[2],
+                         age=int(now - session.created),
+                         idle=int(now - session.last_used),
+                         cached_objects=len(session.cache.entries),
+                         cached_bytes=session.cache.size,
+                         watching_events=session.cache.watching_since
+                         is not None)
+                    for key, session in self.sessions.items()]
+
+    def _close(self, session):
+        with session.lock:
+            if session.handle is not None:
+                try:
+                    session.handle.logout()
+                except Exception:
+                    pass
+                session.handle = None
+
+    def reap(self):
+        """log out idle sessions and keep the busy ones alive"""
+
+        now = time.time()
+        with self.lock:
+            idle = [key for key, session in self.sessions.items()
+                    if now - session.last_used > self.idle_timeout]
+            expired = [self.sessions.pop(key) for key in idle]
+            live = list(self.sessions.values())
+
+        for session in expired:
+            self._close(session)
+
+        for session in live:
+            with session.lock:
+                handle = session.handle
+                if handle is None:
+                    continue
+                # cheap round trip that fails once UCSM has dropped the cookie
+                if not handle.is_valid():
+                    try:
+                        handle.login(auto_refresh=True, force=True)
+                    except Exception:
+                        session.handle = None
+                        continue
+                session.watch()
+
+    def close_all(self):
+        """log out of everything, used on shutdown"""
+
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            self._close(session)
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    """one json request per line, one json reply per line"""
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+                op = request.get('op')
+                if op == "session":
+                    reply = dict(ok=True, handle=broker.session(request))
+                elif op == "status":
+                    reply = dict(ok=True, sessions=broker.status())
+                elif op == "logout":
+                    broker.logout(request)
+                    reply = dict(ok=True)
+                elif op == "cache_get":
+                    reply = dict(ok=True, entries=broker.cache_get(request))
+                elif op == "cache_put":
+                    broker.cache_put(request)
+                    reply = dict(ok=True)
+                elif op == "cache_invalidate":
+                    broker.cache_invalidate(request)
+                    reply = dict(ok=True)
+                elif op == "shutdown":
+                    reply = dict(ok=True)
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    reply = dict(ok=False,
+                                 error="unknown op {0}".format(op))
+            except Exception as broker_exception:
+                reply = dict(ok=False, error=str(broker_exception))
+
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """threaded unix socket server carrying a SessionBroker"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, broker):
+        self.broker = broker
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # the socket hands out live sessions, keep it private to this user
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                   BrokerRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+
+def broker_request(socket_path, request):
+    """send a single request to a running broker and return its reply"""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        return json.loads(sock.makefile("r").readline())
+    finally:
+        sock.close()
+
+
+def serve(socket_path, idle_timeout=1800, keepalive=300,
+          cache_ttl=MO_CACHE_TTL, cache_bytes=MO_CACHE_BYTES):
+    """run the broker until it is asked to shut down"""
+
+    broker = SessionBroker(idle_timeout=idle_timeout, cache_ttl=cache_ttl,
+                           cache_bytes=cache_bytes)
+    server = BrokerServer(socket_path, broker)
+    stop = threading.Event()
+
+    def maintain():
+        while not stop.wait(keepalive):
+            broker.reap()
+
+    maintainer = threading.Thread(target=maintain)
+    maintainer.daemon = True
+    maintainer.start()
+
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        server.server_close()
+        broker.close_all()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def main():
+    """command line entry point"""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--socket", default=os.environ.get(
+        "UCS_BROKER_SOCKET",
+        os.path.expanduser("~/.ansible/ucs_broker.sock")))
+    parser.add_argument("--idle-timeout", type=int, default=1800,
+                        help="log out sessions unused for this many seconds")
+    parser.add_argument("--keepalive", type=int, default=300,
+                        help="seconds between session health checks")
+    parser.add_argument("--cache-ttl", type=int, default=MO_CACHE_TTL,
+                        help="seconds cached objects stay valid while the "
+                             "event channel is not being followed")
+    parser.add_argument("--cache-bytes", type=int, default=MO_CACHE_BYTES,
+                        help="memory bound of each session's object cache")
+    parser.add_argument("--status", action="store_true",
+                        help="print the sessions of a running broker")
+    parser.add_argument("--stop", action="store_true",
+                        help="ask a running broker to log out and exit")
+    args = parser.parse_args()
+
+    if args.status or args.stop:
+        op = "status" if args.status else "shutdown"
+        print(json.dumps(broker_request(args.socket, dict(op=op)), indent=2))
+        return
+
+    # log the sessions out on a plain kill as well as on --stop
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    serve(args.socket, idle_timeout=args.idle_timeout,
+          keepalive=args.keepalive, cache_ttl=args.cache_ttl,
+          cache_bytes=args.cache_bytes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+import json
+import time
+
+from ucs_apply import plan_objects
+from ucs_service_profile_template import POLICY_REFS
+
+DOCUMENTATION = '''
+---
+module: ucs_drift
+short_description: Report drift between desired state and ucs
+author:  "Kyle Jones (@excilsploft)"
+version_added: "<version_tag>"
+description:
+    - Compare desired state, written as the objects ucs_apply takes, with
+      what UCS Manager holds and report every object that differs, without
+      changing anything. Each domain's objects are diffed with the builder
+      of their own module, so the report lists what the modules would
+      commit.
+notes:
+    - Against a live ucsm the classes the desired object types need are
+      read once, concurrently, into an index by dn, and every object is
+      compared against that index, so a domain costs a handful of requests
+      however many objects it has.
+    - Set snapshot to a ucs_snapshot dest (or one domain's directory, or a
+      ucsm backup xml) to compare against a snapshot instead.
+    - The task never reports changed; drift is in the drifted counts and the
+      drift list of each domain.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    desired_state:
+      description:
+        - "json or yaml file holding objects, the desired objects of every
+           domain, and/or domains, a dict of domain (hostname or
+           hostname:port) to that domain's own list of objects"
+      required: false
+      default: None
+    objects:
+      description:
+        - "desired objects, in the form ucs_apply takes, for every domain"
+      required: false
+      default: None
+    report:
+      description:
+        - "also write the drift report to this file as json"
+      required: false
+      default: None
+'''
+
+EXAMPLES = '''
+# Nightly drift check of every domain against last night's snapshot
+- ucs_drift:
+    hostnames: "{{ ucs_domains }}"
+    desired_state: /etc/ucs/desired.yml
+    snapshot: /var/lib/ucs/snapshots
+    report: /var/lib/ucs/drift.json
+
+# desired.yml
+objects:
+  - type: lan_conn
+    org_name: root/exchange
+    lan_con_name: exchange
+    vnics:
+      - name: nic1
+        order: 1
+        templ: exchange_a
+        policy: Windows
+domains:
+  ucs-b.example.com:
+    - type: vsan_assign
+      vsan_id: 1020
+      switch_id: [A, B]
+      ports:
+        - 1/1-16
+'''
+
+# classes each object type reads, for a live ucsm read whole through
+# read_classes (post_many) and then parsed into the index
+DRIFT_CLASSES = dict(
+    lan_conn=["vnicLanConnPolicy", "vnicEther"],
+    san_conn=["vnicSanConnPolicy", "vnicFcNode", "vnicFc"],
+    vsan_assign=["fabricVsan", "fabricFcVsanPortEp"],
+    ip_pool=["ippoolPool", "ippoolBlock"],
+    sp_template=["lsServer", "vnicConnDef"] + [
+        class_id[0].lower() + class_id[1:]
+        for _, class_id, _, _ in POLICY_REFS],
+)
+
+
+def load_desired_state(path):
+    """the desired_state file as (objects for every domain, {domain:
+       objects})"""
+
+    with open(path) as state_file:
+        content = state_file.read()
+
+    try:
+        state = json.loads(content)
+    except ValueError:
+        import yaml
+        state = yaml.safe_load(content)
+
+    state = state or {}
+    return state.get('objects') or [], state.get('domains') or {}
+
+
+def domain_objects(params):
+    """every desired object of the domain params point at"""
+
+    objects = list(params.get('objects') or [])
+    if params.get('desired_state'):
+        common, domains = load_desired_state(params['desired_state'])
+        objects.extend(common)
+        port = int(params['port'])
+        for name in (params['hostname'],
+                     "{0}:{1}".format(params['hostname'], port)):
+            objects.extend(domains.get(name) or [])
+    return objects
+
+
+def build_index(handle, objects, concurrency=None):
+    """read the classes the objects need, all at once, into a
+       SnapshotHandle"""
+
+    classes = set(["orgOrg"])
+    for obj in objects:
+        classes.update(DRIFT_CLASSES.get(obj.get('type'), []))
+
+    index = SnapshotHandle(name=handle.name)
+    for tag, attrs in read_classes(handle, sorted(classes), concurrency):
+        index.add(tag, attrs)
+    return index
+
+
+def change_list(changes):
+    """the changes the builders planned, with every staged child, as plain
+       dicts"""
+
+    listed = []
+    pending = [(operation, mo) for operation, mo in changes]
+    while pending:
+        operation, mo = pending.pop(0)
+        entry = dict(op=operation, dn=mo.dn, class_id=mo.get_class_id())
+        if operation == "add":
+            entry['props'] = dict(
+                (prop, getattr(mo, prop)) for prop in mo.prop_meta
+                if prop not in ("dn", "rn", "status") and
+                getattr(mo, prop, None) is not None)
+            pending.extend(("add", child) for child in mo.child)
+        listed.append(entry)
+    return listed
+
+
+def drift(handle, params):
+    """diff the domain's desired objects against the index"""
+
+    start = time.time()
+    objects = domain_objects(params)
+    if not getattr(handle, "offline", False):
+        handle = build_index(handle, objects, params.get('concurrency'))
+
+    planned = plan_objects(handle, dict(params, objects=objects))
+    drifted = []
+    for result, changes in planned:
+        if result['status'] == "unchanged":
+            continue
+        result['status'] = "drifted" if result['status'] == "changed" \
+            else result['status']
+        result['changes'] = change_list(changes)
+        drifted.append(result)
+
+    return dict(changed=False, checked=len(planned), drifted=len(drifted),
+                drift=drifted, seconds=round(time.time() - start, 3))
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        desired_state=dict(
+            required=False,
+            type="path"
+        ),
+        objects=dict(
+            required=False,
+            type="list"
+        ),
+        report=dict(
+            required=False,
+            type="path"
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True,
+                           required_one_of=[["desired_state", "objects"]])
+
+    result = run_on_domains(module, drift)
+
+    if module.params['report']:
+        with open(module.params['report'], "w") as report_file:
+            json.dump(result, report_file, indent=1, sort_keys=True)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
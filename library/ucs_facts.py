@@ -0,0 +1,270 @@
+#!/usr/bin/python
+
+import re
+import time
+
+DOCUMENTATION = '''
+---
+module: ucs_facts
+short_description: Gather ucs server inventory as facts
+author:  "Chris Dunlap (@stoffee)"
+version_added: "<version_tag>"
+description:
+    - Collect the blades, rack units, chassis, fabric interconnects,
+      adapters, memory, cpus and firmware of a UCS domain as facts under
+      ucs. Every class is read with a single query for the whole domain,
+      the queries running concurrently, and the parts are joined to the
+      server, chassis or fabric interconnect they belong to by dn.
+notes:
+    - Adapters, memory, cpus and firmware are gathered for the servers of
+      the chosen subsets; when neither blades nor rack_units is chosen both
+      are gathered.
+    - Memory lists only equipped dimms, as a count and a total capacity, and
+      the cpus subset lists the equipped sockets of a server as processors.
+    - Firmware is a dict of the running version of each component, keyed by
+      its dn below the server, chassis or fabric interconnect.
+    - With several domains the facts are under ucs_domains, keyed by domain.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    gather_subset:
+      description:
+        - "what to gather: all, blades, rack_units, chassis,
+           fabric_interconnects, adapters, memory, cpus and firmware, each
+           of which can be left out of all with a leading !"
+      required: false
+      default: all
+'''
+
+EXAMPLES = '''
+# Everything
+- ucs_facts:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+
+# Blades with their adapters and firmware, from every domain
+- ucs_facts:
+    hostnames: "{{ ucs_domains }}"
+    username: admin
+    password: admin
+    gather_subset:
+      - blades
+      - adapters
+      - firmware
+
+- debug:
+    msg: "{{ ucs.servers | selectattr('association', 'ne', 'associated')
+             | map(attribute='dn') | list }}"
+'''
+
+# subset: (class, {wire attribute: fact name})
+SUBSETS = dict(
+    blades=("computeBlade", dict(
+        chassisId="chassis_id", slotId="slot_id", model="model",
+        serial="serial", vendor="vendor", uuid="uuid",
+        totalMemory="memory_mb", numOfCpus="cpus", numOfCores="cores",
+        operState="oper_state", operPower="power",
+        association="association", assignedToDn="service_profile")),
+    rack_units=("computeRackUnit", dict(
+        id="id", model="model", serial="serial", vendor="vendor",
+        uuid="uuid", totalMemory="memory_mb", numOfCpus="cpus",
+        numOfCores="cores", operState="oper_state", operPower="power",
+        association="association", assignedToDn="service_profile")),
+    chassis=("equipmentChassis", dict(
+        id="id", model="model", serial="serial", vendor="vendor",
+        operState="oper_state", power="power")),
+    fabric_interconnects=("networkElement", dict(
+        id="id", model="model", serial="serial", vendor="vendor",
+        oobIfIp="oob_ip", operability="operability")),
+    adapters=("adaptorUnit", dict(
+        id="id", model="model", serial="serial", vendor="vendor",
+        operState="oper_state")),
+    memory=("memoryUnit", dict(capacity="capacity", presence="presence")),
+    cpus=("processorUnit", dict(
+        socketDesignation="socket", model="model", cores="cores",
+        speed="speed", presence="presence")),
+    firmware=("firmwareRunning", dict(version="version")),
+)
+
+# cpus is already the count of cpus on a server
+PART_KEYS = dict(cpus="processors")
+
+SERVER_SUBSETS = ("blades", "rack_units")
+OWNER_SUBSETS = SERVER_SUBSETS + ("chassis", "fabric_interconnects")
+NUMERIC_RE = re.compile(r"^\d+$")
+
+
+def chosen_subsets(gather_subset):
+    """the subsets gather_subset asks for, raises ValueError for unknown
+       ones"""
+
+    chosen = set()
+    excluded = set()
+    for subset in gather_subset or ["all"]:
+        name = subset.lstrip("!")
+        if name != "all" and name not in SUBSETS:
+            raise ValueError("unknown gather_subset {0}, expected all or "
+                             "one of {1}".format(subset,
+                                                 ", ".join(sorted(SUBSETS))))
+        names = set(SUBSETS) if name == "all" else set([name])
+        if subset.startswith("!"):
+            excluded.update(names)
+        else:
+            chosen.update(names)
+
+    if not chosen and excluded:
+        chosen = set(SUBSETS)
+    chosen -= excluded
+    if chosen - set(OWNER_SUBSETS) and not chosen & set(SERVER_SUBSETS):
+        chosen.update(SERVER_SUBSETS)
+    return chosen
+
+
+def fact(attrs, names):
+    """the attributes of one object renamed to facts, numbers as ints"""
+
+    found = dict(dn=attrs['dn'])
+    for attr, name in names.items():
+        value = attrs.get(attr)
+        if value is None or value == "":
+            continue
+        found[name] = int(value) if NUMERIC_RE.match(value) else value
+    return found
+
+
+def owner_of(dn, owners):
+    """the gathered server, chassis or fabric interconnect dn is part of,
+       looked up one parent dn at a time"""
+
+    while '/' in dn:
+        dn = dn.rsplit('/', 1)[0]
+        if dn in owners:
+            return owners[dn]
+    return None
+
+
+def gather(handle, subsets, concurrency=None):
+    """read every chosen class in one go and join the parts to their
+       owners, returns the facts"""
+
+    by_class = dict((SUBSETS[subset][0].lower(), subset)
+                    for subset in subsets)
+    owners = {}
+    parts = []
+    facts = dict((subset, []) for subset in OWNER_SUBSETS
+                 if subset in subsets)
+
+    for class_id, attrs in read_classes(
+            handle, sorted(SUBSETS[subset][0] for subset in subsets),
+            concurrency):
+        subset = by_class[class_id.lower()]
+        if subset in OWNER_SUBSETS:
+            entry = fact(attrs, SUBSETS[subset][1])
+            facts[subset].append(entry)
+            owners[entry['dn']] = entry
+        else:
+            parts.append((subset, attrs))
+
+    # parts can arrive before their owners, so they are joined afterwards
+    for subset, attrs in parts:
+        owner = owner_of(attrs['dn'], owners)
+        if owner is None:
+            continue
+        if subset == "firmware":
+            owner.setdefault('firmware', {})[
+                attrs['dn'][len(owner['dn']) + 1:]] = attrs.get('version')
+        elif subset == "memory":
+            memory = owner.setdefault('memory', dict(dimms=0,
+                                                     capacity_mb=0))
+            if attrs.get('presence', "equipped").startswith("equipped") and \
+                    NUMERIC_RE.match(attrs.get('capacity', "")):
+                memory['dimms'] += 1
+                memory['capacity_mb'] += int(attrs['capacity'])
+        else:
+            entry = fact(attrs, SUBSETS[subset][1])
+            if subset == "cpus" and \
+                    not entry.get('presence', "equipped").startswith(
+                        "equipped"):
+                continue
+            owner.setdefault(PART_KEYS.get(subset, subset), []).append(entry)
+
+    servers = []
+    for subset in SERVER_SUBSETS:
+        for entry in facts.pop(subset, []):
+            entry['kind'] = subset[:-1]
+            servers.append(entry)
+    servers.sort(key=lambda entry: entry['dn'])
+    for entries in facts.values():
+        entries.sort(key=lambda entry: entry['dn'])
+    facts['servers'] = servers
+    return facts
+
+
+def summarize(facts):
+    """counts across the gathered servers"""
+
+    servers = facts['servers']
+    summary = dict(servers=len(servers),
+                   associated=sum(1 for server in servers
+                                  if server.get('association') ==
+                                  "associated"),
+                   memory_mb=sum(server.get('memory_mb', 0)
+                                 for server in servers
+                                 if isinstance(server.get('memory_mb'), int)),
+                   cpus=sum(server.get('cpus', 0) for server in servers
+                            if isinstance(server.get('cpus'), int)))
+    for subset in ("chassis", "fabric_interconnects"):
+        if subset in facts:
+            summary[subset] = len(facts[subset])
+    return summary
+
+
+def ucs_facts(handle, params):
+    """gather the chosen subsets of the domain's inventory"""
+
+    start = time.time()
+    try:
+        subsets = chosen_subsets(params['gather_subset'])
+    except ValueError as subset_exception:
+        return dict(changed=False, failed=True, msg=str(subset_exception))
+
+    facts = gather(handle, subsets, params.get('concurrency'))
+    facts['summary'] = summarize(facts)
+    facts['gathered'] = sorted(subsets)
+    return dict(changed=False, ansible_facts=dict(ucs=facts),
+                seconds=round(time.time() - start, 3))
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        gather_subset=dict(
+            required=False,
+            type="list",
+            default=["all"]
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
+
+    result = run_on_domains(module, ucs_facts)
+
+    if 'domains' in result:
+        result['ansible_facts'] = dict(ucs_domains=dict(
+            (name, domain.pop('ansible_facts', {}).get('ucs'))
+            for name, domain in result['domains'].items()))
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,12 @@
 #!/usr/bin/python
 
-from ucsmsdk.ucsconstants import NamingId
-from ucsmsdk.mometa.vnic.VnicEther import VnicEther
-from ucsmsdk.mometa.vnic.VnicLanConnPolicy import VnicLanConnPolicy
+from ucs import LazyMo
+from ucs_rolling import ROLLING_SPEC, add_roll_out
+
+VnicEther = LazyMo("VnicEther")
+VnicLanConnPolicy = LazyMo("VnicLanConnPolicy")
+
+VNIC_PROPS = ('order', 'nw_templ_name', 'adaptor_profile_name')
 
 DOCUMENTATION = '''
 ---
@@ -16,6 +20,13 @@ description:
       order it and Assign a vnic policy.
 notes:
     - This only works with existing vnic templates and vnic policies.
+    - The existing policy is compared with the requested one and only the
+      differences are committed, so a converged policy reports no change.
+    - With rolling set, the service profiles bound to the policy are found
+      with one query per class and their pending reboots acknowledged in
+      waves; in check mode the planned waves are reported instead.  A
+      task that changes nothing leaves pending reboots alone unless
+      resume_rolling is set, they may come from other changes.
 requirements:
     - "python >= 2.7.5"
     - "ucsmsdk"
@@ -35,7 +46,8 @@ options:
         - "a choice, either 'present' or 'absent'"
     org_name:
       description:
-        - "organizational object name to create the policy under"
+        - "organizational object name to create the policy under, either a
+           bare org name or a full org path such as root/HR/Prod"
         required: true
         default: None
     vnics:
@@ -44,10 +56,52 @@ options:
            name: vnic name
            order: order in policy
            templ: vnic template
-           policy: policy name for the vnic"
+           policy: policy name for the vnic
+           vnics on the policy that are not listed are removed, leave the
+           option out to keep the existing vnics as they are"
 
       required: true
       default: None
+    rolling:
+      description:
+        - "after the change, acknowledge the reboots it leaves pending on
+           the service profiles bound to the policy in waves, each wave waiting
+           for its servers to come back healthy"
+      required: false
+      default: false
+    wave_size:
+      description:
+        - "servers per wave, a count or a percentage of the affected ones"
+      required: false
+      default: 10%
+    max_per_chassis:
+      description:
+        - "most servers of one chassis in a wave, 0 for no limit"
+      required: false
+      default: 0
+    fabric_order:
+      description:
+        - "the fabrics to roll through in order, a server's fabric being
+           that of its first vnic"
+      required: false
+      default: [A, B]
+    wave_timeout:
+      description:
+        - "seconds a wave may take to come back healthy"
+      required: false
+      default: 1800
+    wave_interval:
+      description:
+        - "seconds between health checks of a wave"
+      required: false
+      default: 10
+    resume_rolling:
+      description:
+        - "roll out the reboots pending on the bound service profiles even
+           when the policy is already converged, to finish a rolling run
+           that was interrupted"
+      required: false
+      default: false
 '''
 
 EXAMPLES = '''
@@ -72,83 +126,176 @@ EXAMPLES = '''
         order: 2
         templ: exchange_b
         policy: Windows
+
+# Push the same policy to several ucs domains at once
+- ucs_lan_con:
+    state: present
+    hostnames:
+      - ucsm-dc1.example.com
+      - ucsm-dc2.example.com
+      - hostname: ucsm-lab.example.com
+        password: lab_password
+    max_workers: 8
+    domain_timeout: 300
+    username: admin
+    password: admin
+    org_name: myorgname
+    lan_con_name: exchange
+    vnics:
+      - name: nic1
+        order: 1
+        templ: exchange_a
+        policy: Windows
+
+# Change the policy and reboot the bound servers a tenth at a time,
+# fabric A first, never more than two blades of a chassis together
+- ucs_lan_con:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    org_name: myorgname
+    lan_con_name: exchange
+    vnics:
+      - name: nic1
+        order: 1
+        templ: exchange_a
+        policy: Windows
+    rolling: true
+    wave_size: 10%
+    max_per_chassis: 2
 '''
 
 def get_vcon(handle, org_obj, name):
     """verify the vcon exists"""
 
-    ret_val = None
-    filter_str = '(name, "{0}", type="eq")'.format(name)
-    vcon_list = handle.query_children(in_mo=org_obj,
-                                      class_id=NamingId.VNIC_LAN_CONN_POLICY,
-                                      filter_str=filter_str,
-                                      hierarchy=False)
-    for vcon in vcon_list:
-        if vcon.name == name:
-            ret_val = vcon
-            break
+    return cache_query_dn(handle, VnicLanConnPolicy(parent_mo_or_dn=org_obj,
+                                                    name=name).dn)
 
-    return ret_val
 
+def query_vcon(handle, org_obj, name):
+    """fetch the policy and its vnics with one hierarchical query, returns
+       (policy or None, {vnic name: vnic})"""
 
-def vcon_present(handle, params):
-    """make the vcon"""
+    policy_dn = VnicLanConnPolicy(parent_mo_or_dn=org_obj, name=name).dn
 
-    org_obj = get_org(handle, params['org_name'])
+    policy = None
+    vnics = {}
+    for mo in cache_query_dn(handle, policy_dn, hierarchy=True):
+        if mo.dn == policy_dn:
+            policy = mo
+        elif mo.get_class_id() == "VnicEther" and \
+                mo.dn.rsplit('/', 1)[0] == policy_dn:
+            vnics[mo.name] = mo
 
-    if org_obj:
+    return policy, vnics
 
-        vnic_pol = VnicLanConnPolicy(parent_mo_or_dn=org_obj,
-                                     name=params['lan_con_name'],
-                                     descr=params['lan_con_descr'])
 
-        for vnic in params['vnics']:
-            vnic = VnicEther(parent_mo_or_dn=vnic_pol,
-                             name=vnic['name'],
-                             order=str(vnic['order']),
-                             nw_templ_name=vnic['templ'],
-                             adaptor_profile_name=vnic['policy'])
+def desired_vnics(params):
+    """the vnics param as {vnic name: ucs properties}"""
 
-        handle.add_mo(vnic_pol, True)
-        handle.commit()
+    vnics = {}
+    for vnic in params['vnics'] or []:
+        vnics[vnic['name']] = dict(order=str(vnic['order']),
+                                   nw_templ_name=vnic['templ'],
+                                   adaptor_profile_name=vnic['policy'])
+    return vnics
 
-        if get_vcon(handle, org_obj, params['lan_con_name']):
-            #return ({'changed': True, 'failed': False})
-            return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
+
+def build_vcon(handle, org_obj, params):
+    """diff the wanted policy against ucsm, returns (changes, diff) where
+       changes is what commit_changes needs to converge and is empty when
+       the policy already matches"""
+
+    name = params['lan_con_name']
+    policy, vnics = query_vcon(handle, org_obj, name)
+    wanted = desired_vnics(params)
+    descr = params['lan_con_descr']
+
+    diff = dict(before={}, after=dict(descr=descr, vnics=wanted))
+    if policy is not None:
+        diff['before'] = dict(descr=policy.descr,
+                              vnics=dict((vnic_name, mo_props(vnic, VNIC_PROPS))
+                                         for vnic_name, vnic in vnics.items()))
+
+    changes = []
+
+    if policy is None:
+        vnic_pol = VnicLanConnPolicy(parent_mo_or_dn=org_obj, name=name,
+                                     descr=descr)
+        for vnic_name, props in wanted.items():
+            VnicEther(parent_mo_or_dn=vnic_pol, name=vnic_name, **props)
+        changes.append(("add", vnic_pol))
+        return changes, diff
+
+    if diff_props(policy, dict(descr=descr)):
+        changes.append(("add", VnicLanConnPolicy(parent_mo_or_dn=org_obj,
+                                                 name=name, descr=descr)))
+
+    for vnic_name, props in wanted.items():
+        if diff_props(vnics.get(vnic_name), props):
+            changes.append(("add", VnicEther(parent_mo_or_dn=policy.dn,
+                                             name=vnic_name, **props)))
+
+    # leave the vnics alone entirely when the task does not list any
+    if params['vnics'] is not None:
+        for vnic_name, vnic in vnics.items():
+            if vnic_name not in wanted:
+                changes.append(("remove", vnic))
+
+    return changes, diff
+
+
+def vcon_present(handle, params):
+    """make the vcon, committing only what differs from ucsm"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
+
+    changes, diff = build_vcon(handle, org_obj, params)
+    commits = commit_changes(handle, changes, params)
+
+    result = dict(changed=bool(changes), diff=diff, commits=commits)
+
+    policy_dn = VnicLanConnPolicy(parent_mo_or_dn=org_obj,
+                                  name=params['lan_con_name']).dn
+    return add_roll_out(handle, params, result, policy_dn, "lan")
 
 
 def vcon_absent(handle, params):
     """remove the vcon"""
 
-    org_obj = get_org(handle, params['org_name'])
-
-    if org_obj:
-        filter_str = '(name, "{0}", type="eq")'.format(params['lan_con_name'])
-        vcon_list = handle.query_children(in_mo=org_obj,
-                                          class_id=NamingId.VNIC_LAN_CONN_POLICY,
-                                          filter_str=filter_str,
-                                          hierarchy=False)
-        for vcon in vcon_list:
-            if vcon.name == params['lan_con_name']:
-                handle.remove_mo(vcon)
-                handle.commit()
-                break
-
-    if get_vcon(handle, org_obj, params['lan_con_name']):
-        #return ({'changed': True, 'failed': False})
-        return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False)
+
+    vcon = get_vcon(handle, org_obj, params['lan_con_name'])
+    if not vcon:
+        return dict(changed=False)
+
+    # commit_changes fails unless ucsm reports the policy deleted
+    commits = commit_changes(handle, [("remove", vcon)], params)
+    return dict(changed=True, commits=commits)
 
 
 def main():
     """main entry point"""
 
     spec = get_ucs_argument_spec(**dict(
+        ROLLING_SPEC,
         org_name=dict(
             required=True,
             type="str"
@@ -172,16 +319,16 @@ def main():
     ))
 
 
-    module = AnsibleModule(argument_spec=spec)
-
-    handle = get_handle(module)
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
 
     if module.params['state'] == 'present':
-        result = vcon_present(handle, module.params)
+        result = run_on_domains(module, vcon_present)
     else:
-        result = vcon_absent(handle, module.params)
+        result = run_on_domains(module, vcon_absent)
 
-    module.exit_json(changed=result)
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
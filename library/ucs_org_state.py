@@ -0,0 +1,488 @@
+#!/usr/bin/python
+
+import io
+
+from ucs_apply import (LEVELS, OBJECT_TYPES, batch_blocks, switch_ids,
+                       vsan_parent)
+from ucs_service_profile_template import POLICY_REFS
+
+DOCUMENTATION = '''
+---
+module: ucs_org_state
+short_description: Reconcile a whole ucs org with its desired definition
+author:  "Kyle Jones (@excilsploft)"
+version_added: "<version_tag>"
+description:
+    - Take the full definition of an org (ip pools, lan and san connection
+      policies, vsan port assignments and service profile templates) and
+      bring the org in line with it in one task, instead of running each
+      module on its own in the right order.  Every object is diffed with
+      the builder of its own module against one read of the org, the
+      objects are ordered by what they depend on (pools, then policies,
+      then the templates naming them) and all the changes go out in a
+      single commit.
+notes:
+    - The org and everything below it, together with the vsans the port
+      assignments name, are read in one hierarchical query, sent
+      alongside class reads of what the builders check outside the org
+      (every ip block for overlaps, the policy classes templates name,
+      which parent orgs may hold).  Nothing else is read.
+    - The blocks of the ip pools are checked against each other as well as
+      against every other block in ucsm, an overlap fails each pool
+      involved.  An entry missing a required option fails on its own.
+    - A template naming a pool or policy of the definition depends on it;
+      when that object fails the template is skipped.
+    - With prune set, ip pools, lan and san connection policies and
+      templates directly in the org that the definition does not list are
+      removed, templates before policies, and vsan port assignments are
+      exclusive.  Objects named default, the ext-mgmt pool and anything a
+      listed template names are never pruned.
+    - With commit_chunk_size set the commits follow the dependency order.
+    - The org itself must exist.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    org_name:
+      description:
+        - "the org to reconcile, a name or a path such as root/HR/Prod"
+      required: true
+      default: None
+    ip_pools:
+      description:
+        - "the ip pools of the org, each with the options of ucs_ip_pool
+           but org_name"
+      required: false
+      default: []
+    lan_conns:
+      description:
+        - "the lan connection policies of the org, each with the options of
+           ucs_lan_conn but org_name"
+      required: false
+      default: []
+    san_conns:
+      description:
+        - "the san connection policies of the org, each with the options of
+           ucs_san_conn but org_name"
+      required: false
+      default: []
+    vsan_assigns:
+      description:
+        - "fc port assignments of the vsans the org uses, each with the
+           options of ucs_vsan_assign"
+      required: false
+      default: []
+    sp_templates:
+      description:
+        - "the service profile templates of the org, each with the options
+           of ucs_service_profile_template but org_name"
+      required: false
+      default: []
+    prune:
+      description:
+        - "remove the pools, policies and templates of the org that are not
+           listed"
+      required: false
+      default: false
+'''
+
+EXAMPLES = '''
+# The whole exchange tenant, from one definition
+- ucs_org_state:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    org_name: root/exchange
+    prune: true
+    ip_pools:
+      - ip_pool_name: exchange_mgmt
+        ip_v4_pool_block:
+          - name: first
+            starting_address: 10.20.0.10
+            number_of_ip: 100
+            subnet_mask: 255.255.255.0
+            default_route: 10.20.0.1
+    lan_conns:
+      - lan_con_name: exchange
+        vnics:
+          - name: nic1
+            order: 1
+            templ: exchange_a
+            policy: Windows
+    san_conns:
+      - san_con_name: exchange
+        wwnn_pool: exchange_fc_pool
+        hbas:
+          - name: hba1
+            order: 1
+            templ: exchange_a
+            policy: Windows
+    vsan_assigns:
+      - vsan_id: 1020
+        switch_id: [A, B]
+        ports:
+          - 1/1-8
+    sp_templates:
+      - service_profile_name: exchange
+        management_ip: exchange_mgmt
+        lan_con_policy: exchange
+        san_con_policy: exchange
+'''
+
+# option: object type, in the order the sections are planned
+SECTIONS = [
+    ("ip_pools", "ip_pool"),
+    ("lan_conns", "lan_conn"),
+    ("san_conns", "san_conn"),
+    ("vsan_assigns", "vsan_assign"),
+    ("sp_templates", "sp_template"),
+]
+
+# type: (class, rn prefix) of the objects directly in the org
+ORG_CLASSES = dict(
+    ip_pool=("ippoolPool", "ip-pool-"),
+    lan_conn=("vnicLanConnPolicy", "lan-conn-pol-"),
+    san_conn=("vnicSanConnPolicy", "san-conn-pol-"),
+    sp_template=("lsServer", "ls-"),
+)
+
+# policy class a template names: type of the definition that defines it
+DEFINED_BY = dict(IppoolPool="ip_pool", VnicLanConnPolicy="lan_conn",
+                  VnicSanConnPolicy="san_conn")
+
+# what prune leaves alone, ucsm holds these whatever the definition says
+PRUNE_KEEP = ("default", "ext-mgmt")
+
+TEMPLATE_TYPES = ("initial-template", "updating-template")
+
+
+def desired_objects(params):
+    """every object of the definition as a result (type, name, level) and
+       its options, the org filled in, raises ValueError for an entry
+       without a name or an object listed twice"""
+
+    objects = []
+    seen = set()
+    for section, obj_type in SECTIONS:
+        _, _, _, obj_name, defaults = OBJECT_TYPES[obj_type]
+        for entry in params.get(section) or []:
+            obj = dict(defaults, org_cache_ttl=params.get('org_cache_ttl'))
+            obj.update(entry)
+            obj['org_name'] = params['org_name']
+            if obj_type == "vsan_assign" and params.get('prune'):
+                obj['exclusive'] = True
+            try:
+                name = obj_name(obj)
+            except KeyError as key_exception:
+                raise ValueError("an entry of {0} has no {1}".format(
+                    section, key_exception.args[0]))
+            if (obj_type, name) in seen:
+                raise ValueError("{0} {1} is listed twice".format(obj_type,
+                                                                  name))
+            seen.add((obj_type, name))
+            objects.append((dict(type=obj_type, name=name,
+                                 level=LEVELS[obj_type]), obj))
+    return objects
+
+
+def dependencies(objects):
+    """{(type, name): [(type, name) of the definition it names]}"""
+
+    defined = set((result['type'], result['name'])
+                  for result, _ in objects)
+    depends = {}
+    for result, obj in objects:
+        needs = []
+        if result['type'] == "sp_template":
+            for param, class_id, _, _ in POLICY_REFS:
+                key = (DEFINED_BY.get(class_id), obj.get(param))
+                if key in defined:
+                    needs.append(key)
+        depends[(result['type'], result['name'])] = needs
+    return depends
+
+
+def plan_order(objects, depends):
+    """the objects sorted so that each comes after those it depends on,
+       the lowest level first among those ready"""
+
+    position = dict(((result['type'], result['name']), index)
+                    for index, (result, _) in enumerate(objects))
+    by_key = dict(((result['type'], result['name']), (result, obj))
+                  for result, obj in objects)
+    waiting = dict((key, set(needs)) for key, needs in depends.items())
+
+    ordered = []
+    while waiting:
+        ready = [key for key, needs in waiting.items() if not needs]
+        if not ready:
+            raise ValueError("dependency cycle between {0}".format(
+                ", ".join(" ".join(key) for key in sorted(waiting))))
+        key = min(ready, key=lambda key: (LEVELS[key[0]], position[key]))
+        ordered.append(by_key[key])
+        del waiting[key]
+        for needs in waiting.values():
+            needs.discard(key)
+    return ordered
+
+
+def vsan_dns(objects):
+    """the dn of every vsan the port assignments name, on every fabric"""
+
+    dns = []
+    for result, obj in objects:
+        if result['type'] == "vsan_assign":
+            dns.extend("fabric/san/{0}/net-{1}".format(switch_id,
+                                                       obj['vsan_id'])
+                       for switch_id in switch_ids(obj))
+    return dns
+
+
+def outside_classes(objects):
+    """the classes the builders check beyond the org: every ip block, and
+       the policy classes templates name, which parent orgs may hold"""
+
+    classes = set()
+    for result, obj in objects:
+        if result['type'] == "ip_pool":
+            classes.add("ippoolBlock")
+        elif result['type'] == "sp_template":
+            classes.update(class_id[0].lower() + class_id[1:]
+                           for param, class_id, _, _ in POLICY_REFS
+                           if obj.get(param))
+    return sorted(classes)
+
+
+def read_org(handle, org_dn, objects, concurrency=None):
+    """the org subtree and the vsans in one hierarchical query, sent
+       together with the outside_classes reads, into a SnapshotHandle the
+       builders read instead of ucsm"""
+
+    dns = [org_dn] + vsan_dns(objects)
+    classes = outside_classes(objects)
+    index = SnapshotHandle(name=handle.name)
+
+    with trace_span(handle, "ucs.read_org", org=org_dn):
+        if getattr(handle, "offline", False):
+            for tag, attrs in stream_dns(handle, dns, hierarchy=True):
+                index.add(tag, attrs)
+            for tag, attrs in read_classes(handle, classes):
+                index.add(tag, attrs)
+            return index
+
+        requests = [dns_request(handle, dns, hierarchy=True)] + \
+            [class_request(handle, class_id) for class_id in classes]
+        for body in post_many(handle, requests, concurrency):
+            for tag, attrs in parse_mos(io.BytesIO(body.encode("utf-8"))):
+                index.add(tag, attrs)
+    return index
+
+
+def org_child_dn(org_dn, obj_type, name):
+    """the dn of an object of the definition directly in the org"""
+
+    return "{0}/{1}{2}".format(org_dn, ORG_CLASSES[obj_type][1], name)
+
+
+def plan_object(index, org_obj, result, obj, batch):
+    """diff one object against the index, fills in result (action, status,
+       diff) and returns its changes.  batch holds the blocks of every
+       ip pool of the definition, as batch_blocks returns them."""
+
+    builder = OBJECT_TYPES[result['type']][0]
+    extra = {}
+    if result['type'] == "ip_pool":
+        extra['batch'] = batch
+    try:
+        parent = org_obj
+        if result['type'] == "vsan_assign":
+            parent = vsan_parent(index, obj)
+            if not parent:
+                raise ValueError("vsan {0} not found on fabric {1}".format(
+                    obj['vsan_id'], ", ".join(switch_ids(obj))))
+        changes, diff = builder(index, parent, obj, **extra)
+    except KeyError as key_exception:
+        result.update(status="failed", msg="{0} {1} has no {2}".format(
+            result['type'], result['name'], key_exception.args[0]))
+        return []
+    except ValueError as build_exception:
+        result.update(status="failed", msg=str(build_exception))
+        return []
+
+    action = "update"
+    if result['type'] in ORG_CLASSES and org_child_dn(
+            org_obj.dn, result['type'], result['name']) not in index.mos:
+        action = "create"
+    result.update(action=action if changes else "none",
+                  status="changed" if changes else "unchanged", diff=diff)
+    return changes
+
+
+def prune_objects(index, org_dn, objects):
+    """results and remove changes for the objects of the managed classes
+       directly in the org that the definition does not list, templates
+       first.  An object a listed template names is kept and failed."""
+
+    listed = set((result['type'], result['name'])
+                 for result, _ in objects)
+    named = {}
+    for result, obj in objects:
+        if result['type'] == "sp_template":
+            for param, class_id, _, _ in POLICY_REFS:
+                if class_id in DEFINED_BY and obj.get(param):
+                    named.setdefault((DEFINED_BY[class_id], obj[param]),
+                                     result['name'])
+
+    pruned = []
+    for obj_type in sorted(ORG_CLASSES, key=lambda obj_type:
+                           -LEVELS[obj_type]):
+        class_id, prefix = ORG_CLASSES[obj_type]
+        for dn in index.children.get(org_dn, []):
+            tag, attrs = index.mos[dn]
+            rn = dn.rsplit('/', 1)[-1]
+            name = rn[len(prefix):]
+            if tag.lower() != class_id.lower() or \
+                    not rn.startswith(prefix) or \
+                    (obj_type, name) in listed or name in PRUNE_KEEP:
+                continue
+            if obj_type == "sp_template" and \
+                    attrs.get('type') not in TEMPLATE_TYPES:
+                continue
+            result = dict(type=obj_type, name=name, level=LEVELS[obj_type],
+                          action="remove", depends=[])
+            if (obj_type, name) in named:
+                result.update(status="failed", msg="not pruned, template "
+                              "{0} names it".format(named[(obj_type, name)]))
+                pruned.append((result, []))
+                continue
+            result.update(status="changed",
+                          diff=dict(before=dict(dn=dn), after={}))
+            pruned.append((result, [("remove", index.query_dn(dn))]))
+    return pruned
+
+
+def reconcile_org(handle, params):
+    """plan the whole org against one read of it, then push every change
+       in dependency order in as few commits as commit_chunk_size allows"""
+
+    try:
+        objects = desired_objects(params)
+        depends = dependencies(objects)
+        ordered = plan_order(objects, depends)
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as plan_exception:
+        return dict(changed=False, failed=True, msg=str(plan_exception))
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
+
+    index = read_org(handle, org_obj.dn, objects, params.get('concurrency'))
+    # the pools of the definition are checked against each other's blocks
+    batch = batch_blocks(index, {("org", params['org_name']): org_obj},
+                         [obj for result, obj in objects
+                          if result['type'] == "ip_pool"])
+    planned = []
+    statuses = {}
+    for result, obj in ordered:
+        key = (result['type'], result['name'])
+        result['depends'] = [" ".join(need) for need in depends[key]]
+        blocked = [need for need in depends[key]
+                   if statuses.get(need) in ("failed", "skipped")]
+        if blocked:
+            result.update(status="skipped", msg="depends on {0}".format(
+                ", ".join(" ".join(need) for need in blocked)))
+            changes = []
+        else:
+            changes = plan_object(index, org_obj, result, obj, batch)
+        statuses[key] = result['status']
+        planned.append((result, changes))
+        if result.get('action') == "create":
+            # the templates after it must find it as if it were committed
+            index.add(ORG_CLASSES[result['type']][0], dict(
+                dn=org_child_dn(org_obj.dn, result['type'], result['name']),
+                name=result['name']))
+
+    if params.get('prune'):
+        planned.extend(prune_objects(index, org_obj.dn, objects))
+
+    pending = [(result, changes) for result, changes in planned if changes]
+    commits = []
+    try:
+        commits = commit_changes(handle, [change for _, changes in pending
+                                          for change in changes], params)
+    except CommitError as commit_exception:
+        commits = commit_exception.chunks
+        for result, _ in pending:
+            result.update(status="failed", msg=str(commit_exception))
+
+    results = [result for result, _ in planned]
+    failed = [result for result in results if result['status'] == "failed"]
+    ret_val = dict(changed=any(result['status'] == "changed"
+                               for result in results),
+                   plan=[dict(action=result['action'], type=result['type'],
+                              name=result['name'])
+                         for result, _ in pending],
+                   results=results, commits=commits)
+    if failed:
+        ret_val.update(failed=True,
+                       msg="{0} of {1} objects failed".format(len(failed),
+                                                             len(results)))
+    return ret_val
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        org_name=dict(
+            required=True,
+            type="str"
+        ),
+        ip_pools=dict(
+            required=False,
+            type="list",
+            default=[]
+        ),
+        lan_conns=dict(
+            required=False,
+            type="list",
+            default=[]
+        ),
+        san_conns=dict(
+            required=False,
+            type="list",
+            default=[]
+        ),
+        vsan_assigns=dict(
+            required=False,
+            type="list",
+            default=[]
+        ),
+        sp_templates=dict(
+            required=False,
+            type="list",
+            default=[]
+        ),
+        prune=dict(
+            required=False,
+            type="bool",
+            default=False
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
+
+    result = run_on_domains(module, reconcile_org)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/python
+
+import bisect
+import time
+
+from ip_pool import ip_to_int
+
+DOCUMENTATION = '''
+---
+module: ucs_pool_usage
+short_description: Report how full ucs ip, mac, wwn and uuid pools are
+author:  "Chris Dunlap (@stoffee)"
+version_added: "<version_tag>"
+description:
+    - Read every pool, block and assigned address of the ip, mac, wwn and
+      uuid pools of a UCS domain and report the size, used and free count
+      of each pool and of each org, and optionally whether a number of new
+      service profiles fits in what is left. Nothing is changed.
+notes:
+    - Each class is read with a single query for the whole domain, the
+      queries running concurrently. Blocks are merged into intervals and
+      assigned addresses counted against them with a binary search, so the
+      cost grows with the number of blocks and assigned addresses, never
+      with the size of a pool.
+    - Overlapping blocks of a pool are counted once. Addresses assigned
+      outside every block of their pool are reported as outside, not used.
+    - Only IPv4 blocks are counted in ip pools.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    kinds:
+      description:
+        - "pool kinds to report, any of ip, mac, wwn and uuid"
+      required: false
+      default: [ip, mac, wwn, uuid]
+    pools:
+      description:
+        - "only report pools with these names or dns"
+      required: false
+      default: None
+    profiles:
+      description:
+        - "number of new service profiles to check the pools against"
+      required: false
+      default: 0
+    per_profile:
+      description:
+        - "addresses each new profile takes from a pool, keyed by pool name
+           or dn, pools not listed take 1"
+      required: false
+      default: None
+'''
+
+EXAMPLES = '''
+# Will 200 profiles with two vnics each fit?
+- ucs_pool_usage:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    pools: [ext-mgmt, exchange_mac, exchange_uuid, exchange_wwpn]
+    profiles: 200
+    per_profile:
+      exchange_mac: 2
+      exchange_wwpn: 2
+  register: usage
+
+- fail:
+    msg: "short of addresses in {{ usage.short | join(', ') }}"
+  when: not usage.fits
+'''
+
+
+def hex_to_int(address):
+    """mac, wwn or uuid suffix to integer"""
+
+    return int(address.replace(":", "").replace("-", ""), 16)
+
+
+# kind: (pool class, block class, assigned address class, to integer)
+KINDS = dict(
+    ip=("ippoolPool", "ippoolBlock", "ippoolPooled", ip_to_int),
+    mac=("macpoolPool", "macpoolBlock", "macpoolPooled", hex_to_int),
+    wwn=("fcpoolInitiators", "fcpoolBlock", "fcpoolInitiator", hex_to_int),
+    uuid=("uuidpoolPool", "uuidpoolBlock", "uuidpoolPooled", hex_to_int),
+)
+
+# what ucsm's assigned property reads for an address nobody holds
+UNASSIGNED = ("no", "false")
+
+
+def merge_intervals(intervals):
+    """(first, last) integer intervals merged into sorted disjoint ones"""
+
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def count_within(merged, addresses):
+    """how many of the sorted addresses fall in the merged intervals"""
+
+    return sum(bisect.bisect_right(addresses, last) -
+               bisect.bisect_left(addresses, first)
+               for first, last in merged)
+
+
+def pool_of(dn, pools):
+    """the pool dn is part of, looked up one parent dn at a time"""
+
+    while '/' in dn:
+        dn = dn.rsplit('/', 1)[0]
+        if dn in pools:
+            return pools[dn]
+    return None
+
+
+def read_pools(handle, kinds, concurrency=None):
+    """every pool of kinds with its block intervals and assigned addresses,
+       as {pool dn: pool}"""
+
+    by_class = {}
+    filters = {}
+    class_ids = []
+    for kind in kinds:
+        pool_class, block_class, pooled_class, _ = KINDS[kind]
+        class_ids.extend([pool_class, block_class, pooled_class])
+        by_class[pool_class.lower()] = (kind, "pool")
+        by_class[block_class.lower()] = (kind, "block")
+        by_class[pooled_class.lower()] = (kind, "pooled")
+        filters[pooled_class] = '<and>{0}</and>'.format("".join(
+            '<ne class="{0}" property="assigned" value="{1}"/>'.format(
+                pooled_class, value) for value in UNASSIGNED))
+
+    pools = {}
+    members = []
+    for class_id, attrs in read_classes(handle, class_ids, concurrency,
+                                        filters):
+        kind, role = by_class[class_id.lower()]
+        if role == "pool":
+            if kind == "wwn":
+                kind = dict(node="wwnn", port="wwpn").get(
+                    attrs.get('purpose', "").split("-")[0], "wwn")
+            pools[attrs['dn']] = dict(kind=kind, name=attrs.get('name'),
+                                      dn=attrs['dn'], blocks=[],
+                                      addresses=[])
+        else:
+            members.append((kind, role, attrs))
+
+    # blocks and addresses can arrive before their pools
+    for kind, role, attrs in members:
+        pool = pool_of(attrs['dn'], pools)
+        if pool is None:
+            continue
+        to_int = KINDS[kind][3]
+        try:
+            if role == "block":
+                pool['blocks'].append((to_int(attrs['from']),
+                                       to_int(attrs['to'])))
+            elif attrs.get('assigned', "yes") not in UNASSIGNED:
+                pool['addresses'].append(to_int(attrs['id']))
+        except (KeyError, ValueError, IOError, OSError):
+            # ipv6 blocks and addresses, or anything else unreadable
+            continue
+    return pools
+
+
+def pool_usage(pool):
+    """size, used, free and outside counts of one pool"""
+
+    merged = merge_intervals(pool['blocks'])
+    addresses = sorted(set(pool['addresses']))
+    size = sum(last - first + 1 for first, last in merged)
+    used = count_within(merged, addresses)
+    return dict(kind=pool['kind'], name=pool['name'], dn=pool['dn'],
+                org=pool['dn'].rsplit('/', 1)[0], size=size, used=used,
+                free=size - used, outside=len(addresses) - used,
+                blocks=len(pool['blocks']),
+                percent_used=round(100.0 * used / size, 1) if size else None)
+
+
+def usage(handle, params):
+    """the usage of every pool, per org and against the planned profiles"""
+
+    start = time.time()
+    kinds = params['kinds'] or sorted(KINDS)
+    unknown = sorted(set(kinds) - set(KINDS))
+    if unknown:
+        return dict(changed=False, failed=True,
+                    msg="unknown pool kinds {0}, expected {1}".format(
+                        ", ".join(unknown), ", ".join(sorted(KINDS))))
+
+    wanted = set(params['pools'] or [])
+    pools = [pool_usage(pool) for pool in
+             read_pools(handle, kinds, params.get('concurrency')).values()
+             if not wanted or pool['name'] in wanted or pool['dn'] in wanted]
+    pools.sort(key=lambda pool: (pool['kind'], pool['dn']))
+
+    orgs = {}
+    for pool in pools:
+        totals = orgs.setdefault(pool['org'], {}).setdefault(
+            pool['kind'], dict(pools=0, size=0, used=0, free=0))
+        totals['pools'] += 1
+        for key in ("size", "used", "free"):
+            totals[key] += pool[key]
+
+    result = dict(changed=False, pools=pools, orgs=orgs,
+                  seconds=round(time.time() - start, 3))
+
+    profiles = params['profiles'] or 0
+    if profiles:
+        per_profile = params['per_profile'] or {}
+        short = []
+        for pool in pools:
+            each = int(per_profile.get(pool['dn'],
+                                       per_profile.get(pool['name'], 1)))
+            pool['needed'] = profiles * each
+            pool['fits'] = pool['needed'] <= pool['free']
+            if not pool['fits']:
+                short.append("{0} ({1} free, {2} needed)".format(
+                    pool['dn'], pool['free'], pool['needed']))
+        result.update(profiles=profiles, fits=not short, short=short)
+
+    return result
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        kinds=dict(
+            required=False,
+            type="list"
+        ),
+        pools=dict(
+            required=False,
+            type="list"
+        ),
+        profiles=dict(
+            required=False,
+            type="int",
+            default=0
+        ),
+        per_profile=dict(
+            required=False,
+            type="dict"
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
+
+    result = run_on_domains(module, usage)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""Rolling acknowledgement of the reboots a policy change leaves pending.
+
+Changing a lan or san connection policy bound to service profiles with a
+user-ack maintenance policy leaves a pending activity (lsmaintAck waiting
+for the user) on every one of them, and acknowledging them all at once
+reboots every server together.  roll_out finds the servers a policy change
+affects with one query per class, all sent at once, splits them into waves
+and acknowledges one wave at a time, waiting for each to come back healthy
+before starting the next:
+
+    result['rolling'] = roll_out(handle, params, policy_dn, "lan")
+
+A wave holds at most wave_size servers (a count or a percentage such as
+10%), at most max_per_chassis of them from one chassis, and servers of one
+fabric only.  The fabric of a server is that of the first vnic (or vhba for
+a san policy) of its profile, and the fabrics go in fabric_order; servers
+on fabrics not listed there go last, an empty list mixing them all.
+"""
+
+import math
+import time
+
+from ucs import (CommitError, LazyMo, commit_changes, dry_run, read_classes,
+                 stream_dns)
+
+LsmaintAck = LazyMo("LsmaintAck")
+
+# policy kind: (conn def attribute naming the policy, vnic class)
+KINDS = dict(
+    lan=("operLanConnPolicyName", "vnicEther"),
+    san=("operSanConnPolicyName", "vnicFc"),
+)
+
+# ack states that mean ucsm has not finished working out the change
+EVALUATING = ("evaluation-pending", "pending", "waiting-for-dependency")
+FAILED_STATES = ("failed", "failed-to-apply", "config-failure",
+                 "compute-failed", "inoperable", "discovery-failed")
+
+ROLLING_SPEC = dict(
+    rolling=dict(
+        required=False,
+        type="bool",
+        default=False
+    ),
+    wave_size=dict(
+        required=False,
+        type="str",
+        default="10%"
+    ),
+    max_per_chassis=dict(
+        required=False,
+        type="int",
+        default=0
+    ),
+    fabric_order=dict(
+        required=False,
+        type="list",
+        default=["A", "B"]
+    ),
+    wave_timeout=dict(
+        required=False,
+        type="int",
+        default=1800
+    ),
+    wave_interval=dict(
+        required=False,
+        type="int",
+        default=10
+    ),
+    resume_rolling=dict(
+        required=False,
+        type="bool",
+        default=False
+    ),
+)
+
+
+def wave_count(wave_size, total):
+    """servers per wave from a count or a percentage of total, at least 1,
+       raises ValueError for anything else"""
+
+    text = str(wave_size).strip()
+    try:
+        size = float(text[:-1]) if text.endswith("%") else int(text)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        raise ValueError("wave_size {0} is not a positive count or "
+                         "percentage".format(wave_size))
+    if text.endswith("%"):
+        return max(1, int(math.ceil(total * size / 100.0)))
+    return size
+
+
+def chassis_of(server_dn):
+    """the chassis dn of a blade, None for a rack unit or no server"""
+
+    if server_dn and server_dn.startswith("sys/chassis-"):
+        return server_dn.rsplit('/', 1)[0]
+    return None
+
+
+def discover(handle, policy_dn, kind, concurrency=None):
+    """every service profile bound to policy_dn with the state of its pending
+       activity, as a list of dicts (profile, server, chassis, fabric, ack)"""
+
+    conn_attr, vnic_class = KINDS[kind]
+    filters = dict(
+        vnicConnDef='<eq class="vnicConnDef" property="{0}" '
+                    'value="{1}"/>'.format(conn_attr, policy_dn),
+        lsServer='<eq class="lsServer" property="type" value="instance"/>',
+        lsmaintAck='<ne class="lsmaintAck" property="operState" '
+                   'value="untriggered"/>',
+        **{vnic_class: '<wcard class="{0}" property="dn" '
+                       'value="/ls-[^/]+/[^/]+$"/>'.format(vnic_class)})
+
+    bound = set()
+    profiles = {}
+    acks = {}
+    vnics = {}
+    # the filters are checked again here, a snapshot does not apply them
+    for class_id, attrs in read_classes(
+            handle, ["vnicConnDef", "lsServer", "lsmaintAck", vnic_class],
+            concurrency, filters):
+        parent = attrs['dn'].rsplit('/', 1)[0]
+        class_id = class_id[0].lower() + class_id[1:]
+        if class_id == "vnicConnDef":
+            if attrs.get(conn_attr) == policy_dn:
+                bound.add(parent)
+        elif class_id == "lsServer":
+            if attrs.get('type') == "instance":
+                profiles[attrs['dn']] = attrs
+        elif class_id == "lsmaintAck":
+            if attrs.get('operState') != "untriggered":
+                acks[parent] = attrs.get('operState')
+        else:
+            order = attrs.get('order', "")
+            vnics.setdefault(parent, []).append(
+                (int(order) if order.isdigit() else 0,
+                 attrs.get('switchId', "")))
+
+    servers = []
+    for dn in sorted(bound):
+        profile = profiles.get(dn)
+        if profile is None:
+            # a template, or the profile went away meanwhile
+            continue
+        server = profile.get('pnDn') or None
+        fabric = sorted(vnics.get(dn, []) or [(0, "")])[0][1]
+        servers.append(dict(profile=dn, server=server,
+                            chassis=chassis_of(server),
+                            fabric=fabric[:1] or None,
+                            ack=acks.get(dn)))
+    return servers
+
+
+def plan_waves(servers, wave_size, max_per_chassis, fabric_order):
+    """split servers into waves of at most wave_size, at most
+       max_per_chassis (0 for any number) from one chassis and of one fabric
+       each, the fabrics in fabric_order.  Servers of fabrics not listed
+       come last, mixed."""
+
+    size = wave_count(wave_size, len(servers))
+    order = [str(fabric).upper() for fabric in fabric_order or []]
+    by_fabric = {}
+    for server in servers:
+        fabric = server['fabric'] if server['fabric'] in order else None
+        by_fabric.setdefault(fabric, []).append(server)
+
+    waves = []
+    for fabric in sorted(by_fabric, key=lambda fabric: order.index(fabric)
+                         if fabric in order else len(order)):
+        # take the chassis in turn, so the chassis limit leaves no wave
+        # short while other chassis still have servers waiting
+        by_chassis = {}
+        for server in sorted(by_fabric[fabric],
+                             key=lambda server: (server['server'] or "",
+                                                 server['profile'])):
+            by_chassis.setdefault(server['chassis'] or server['profile'],
+                                  []).append(server)
+        columns = [by_chassis[chassis] for chassis in sorted(by_chassis)]
+        remaining = [column[index]
+                     for index in range(max(len(column)
+                                            for column in columns))
+                     for column in columns if index < len(column)]
+        while remaining:
+            wave = []
+            per_chassis = {}
+            deferred = []
+            for server in remaining:
+                chassis = server['chassis']
+                if len(wave) < size and not (
+                        max_per_chassis and chassis and
+                        per_chassis.get(chassis, 0) >= max_per_chassis):
+                    wave.append(server)
+                    if chassis:
+                        per_chassis[chassis] = per_chassis.get(chassis,
+                                                               0) + 1
+                else:
+                    deferred.append(server)
+            waves.append(wave)
+            remaining = deferred
+    return waves
+
+
+def wave_health(handle, wave):
+    """read the profiles of a wave and their acks in one round trip,
+       returns {profile dn: healthy, failed or busy}"""
+
+    dns = [server['profile'] for server in wave]
+    found = {}
+    for _, attrs in stream_dns(handle, dns + [dn + "/ack" for dn in dns]):
+        found[attrs['dn']] = attrs
+
+    states = {}
+    for dn in dns:
+        profile = found.get(dn)
+        ack = found.get(dn + "/ack")
+        if profile is None:
+            states[dn] = "failed"
+            continue
+        values = (profile.get('assocState'), profile.get('configState'),
+                  profile.get('operState'))
+        if any(value in FAILED_STATES for value in values):
+            states[dn] = "failed"
+        elif values == ("associated", "applied", "ok") and (
+                ack is None or ack.get('operState') in ("untriggered",
+                                                        "applied")):
+            states[dn] = "healthy"
+        else:
+            states[dn] = "busy"
+    return states
+
+
+def wait_for_wave(handle, wave, timeout, interval):
+    """poll the wave until every server is healthy, one failed or the
+       timeout passes, returns {profile dn: state}"""
+
+    start = time.time()
+    while True:
+        states = wave_health(handle, wave)
+        if "failed" in states.values() or \
+                all(state == "healthy" for state in states.values()):
+            return states
+        if time.time() - start + interval > timeout:
+            return dict((dn, "timeout" if state == "busy" else state)
+                        for dn, state in states.items())
+        time.sleep(interval)
+
+
+def roll_out(handle, params, policy_dn, kind):
+    """acknowledge the pending reboots policy_dn left, wave by wave,
+       returns the report for the module result; failed is set when a wave
+       did not come back healthy, the waves after it are left pending"""
+
+    start = time.time()
+    interval = params.get('wave_interval') or 10
+    timeout = params.get('wave_timeout') or 1800
+
+    # ucsm needs a moment to work out which profiles the change affects
+    while True:
+        servers = discover(handle, policy_dn, kind,
+                           params.get('concurrency'))
+        if dry_run(handle, params) or not any(
+                server['ack'] in EVALUATING for server in servers) or \
+                time.time() - start + interval > timeout:
+            break
+        time.sleep(interval)
+
+    waiting = [server for server in servers
+               if server['ack'] == "waiting-for-user"]
+    report = dict(changed=False, bound=len(servers), pending=len(waiting),
+                  waves=[])
+    try:
+        waves = plan_waves(waiting, params.get('wave_size') or "10%",
+                           params.get('max_per_chassis') or 0,
+                           params.get('fabric_order'))
+    except ValueError as wave_exception:
+        report.update(failed=True, msg=str(wave_exception))
+        return report
+
+    for number, wave in enumerate(waves):
+        fabrics = set(server['fabric'] for server in wave)
+        entry = dict(wave=number + 1,
+                     fabric=fabrics.pop() if len(fabrics) == 1 else None,
+                     profiles=[server['profile'] for server in wave],
+                     servers=[server['server'] for server in wave])
+        report['waves'].append(entry)
+        if report.get('failed'):
+            entry['state'] = "pending"
+            continue
+        if dry_run(handle, params):
+            entry['state'] = "planned"
+            continue
+
+        wave_start = time.time()
+        try:
+            commit_changes(handle, [("add", LsmaintAck(
+                parent_mo_or_dn=server['profile'],
+                admin_state="trigger-immediate")) for server in wave],
+                params)
+        except CommitError as commit_exception:
+            entry['state'] = "failed"
+            report.update(failed=True, msg="wave {0} of {1} could not be "
+                          "acknowledged: {2}".format(number + 1, len(waves),
+                                                     commit_exception))
+            continue
+        report['changed'] = True
+
+        states = wait_for_wave(handle, wave, timeout, interval)
+        entry['seconds'] = round(time.time() - wave_start, 1)
+        unhealthy = sorted(dn for dn, state in states.items()
+                           if state != "healthy")
+        entry['state'] = "failed" if unhealthy else "healthy"
+        if unhealthy:
+            report.update(failed=True, msg="wave {0} of {1} did not come "
+                          "back healthy: {2}".format(
+                              number + 1, len(waves), ", ".join(
+                                  "{0} ({1})".format(dn, states[dn])
+                                  for dn in unhealthy)))
+
+    report['seconds'] = round(time.time() - start, 1)
+    return report
+
+
+def add_roll_out(handle, params, result, policy_dn, kind):
+    """with rolling set, roll out the pending reboots of policy_dn and fold
+       the report into the module result as rolling.  When the task changed
+       nothing the reboots pending may be those of unrelated changes, so
+       they are only rolled out with resume_rolling set."""
+
+    if not params.get('rolling'):
+        return result
+    if not result['changed'] and not params.get('resume_rolling'):
+        return result
+
+    report = roll_out(handle, params, policy_dn, kind)
+    result['changed'] = result['changed'] or report.pop('changed')
+    if report.get('failed'):
+        result.update(failed=True, msg=report.pop('msg'))
+        report.pop('failed')
+    result['rolling'] = report
+    return result
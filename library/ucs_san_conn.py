@@ -1,9 +1,13 @@
 #!/usr/bin/python
 
-from ucsmsdk.ucsconstants import NamingId
-from ucsmsdk.mometa.vnic.VnicFc import VnicFc
-from ucsmsdk.mometa.vnic.VnicSanConnPolicy import VnicSanConnPolicy
-from ucsmsdk.mometa.vnic.VnicFcNode import VnicFcNode
+from ucs import LazyMo
+from ucs_rolling import ROLLING_SPEC, add_roll_out
+
+VnicFc = LazyMo("VnicFc")
+VnicSanConnPolicy = LazyMo("VnicSanConnPolicy")
+VnicFcNode = LazyMo("VnicFcNode")
+
+HBA_PROPS = ('order', 'nw_templ_name', 'adaptor_profile_name')
 
 DOCUMENTATION = '''
 ---
@@ -17,6 +21,14 @@ description:
       order it and Assign a vnic policy.
 notes:
     - This only works with existing hba templates and vnic policies.
+    - The existing policy, wwnn pool and hbas are compared with the requested
+      ones and only the differences are committed, so a converged policy
+      reports no change.  The result carries a before/after diff.
+    - With rolling set, the service profiles bound to the policy are found
+      with one query per class and their pending reboots acknowledged in
+      waves; in check mode the planned waves are reported instead.  A
+      task that changes nothing leaves pending reboots alone unless
+      resume_rolling is set, they may come from other changes.
 requirements:
     - "python >= 2.7.5"
     - "ucsmsdk"
@@ -36,7 +48,8 @@ options:
         - "a choice, either 'present' or 'absent'"
     org_name:
       description:
-        - "organizational object name to create the policy under"
+        - "organizational object name to create the policy under, either a
+           bare org name or a full org path such as root/HR/Prod"
         required: true
         default: None
     wwnn_pool: "world wide node name pool"
@@ -46,10 +59,52 @@ options:
            name: vnic name
            order: order in policy
            templ: vnic template
-           policy: policy name for the vnic"
+           policy: policy name for the vnic
+           hbas on the policy that are not listed are removed, leave the
+           option out to keep the existing hbas as they are"
 
       required: true
       default: None
+    rolling:
+      description:
+        - "after the change, acknowledge the reboots it leaves pending on
+           the service profiles bound to the policy in waves, each wave waiting
+           for its servers to come back healthy"
+      required: false
+      default: false
+    wave_size:
+      description:
+        - "servers per wave, a count or a percentage of the affected ones"
+      required: false
+      default: 10%
+    max_per_chassis:
+      description:
+        - "most servers of one chassis in a wave, 0 for no limit"
+      required: false
+      default: 0
+    fabric_order:
+      description:
+        - "the fabrics to roll through in order, a server's fabric being
+           that of its first vhba"
+      required: false
+      default: [A, B]
+    wave_timeout:
+      description:
+        - "seconds a wave may take to come back healthy"
+      required: false
+      default: 1800
+    wave_interval:
+      description:
+        - "seconds between health checks of a wave"
+      required: false
+      default: 10
+    resume_rolling:
+      description:
+        - "roll out the reboots pending on the bound service profiles even
+           when the policy is already converged, to finish a rolling run
+           that was interrupted"
+      required: false
+      default: false
 '''
 
 EXAMPLES = '''
@@ -74,82 +129,166 @@ EXAMPLES = '''
         order: 2
         templ: exchange_b
         policy: Windows
+
+# Change the policy and reboot the bound servers a tenth at a time,
+# fabric A first, never more than two blades of a chassis together
+- ucs_san_conn:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    org_name: myorgname
+    san_con_name: exchange
+    wwnn_pool: exchange_fc_pool
+    rolling: true
+    wave_size: 10%
+    max_per_chassis: 2
 '''
 
 
 def get_san_con(handle, org_obj, name):
     """verify the san conn policy exists"""
 
-    ret_val = None
-    filter_str = '(name, "{0}", type="eq")'.format(name)
-    san_con_list = handle.query_children(in_mo=org_obj,
-                                         class_id=NamingId.VNIC_SAN_CONN_POLICY,
-                                         filter_str=filter_str,
-                                         hierarchy=False)
-    for san in san_con_list:
-        if san.name == name:
-            ret_val = san
-            break
+    return cache_query_dn(handle, VnicSanConnPolicy(parent_mo_or_dn=org_obj,
+                                                    name=name).dn)
+
+def query_san_con(handle, org_obj, name):
+    """fetch the policy, its wwnn node and hbas with one hierarchical query,
+       returns (policy or None, fc node or None, {hba name: hba})"""
+
+    policy_dn = VnicSanConnPolicy(parent_mo_or_dn=org_obj, name=name).dn
+
+    policy = None
+    fc_node = None
+    hbas = {}
+    for mo in cache_query_dn(handle, policy_dn, hierarchy=True):
+        parent_dn = mo.dn.rsplit('/', 1)[0]
+        if mo.dn == policy_dn:
+            policy = mo
+        elif parent_dn != policy_dn:
+            continue
+        elif mo.get_class_id() == "VnicFcNode":
+            fc_node = mo
+        elif mo.get_class_id() == "VnicFc":
+            hbas[mo.name] = mo
+
+    return policy, fc_node, hbas
+
+
+def desired_hbas(params):
+    """the hbas param as {hba name: ucs properties}"""
+
+    hbas = {}
+    for hba in params['hbas'] or []:
+        hbas[hba['name']] = dict(order=str(hba['order']),
+                                 nw_templ_name=hba['templ'],
+                                 adaptor_profile_name=hba['policy'])
+    return hbas
+
+
+def build_san_con(handle, org_obj, params):
+    """diff the wanted policy against ucsm, returns (changes, diff) where
+       changes is what commit_changes needs to converge and is empty when
+       the policy already matches"""
+
+    name = params['san_con_name']
+    policy, fc_node, hbas = query_san_con(handle, org_obj, name)
+    wanted = desired_hbas(params)
+    descr = params['san_con_descr']
+    node_props = dict(ident_pool_name=params['wwnn_pool'])
+
+    diff = dict(before={}, after=dict(descr=descr,
+                                      wwnn_pool=params['wwnn_pool'],
+                                      hbas=wanted))
+    if policy is not None:
+        diff['before'] = dict(descr=policy.descr,
+                              wwnn_pool=getattr(fc_node, 'ident_pool_name',
+                                                None),
+                              hbas=dict((hba_name, mo_props(hba, HBA_PROPS))
+                                        for hba_name, hba in hbas.items()))
+
+    changes = []
+
+    if policy is None:
+        san_con_pol = VnicSanConnPolicy(parent_mo_or_dn=org_obj, name=name,
+                                        descr=descr)
+        VnicFcNode(parent_mo_or_dn=san_con_pol, **node_props)
+        for hba_name, props in wanted.items():
+            VnicFc(parent_mo_or_dn=san_con_pol, name=hba_name, **props)
+        changes.append(("add", san_con_pol))
+        return changes, diff
+
+    if diff_props(policy, dict(descr=descr)):
+        changes.append(("add", VnicSanConnPolicy(parent_mo_or_dn=org_obj,
+                                                 name=name, descr=descr)))
+
+    if diff_props(fc_node, node_props):
+        changes.append(("add", VnicFcNode(parent_mo_or_dn=policy.dn,
+                                          **node_props)))
+
+    for hba_name, props in wanted.items():
+        if diff_props(hbas.get(hba_name), props):
+            changes.append(("add", VnicFc(parent_mo_or_dn=policy.dn,
+                                          name=hba_name, **props)))
+
+    # leave the hbas alone entirely when the task does not list any
+    if params['hbas'] is not None:
+        for hba_name, hba in hbas.items():
+            if hba_name not in wanted:
+                changes.append(("remove", hba))
+
+    return changes, diff
 
-    return ret_val
 
 def san_con_present(handle, params):
-    """make the san con policy """
-
-    org_obj = get_org(handle, params['org_name'])
-
-    if org_obj:
-        san_con_pol = VnicSanConnPolicy(parent_mo_or_dn=org_obj,
-                                        name=params['san_con_name'],
-                                        descr=params['san_con_descr'])
-
-        fc_node = VnicFcNode(parent_mo_or_dn=san_con_pol,
-                             ident_pool_name=params['wwnn_pool'])
-        for hba in params['hbas']:
-            hba_obj = VnicFc(parent_mo_or_dn=san_con_pol,
-                             name=hba['name'],
-                             order=str(hba['order']),
-                             nw_templ_name=hba['templ'],
-                             adaptor_profile_name=hba['policy'])
-
-        handle.add_mo(san_con_pol, True)
-        handle.commit()
-
-        if get_san_con(handle, org_obj, params['san_con_name']):
-            #return ({'changed': True, 'failed': False})
-            return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
+    """make the san con policy, committing only what differs from ucsm"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
+
+    changes, diff = build_san_con(handle, org_obj, params)
+    commits = commit_changes(handle, changes, params)
+
+    result = dict(changed=bool(changes), diff=diff, commits=commits)
+
+    policy_dn = VnicSanConnPolicy(parent_mo_or_dn=org_obj,
+                                  name=params['san_con_name']).dn
+    return add_roll_out(handle, params, result, policy_dn, "san")
+
 
 def san_con_absent(handle, params):
     """remove the san con policy"""
 
-    org_obj = get_org(handle, params['org_name'])
-
-    if org_obj:
-        filter_str = '(name, "{0}", type="eq")'.format(params['san_con_name'])
-        san_con_list = handle.query_children(in_mo=org_obj,
-                                             class_id=NamingId.VNIC_SAN_CONN_POLICY,
-                                             filter_str=filter_str,
-                                             hierarchy=False)
-        for s_con in san_con_list:
-            if s_con.name == params['san_con_name']:
-                handle.remove_mo(s_con)
-                handle.commit()
-                break
-
-    if get_san_con(handle, org_obj, params['san_con_name']):
-        #return ({'changed': True, 'failed': False})
-        return True
-    else:
-        #return ({'changed': False, 'failed': True})
-        return False
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False)
+
+    s_con = get_san_con(handle, org_obj, params['san_con_name'])
+    if not s_con:
+        return dict(changed=False)
+
+    # commit_changes fails unless ucsm reports the policy deleted
+    commits = commit_changes(handle, [("remove", s_con)], params)
+    return dict(changed=True, commits=commits)
 
 def main():
     """main entry point"""
 
     spec = get_ucs_argument_spec(**dict(
+        ROLLING_SPEC,
         org_name=dict(
             required=True,
             type="str"
@@ -177,16 +316,16 @@ def main():
     ))
 
 
-    module = AnsibleModule(argument_spec=spec)
-
-    handle = get_handle(module)
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
 
     if module.params['state'] == 'present':
-        result = san_con_present(handle, module.params)
+        result = run_on_domains(module, san_con_present)
     else:
-        result = san_con_absent(handle, module.params)
+        result = run_on_domains(module, san_con_absent)
 
-    module.exit_json(changed=result)
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
@@ -0,0 +1,393 @@
+#!/usr/bin/python
+
+import time
+
+from ucs import LazyMo
+
+LsServer = LazyMo("LsServer")
+LsBinding = LazyMo("LsBinding")
+LsRequirement = LazyMo("LsRequirement")
+
+DOCUMENTATION = '''
+---
+module: ucs_service_profile
+short_description: Create and Delete ucs service profiles from a template
+author:  "Kyle Jones (@excilsploft)"
+version_added: "<version_tag>"
+description:
+    - Instantiate a numbered set of service profiles from a service profile
+      template in a UCS version 2.2X and Greater, in one commit. The profiles
+      can be associated to a server pool or to explicit blades, and the
+      module can wait for all of them to finish associating.
+notes:
+    - Profiles are named profile_prefix followed by the number, zero padded
+      to number_width digits, e.g. esxi-01 to esxi-40.
+    - Association is tracked with one query covering every pending profile
+      per poll_interval, and each profile reports how long it took.
+    - When running against several domains, set domain_timeout above
+      wait_timeout.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    org_name:
+      description:
+        - "organizational object name the template and profiles live in"
+      required: true
+      default: None
+    template_name:
+      description:
+        - "the service profile template to instantiate"
+      required: true
+      default: None
+    profile_prefix:
+      description:
+        - "name prefix for the profiles"
+      required: true
+      default: None
+    count:
+      description:
+        - "how many profiles to make"
+      required: false
+      default: 1
+    start_number:
+      description:
+        - "number of the first profile"
+      required: false
+      default: 1
+    number_width:
+      description:
+        - "zero pad the profile numbers to this many digits"
+      required: false
+      default: 0
+    server_pool:
+      description:
+        - "server pool to associate the profiles with"
+      required: false
+      default: None
+    blades:
+      description:
+        - "explicit servers to associate the profiles with, one per profile
+           in order, either chassis/slot or a full dn such as
+           sys/rack-unit-3"
+      required: false
+      default: None
+    wait:
+      description:
+        - "wait for the profiles to finish associating"
+      required: false
+      default: true
+    wait_timeout:
+      description:
+        - "seconds to wait for association before failing"
+      required: false
+      default: 1800
+    poll_interval:
+      description:
+        - "seconds between association checks"
+      required: false
+      default: 10
+    state:
+      description:
+        - "a choice, either 'present' or 'absent'"
+      required: false
+      default: present
+'''
+
+EXAMPLES = '''
+# Stamp out forty esxi hosts for the new HR cluster
+- ucs_service_profile:
+    state: present
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    org_name: HR
+    template_name: esxi
+    profile_prefix: esxi-
+    count: 40
+    number_width: 2
+    server_pool: hr_blades
+
+# Pin two profiles to specific blades without waiting
+- ucs_service_profile:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    org_name: HR
+    template_name: esxi
+    profile_prefix: esxi-db-
+    count: 2
+    blades:
+      - 1/1
+      - 1/2
+    wait: false
+'''
+
+
+def profile_names(params):
+    """the numbered profile names"""
+
+    return ["{0}{1}".format(params['profile_prefix'],
+                            str(number).zfill(params['number_width'] or 0))
+            for number in range(params['start_number'],
+                                params['start_number'] + params['count'])]
+
+
+def blade_dn(blade):
+    """chassis/slot or a full dn to the dn of the server"""
+
+    blade = str(blade).strip()
+    if blade.startswith("sys/"):
+        return blade
+    parts = blade.split('/')
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        raise ValueError("invalid blade {0}, expected chassis/slot or a dn"
+                         .format(blade))
+    return "sys/chassis-{0}/blade-{1}".format(*parts)
+
+
+def build_profiles(handle, org_obj, params):
+    """diff the wanted profiles against ucsm, returns (changes, diff) for
+       commit_changes, every profile and its association read in one query"""
+
+    names = profile_names(params)
+    blades = params.get('blades')
+    if blades is not None:
+        if len(blades) != len(names):
+            raise ValueError("{0} blades given for {1} profiles".format(
+                len(blades), len(names)))
+        blades = [blade_dn(blade) for blade in blades]
+
+    dns = [LsServer(parent_mo_or_dn=org_obj, name=name).dn for name in names]
+    current = cache_query_dns(handle, [dn + suffix for dn in dns
+                                       for suffix in ("", "/pn-req", "/pn")])
+
+    template = params['template_name']
+    pool = params.get('server_pool')
+    changes = []
+    diff = dict(before={}, after={})
+
+    for index, (name, dn) in enumerate(zip(names, dns)):
+        profile = current.get(dn)
+        want = dict(src_templ_name=template)
+        if pool:
+            want['server_pool'] = pool
+        if blades:
+            want['blade'] = blades[index]
+        diff['after'][name] = want
+
+        if profile is None:
+            profile = LsServer(parent_mo_or_dn=org_obj, name=name,
+                               src_templ_name=template)
+            if pool:
+                LsRequirement(parent_mo_or_dn=profile, name=pool)
+            if blades:
+                LsBinding(parent_mo_or_dn=profile, pn_dn=blades[index])
+            changes.append(("add", profile))
+            continue
+
+        if profile.type in ("initial-template", "updating-template"):
+            raise ValueError("{0} is a template, not a service profile"
+                             .format(dn))
+
+        requirement = current.get(dn + "/pn-req")
+        binding = current.get(dn + "/pn")
+        diff['before'][name] = dict(
+            src_templ_name=profile.src_templ_name,
+            server_pool=requirement.name if requirement else None,
+            blade=binding.pn_dn if binding else None)
+
+        if diff_props(profile, dict(src_templ_name=template)):
+            changes.append(("add", LsServer(parent_mo_or_dn=org_obj,
+                                            name=name,
+                                            src_templ_name=template)))
+        if pool and diff_props(requirement, dict(name=pool)):
+            changes.append(("add", LsRequirement(parent_mo_or_dn=dn,
+                                                 name=pool)))
+        if blades and diff_props(binding, dict(pn_dn=blades[index])):
+            changes.append(("add", LsBinding(parent_mo_or_dn=dn,
+                                             pn_dn=blades[index])))
+
+    return changes, diff
+
+
+def wait_for_association(handle, dns, timeout, interval):
+    """poll every unfinished profile with a single query per round until all
+       are associated, failed or the timeout passes, returns {dn: result}"""
+
+    start = time.time()
+    results = dict((dn, dict(assoc_state=None, seconds=None))
+                   for dn in dns)
+    pending = set(dns)
+
+    while pending:
+        for dn, profile in handle.query_dns(sorted(pending)).items():
+            result = results[dn]
+            if profile is None:
+                result['assoc_state'] = "missing"
+            else:
+                result.update(assoc_state=profile.assoc_state,
+                              config_state=profile.config_state,
+                              pn_dn=profile.pn_dn)
+            if profile is None or profile.assoc_state in ("associated",
+                                                          "failed") or \
+                    profile.config_state == "failed-to-apply":
+                result['seconds'] = round(time.time() - start, 1)
+                pending.discard(dn)
+
+        if not pending or time.time() - start + interval > timeout:
+            break
+        time.sleep(interval)
+
+    for dn in pending:
+        results[dn]['assoc_state'] = "timeout"
+    return results
+
+
+def profiles_present(handle, params):
+    """make the profiles in one commit, then wait for them to associate"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
+
+    try:
+        changes, diff = build_profiles(handle, org_obj, params)
+    except ValueError as profile_exception:
+        return dict(changed=False, failed=True, msg=str(profile_exception))
+
+    commits = commit_changes(handle, changes, params)
+    result = dict(changed=bool(changes), diff=diff, commits=commits)
+
+    if not params['wait'] or dry_run(handle, params) or \
+            not (params.get('server_pool') or params.get('blades')):
+        return result
+
+    dns = [LsServer(parent_mo_or_dn=org_obj, name=name).dn
+           for name in profile_names(params)]
+    states = wait_for_association(handle, dns, params['wait_timeout'],
+                                  params['poll_interval'])
+    result['profiles'] = [dict(dn=dn, **states[dn]) for dn in dns]
+
+    unfinished = [dn for dn in dns if states[dn]['assoc_state'] !=
+                  "associated" or states[dn].get('config_state') ==
+                  "failed-to-apply"]
+    if unfinished:
+        result.update(failed=True,
+                      msg="{0} of {1} profiles did not associate: {2}".format(
+                          len(unfinished), len(dns), ", ".join(unfinished)))
+    return result
+
+
+def profiles_absent(handle, params):
+    """remove the profiles in one commit"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False)
+
+    dns = [LsServer(parent_mo_or_dn=org_obj, name=name).dn
+           for name in profile_names(params)]
+    profiles = [profile for profile in cache_query_dns(handle, dns).values()
+                if profile is not None and profile.type not in
+                ("initial-template", "updating-template")]
+
+    commit_changes(handle, [("remove", profile) for profile in profiles],
+                   params)
+    return dict(changed=bool(profiles))
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        org_name=dict(
+            required=True,
+            type="str"
+        ),
+        template_name=dict(
+            required=True,
+            type="str"
+        ),
+        profile_prefix=dict(
+            required=True,
+            type="str"
+        ),
+        count=dict(
+            required=False,
+            type="int",
+            default=1
+        ),
+        start_number=dict(
+            required=False,
+            type="int",
+            default=1
+        ),
+        number_width=dict(
+            required=False,
+            type="int",
+            default=0
+        ),
+        server_pool=dict(
+            required=False,
+            type="str"
+        ),
+        blades=dict(
+            required=False,
+            type="list"
+        ),
+        wait=dict(
+            required=False,
+            type="bool",
+            default=True
+        ),
+        wait_timeout=dict(
+            required=False,
+            type="int",
+            default=1800
+        ),
+        poll_interval=dict(
+            required=False,
+            type="int",
+            default=10
+        ),
+        state=dict(
+            default="present",
+            choices=["present", "absent"],
+            type="str"
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec,
+                           mutually_exclusive=[["server_pool", "blades"]],
+                           supports_check_mode=True)
+
+    if module.params['state'] == 'present':
+        result = run_on_domains(module, profiles_present)
+    else:
+        result = run_on_domains(module, profiles_absent)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 #!/usr/bin/python
 
+from ucs import LazyMo
+
+LsServer = LazyMo("LsServer")
+VnicConnDef = LazyMo("VnicConnDef")
+
 DOCUMENTATION = '''
 ---
 module: ucs_service_profile_template
@@ -12,6 +17,9 @@ description:
       org
 notes:
     - This only works with existing templates and policies.
+    - Every referenced pool and policy is looked up in the template org and
+      its parent orgs, the same way ucsm resolves them, with one query for
+      all of them. Missing ones fail the task before anything is committed.
 requirements:
     - "python >= 2.7.5"
     - "ucsmsdk"
@@ -26,6 +34,12 @@ options:
         - "description label for the template"
       required: false
       default: None
+    template_type:
+      description:
+        - "a choice, either 'updating-template' or 'initial-template', only
+           used when the template is created"
+      required: false
+      default: updating-template
     state:
       description:
         - "a choice, either 'present' or 'absent'"
@@ -80,6 +94,7 @@ options:
        required: true
        default: None
     san_con_policy:
+       description:
          - "a san connection policy to use"
        required: true
        default: None
@@ -88,7 +103,7 @@ options:
 
 EXAMPLES = '''
 # Create a esxi template under org HR
-- ucs_service_profile_template
+- ucs_service_profile_template:
   state: present
   hostname: dev_ucsm_hostname
   username: admin
@@ -110,6 +125,176 @@ EXAMPLES = '''
   san_con_policy: esxi_hr_san
 '''
 
+
+# param: (policy class, property on the template or its conn-def, on conn-def)
+POLICY_REFS = [
+    ("uuid", "UuidpoolPool", "ident_pool_name", False),
+    ("bios_policy", "BiosVProfile", "bios_profile_name", False),
+    ("boot_policy", "LsbootPolicy", "boot_policy_name", False),
+    ("firmware_policy", "FirmwareComputeHostPack", "host_fw_policy_name",
+     False),
+    ("disk_policy", "StorageLocalDiskConfigPolicy", "local_disk_policy_name",
+     False),
+    ("management_ip", "IppoolPool", "ext_ip_pool_name", False),
+    ("maintenance_policy", "LsmaintMaintPolicy", "maint_policy_name", False),
+    ("kvm_policy", "ComputeKvmMgmtPolicy", "kvm_mgmt_policy_name", False),
+    ("lan_con_policy", "VnicLanConnPolicy", "lan_conn_policy_name", True),
+    ("san_con_policy", "VnicSanConnPolicy", "san_conn_policy_name", True),
+]
+
+
+def org_ancestors(dn):
+    """the org dn and the dn of every org above it"""
+
+    parts = dn.split('/')
+    return set("/".join(parts[:index]) for index in range(1, len(parts) + 1))
+
+
+def missing_policies(handle, org_dn, params, planned=None):
+    """names of the referenced policies that neither the org nor one of its
+       parent orgs holds, all policy classes fetched in one query.  planned
+       ({class: set of (parent dn, name)}) counts as held too."""
+
+    refs = [(param, class_id) for param, class_id, _, _ in POLICY_REFS
+            if params.get(param)]
+    if not refs:
+        return []
+
+    visible = org_ancestors(org_dn)
+    found = cache_query_classids(handle,
+                                 [class_id for _, class_id in refs])
+
+    missing = []
+    for param, class_id in refs:
+        names = set(mo.name for mo in found.get(class_id, [])
+                    if mo.dn.rsplit('/', 1)[0] in visible)
+        names.update(name for parent_dn, name in
+                     (planned or {}).get(class_id, ())
+                     if parent_dn in visible)
+        if params[param] not in names:
+            missing.append("{0} {1}".format(param, params[param]))
+    return missing
+
+
+def desired_template(params):
+    """split the policy params into template and conn-def properties"""
+
+    template = dict(descr=params['template_descr'])
+    conn_def = {}
+    for param, _, prop, on_conn_def in POLICY_REFS:
+        if on_conn_def:
+            conn_def[prop] = params[param]
+        else:
+            template[prop] = params[param]
+    if params['management_ip']:
+        template['ext_ip_state'] = "pooled"
+    return template, conn_def
+
+
+def build_sp_template(handle, org_obj, params, planned=None):
+    """diff the wanted template against ucsm, returns (changes, diff) for
+       commit_changes, raises ValueError for unresolved policy names.
+       planned holds the policies committed alongside it, as for
+       missing_policies."""
+
+    name = params['service_profile_name']
+    template_dn = LsServer(parent_mo_or_dn=org_obj, name=name).dn
+
+    missing = missing_policies(handle, org_obj.dn, params, planned)
+    if missing:
+        raise ValueError("policies not found in {0} or its parent orgs: "
+                         "{1}".format(org_obj.dn, ", ".join(missing)))
+
+    template_props, conn_def_props = desired_template(params)
+    current = cache_query_dns(handle, [template_dn,
+                                       template_dn + "/conn-def"])
+    template = current.get(template_dn)
+    conn_def = current.get(template_dn + "/conn-def")
+
+    diff = dict(before={}, after=dict(template_props, **conn_def_props))
+    if template is not None:
+        diff['before'] = dict(mo_props(template, template_props),
+                              **mo_props(conn_def, conn_def_props))
+        if template.type not in ("initial-template", "updating-template"):
+            raise ValueError("{0} is a service profile, not a template"
+                             .format(template_dn))
+
+    changes = []
+    if template is None:
+        template = LsServer(parent_mo_or_dn=org_obj, name=name,
+                            type=params.get('template_type') or
+                            "updating-template",
+                            **dict((prop, value) for prop, value in
+                                   template_props.items()
+                                   if value is not None))
+        VnicConnDef(parent_mo_or_dn=template,
+                    **dict((prop, value) for prop, value in
+                           conn_def_props.items() if value is not None))
+        changes.append(("add", template))
+        return changes, diff
+
+    changed = diff_props(template, template_props)
+    if changed:
+        changes.append(("add", LsServer(parent_mo_or_dn=org_obj, name=name,
+                                        **changed)))
+    changed = diff_props(conn_def, conn_def_props)
+    if changed:
+        changes.append(("add", VnicConnDef(parent_mo_or_dn=template_dn,
+                                           **changed)))
+
+    return changes, diff
+
+
+def sp_template_present(handle, params):
+    """make the service profile template, failing on unresolved policies"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False, failed=True,
+                    msg="org {0} not found".format(params['org_name']))
+
+    try:
+        changes, diff = build_sp_template(handle, org_obj, params)
+    except ValueError as template_exception:
+        return dict(changed=False, failed=True, msg=str(template_exception))
+
+    commits = commit_changes(handle, changes, params)
+
+    return dict(changed=bool(changes), diff=diff, commits=commits)
+
+
+def sp_template_absent(handle, params):
+    """remove the service profile template"""
+
+    try:
+        org_obj = get_org(handle, params['org_name'],
+                          params.get('org_cache_ttl'))
+    except ValueError as org_exception:
+        # an ambiguous org name, the message lists the candidates
+        return dict(changed=False, failed=True, msg=str(org_exception))
+
+    if not org_obj:
+        return dict(changed=False)
+
+    template = cache_query_dn(handle, LsServer(
+        parent_mo_or_dn=org_obj, name=params['service_profile_name']).dn)
+    if template is None:
+        return dict(changed=False)
+    if template.type not in ("initial-template", "updating-template"):
+        return dict(changed=False, failed=True,
+                    msg="{0} is a service profile, not a template"
+                    .format(template.dn))
+
+    commit_changes(handle, [("remove", template)], params)
+    return dict(changed=True)
+
+
 def main():
     """main entry point"""
 
@@ -166,6 +351,11 @@ def main():
             required=True,
             type="str"
         ),
+        template_type=dict(
+            default="updating-template",
+            choices=["updating-template", "initial-template"],
+            type="str"
+        ),
         state=dict(
             default="present",
             choices=["present", "absent"],
@@ -174,16 +364,16 @@ def main():
     ))
 
 
-    module = AnsibleModule(argument_spec=spec)
-
-    handle = get_handle(module)
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
 
     if module.params['state'] == 'present':
-        result = sp_template_present(handle, module.params)
+        result = run_on_domains(module, sp_template_present)
     else:
-        result = sp_template_absent(handle, module.params)
+        result = run_on_domains(module, sp_template_absent)
 
-    module.exit_json(changed=result)
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
@@ -0,0 +1,346 @@
+#!/usr/bin/python
+
+import json
+import os
+import tempfile
+import time
+
+DOCUMENTATION = '''
+---
+module: ucs_snapshot
+short_description: Export ucs configuration to json lines files
+author:  "Chris Dunlap (@stoffee)"
+version_added: "<version_tag>"
+description:
+    - Read every object of the listed classes from UCS Manager and write
+      them to one json lines file per class under dest, one directory per
+      domain. Responses are parsed as they stream in and written straight
+      out, so memory use does not grow with the size of the domain.
+notes:
+    - Each line is {"dn": ..., "attrs": {...}} with the attributes sorted;
+      childAction, status and rn are left out.
+    - With incremental set, a refresh reads the ucsm audit log (aaaModLR)
+      past the record the last snapshot ended on and re-reads only the
+      objects it names, with everything below them. When that record has
+      already rolled out of the audit log, or the classes changed, the
+      snapshot is taken in full.
+    - meta.json in each domain directory holds the classes, the object
+      counts, the time taken and the last audit log record seen.
+    - The result reports the directory as snapshot_dir and how it was
+      taken as refresh, see RETURN.
+requirements:
+    - "python >= 2.7.5"
+    - "ucsmsdk"
+options:
+    dest:
+      description:
+        - "directory to write the snapshot to, each domain gets a
+           directory named after its hostname below it"
+      required: true
+      default: None
+    classes:
+      description:
+        - "managed object classes to export"
+      required: false
+      default: the pools, policies, vlans, vsans, orgs and service profiles
+    incremental:
+      description:
+        - "refresh an existing snapshot from the audit log instead of
+           reading everything again"
+      required: false
+      default: true
+'''
+
+RETURN = '''
+snapshot_dir:
+    description: the directory of the domain's snapshot
+    returned: success
+    type: string
+    sample: /var/lib/ucs/snapshots/dev_ucsm_hostname
+refresh:
+    description: how the snapshot was taken, full, incremental from the
+                 audit log, or unchanged when the audit log named nothing
+    returned: success
+    type: string
+    sample: incremental
+counts:
+    description: the number of objects written for each class
+    returned: success
+    type: dict
+    sample: {"lsServer": 120, "orgOrg": 8}
+reread:
+    description: the objects named by the audit log that were re-read
+    returned: when refresh is incremental
+    type: int
+    sample: 3
+last_id:
+    description: the last audit log record the snapshot covers
+    returned: when changed
+    type: string
+    sample: "1042"
+seconds:
+    description: the time the snapshot took
+    returned: when changed
+    type: float
+    sample: 1.52
+'''
+
+EXAMPLES = '''
+# Nightly export of every domain
+- ucs_snapshot:
+    hostnames: "{{ ucs_domains }}"
+    username: admin
+    password: admin
+    dest: /var/lib/ucs/snapshots
+
+# Full export of just the service profiles
+- ucs_snapshot:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    dest: /tmp/ucs
+    incremental: false
+    classes:
+      - lsServer
+      - lsRequirement
+      - lsBinding
+'''
+
+DEFAULT_CLASSES = [
+    "orgOrg",
+    "lsServer",
+    "lsRequirement",
+    "lsBinding",
+    "vnicConnDef",
+    "vnicLanConnPolicy",
+    "vnicEther",
+    "vnicSanConnPolicy",
+    "vnicFcNode",
+    "vnicFc",
+    "fabricVlan",
+    "fabricVsan",
+    "fabricFcVsanPortEp",
+    "ippoolPool",
+    "ippoolBlock",
+    "uuidpoolPool",
+    "uuidpoolBlock",
+    "macpoolPool",
+    "macpoolBlock",
+    "fcpoolInitiators",
+    "fcpoolBlock",
+    "lsbootPolicy",
+    "biosVProfile",
+    "firmwareComputeHostPack",
+    "storageLocalDiskConfigPolicy",
+    "lsmaintMaintPolicy",
+    "computeKvmMgmtPolicy",
+]
+
+SKIPPED_ATTRS = ("childAction", "status", "rn")
+
+
+def class_key(class_id):
+    """class ids as ucsm writes them on the wire, e.g. lsServer"""
+
+    return class_id[0].lower() + class_id[1:]
+
+
+def snapshot_dir(params):
+    """the directory of this domain's snapshot"""
+
+    return domain_dir(params['dest'], params)
+
+
+def record(attrs):
+    """one managed object as a json line"""
+
+    attrs = dict((key, value) for key, value in attrs.items()
+                 if key not in SKIPPED_ATTRS)
+    dn = attrs.pop('dn')
+    return json.dumps(dict(dn=dn, attrs=attrs), sort_keys=True) + "\n"
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            return json.load(meta_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_atomic(path, lines):
+    """write lines to path through a temporary file, returns the count"""
+
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    count = 0
+    try:
+        with os.fdopen(fd, "w") as out_file:
+            for line in lines:
+                out_file.write(line)
+                count += 1
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return count
+
+
+def audit_log(handle, since):
+    """the audit log records newer than since as (id, affected dn, ind), and
+       whether the record since itself is still in the log"""
+
+    records = []
+    found = since == 0
+    for _, attrs in stream_class(
+            handle, "aaaModLR",
+            '<ge class="aaaModLR" property="id" value="{0}"/>'.format(since)):
+        log_id = int(attrs['id'])
+        if log_id == since:
+            found = True
+        elif log_id > since:
+            records.append((log_id, attrs.get('affected'), attrs.get('ind')))
+    return sorted(records), found
+
+
+def under(dn, dns):
+    """whether dn is one of dns or below one of them"""
+
+    parts = dn.split('/')
+    return any("/".join(parts[:index]) in dns
+               for index in range(1, len(parts) + 1))
+
+
+def full_snapshot(handle, path, classes):
+    """read every class into its file, returns (counts, last audit id)"""
+
+    # taken before the classes are read, so changes made while they are
+    # being read are picked up again by the next refresh
+    last_id = 0
+    for _, attrs in stream_class(handle, "aaaModLR"):
+        last_id = max(last_id, int(attrs['id']))
+
+    counts = {}
+    for class_id in classes:
+        counts[class_id] = write_atomic(
+            os.path.join(path, class_id + ".jsonl"),
+            (record(attrs) for _, attrs in stream_class(handle, class_id)))
+    return counts, last_id
+
+
+def refresh_snapshot(handle, path, classes, records):
+    """replace the objects below every dn the audit records name with what
+       ucsm has there now, returns (counts, dns re-read)"""
+
+    affected = set(dn for _, dn, _ in records if dn)
+    reread = sorted(dn for dn in affected
+                    if '/' not in dn or
+                    not under(dn.rsplit('/', 1)[0], affected))
+
+    # a change high up the tree can bring back a lot, so spool it to disk
+    fresh = dict((class_id, tempfile.SpooledTemporaryFile(
+        max_size=1024 * 1024, mode="w+")) for class_id in classes)
+    try:
+        if reread:
+            for class_id, attrs in stream_dns(handle, reread, hierarchy=True):
+                if class_id in fresh:
+                    fresh[class_id].write(record(attrs))
+
+        counts = {}
+        for class_id in classes:
+            class_path = os.path.join(path, class_id + ".jsonl")
+
+            def lines():
+                with open(class_path) as class_file:
+                    for line in class_file:
+                        if not under(json.loads(line)['dn'], affected):
+                            yield line
+                fresh[class_id].seek(0)
+                for line in fresh[class_id]:
+                    yield line
+
+            counts[class_id] = write_atomic(class_path, lines())
+    finally:
+        for spool in fresh.values():
+            spool.close()
+    return counts, reread
+
+
+def snapshot(handle, params):
+    """export the classes, refreshing from the audit log when possible"""
+
+    if getattr(handle, "offline", False):
+        return dict(changed=False, failed=True,
+                    msg="ucs_snapshot needs a live ucsm, not a snapshot")
+
+    path = snapshot_dir(params)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    classes = sorted(set(class_key(class_id) for class_id in
+                         params['classes'] or DEFAULT_CLASSES))
+    meta = read_meta(path)
+    start = time.time()
+    # not path or mode, exit_json would read them as a file's
+    result = dict(snapshot_dir=path)
+
+    records, found = [], False
+    if params['incremental'] and meta and meta.get('classes') == classes \
+            and all(os.path.exists(os.path.join(path, class_id + ".jsonl"))
+                    for class_id in classes):
+        records, found = audit_log(handle, meta['last_id'])
+
+    if found and not records:
+        result.update(changed=False, refresh="unchanged", counts=meta['counts'])
+        return result
+
+    if found:
+        counts, reread = refresh_snapshot(handle, path, classes, records)
+        last_id = records[-1][0]
+        result.update(refresh="incremental", reread=len(reread))
+    else:
+        counts, last_id = full_snapshot(handle, path, classes)
+        result['refresh'] = "full"
+
+    write_atomic(os.path.join(path, "meta.json"), [json.dumps(dict(
+        classes=classes, counts=counts, last_id=last_id, taken=time.time()),
+        sort_keys=True, indent=1)])
+    result.update(changed=True, counts=counts, last_id=last_id,
+                  seconds=round(time.time() - start, 3))
+    return result
+
+
+def main():
+    """main entry point"""
+
+    spec = get_ucs_argument_spec(**dict(
+        dest=dict(
+            required=True,
+            type="path"
+        ),
+        classes=dict(
+            required=False,
+            type="list"
+        ),
+        incremental=dict(
+            required=False,
+            type="bool",
+            default=True
+        ),
+    ))
+
+
+    module = AnsibleModule(argument_spec=spec)
+
+    result = run_on_domains(module, snapshot)
+
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
+
+
+from ansible.module_utils.basic import *
+from ucs import *
+
+if __name__ == '__main__':
+    main()
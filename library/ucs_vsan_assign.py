@@ -1,6 +1,13 @@
 #!/usr/bin/python
 
-from ucsmsdk.mometa.fabric.FabricFcVsanPortEp import FabricFcVsanPortEp
+import re
+
+from ucs import LazyMo
+
+FabricFcVsanPortEp = LazyMo("FabricFcVsanPortEp")
+
+PORT_RE = re.compile(r'^(\d+)/(\d+)(?:-(\d+))?$')
+SWITCH_IDS = ["A", "B"]
 
 
 DOCUMENTATION = '''
@@ -13,6 +20,8 @@ description:
     - Assign FC ports to a VSAN
 notes:
     - VSAN and Unified (ie FC ports) must already be configured
+    - Ports that are already members of the vsan are left alone, so a
+      converged assignment makes no commit and reports no change
 requirements:
     - "python >= 2.7.5"
     - "ucsmsdk"
@@ -24,13 +33,21 @@ options:
       default: None
     switch_id:
       description:
-        - "A UCS Fabric Interconnect (A or B)"
+        - "A UCS Fabric Interconnect (A or B), or a list of both to assign
+           the same ports on each fabric in one commit"
       required: true
+      choices: [A, B]
     ports:
       description:
-        - "a list of unified FC ports in module/port notation (ie 1/16, 3/5, etc)"
+        - "a list of unified FC ports in module/port notation (ie 1/16, 3/5, etc)
+           or port ranges in module/first-last notation (ie 1/1-16)"
       required: true
       default: None
+    exclusive:
+      description:
+        - "remove the vsan's member ports that are not listed"
+      required: false
+      default: false
 '''
 
 EXAMPLES = '''
@@ -48,6 +65,18 @@ EXAMPLES = '''
       - 4/14
       - 4/15
       - 4/16
+
+# Make 1/1-16 and 2/1-48 the only members of vsan 1020 on both fabrics
+- ucs_vsan_assign:
+    hostname: dev_ucsm_hostname
+    username: admin
+    password: admin
+    vsan_id: 1020
+    switch_id: [A, B]
+    exclusive: true
+    ports:
+      - 1/1-16
+      - 2/1-48
 '''
 
 
@@ -56,33 +85,128 @@ def get_vsan(handle, vsan_id, switch_id):
 
     #filter_str = '(id, "{0}", type="eq")'.format(vsan_id)
     vsan_dn = "fabric/san/{0}/net-{1}".format(switch_id, vsan_id)
-    vsan_obj = handle.query_dn(vsan_dn)
+    vsan_obj = cache_query_dn(handle, vsan_dn)
     return vsan_obj
 
+
+def expand_ports(ports):
+    """turn port notation (1/16, or a range such as 1/1-16) into a sorted
+       list of (slot, port) tuples, raises ValueError on anything else"""
+
+    expanded = set()
+    for port in ports or []:
+        match = PORT_RE.match(str(port).strip())
+        if not match:
+            raise ValueError("port {0} is not in slot/port or "
+                             "slot/first-last notation".format(port))
+        slot_id, first, last = match.groups()
+        last = last or first
+        if int(last) < int(first):
+            raise ValueError("port range {0} runs backwards".format(port))
+        for port_id in range(int(first), int(last) + 1):
+            expanded.add((int(slot_id), port_id))
+
+    return sorted(expanded)
+
+
+def port_names(port_keys):
+    """(slot, port) tuples back into slot/port strings"""
+
+    return ["{0}/{1}".format(slot_id, port_id)
+            for slot_id, port_id in sorted(port_keys)]
+
+
+def query_vsan_ports(handle, vsan_id, switch_ids):
+    """read the vsan on every fabric together with its port endpoints in one
+       round trip, returns {switch_id: (vsan, {(slot, port): port ep})} or
+       None if the vsan is missing on any of the fabrics, raises ValueError
+       for a switch id other than A or B"""
+
+    unknown = [str(switch_id) for switch_id in switch_ids
+               if switch_id not in SWITCH_IDS]
+    if unknown:
+        raise ValueError("switch_id {0} is not one of {1}".format(
+            ", ".join(unknown), ", ".join(SWITCH_IDS)))
+
+    vsan_dns = dict(("fabric/san/{0}/net-{1}".format(switch_id, vsan_id),
+                     switch_id) for switch_id in switch_ids)
+
+    vsans = {}
+    port_eps = dict((switch_id, {}) for switch_id in switch_ids)
+    for mo in cache_query_dns_hierarchy(handle, list(vsan_dns)):
+        parent_dn = mo.dn.rsplit('/', 1)[0]
+        if mo.dn in vsan_dns:
+            vsans[vsan_dns[mo.dn]] = mo
+        elif parent_dn in vsan_dns and \
+                mo.get_class_id() == "FabricFcVsanPortEp":
+            key = (int(mo.slot_id), int(mo.port_id))
+            port_eps[vsan_dns[parent_dn]][key] = mo
+
+    if len(vsans) != len(vsan_dns):
+        return None
+
+    return dict((switch_id, (vsans[switch_id], port_eps[switch_id]))
+                for switch_id in switch_ids)
+
+
+def build_port_assignment(handle, vsans, params):
+    """diff the listed ports against the port endpoints the vsan already
+       has on each fabric, returns (changes, diff) for commit_changes.  With
+       exclusive set, member ports that are not listed are removed."""
+
+    wanted = expand_ports(params['ports'])
+    wanted_keys = set(wanted)
+
+    changes = []
+    diff = dict(before={}, after={})
+    for switch_id, (vsan_obj, port_eps) in sorted(vsans.items()):
+        diff['before'][switch_id] = port_names(port_eps)
+        diff['after'][switch_id] = port_names(wanted)
+
+        for slot_id, port_id in wanted:
+            if diff_props(port_eps.get((slot_id, port_id)),
+                          dict(admin_state='enabled')):
+                changes.append(("add", FabricFcVsanPortEp(
+                    parent_mo_or_dn=vsan_obj.dn,
+                    name="",
+                    auto_negotiate='enabled',
+                    switch_id=switch_id,
+                    slot_id=str(slot_id),
+                    port_id=str(port_id),
+                    admin_state='enabled')))
+
+        if params.get('exclusive'):
+            for key, port_ep in sorted(port_eps.items()):
+                if key not in wanted_keys:
+                    changes.append(("remove", port_ep))
+        else:
+            diff['after'][switch_id] = port_names(wanted_keys |
+                                                  set(port_eps))
+
+    return changes, diff
+
+
 def assign_ports(handle,  params):
-    """ assign the ports to the vsan """
+    """ assign the ports to the vsan on every listed fabric in one commit """
 
     vsan_id = params['vsan_id']
-    switch_id = params['switch_id']
+    switch_ids = params['switch_id']
 
-    vsan_obj = get_vsan(handle, vsan_id, switch_id)
+    try:
+        expand_ports(params['ports'])
+        vsans = query_vsan_ports(handle, vsan_id, switch_ids)
+    except ValueError as port_exception:
+        return dict(changed=False, failed=True, msg=str(port_exception))
 
-    if vsan_obj:
-        for port in params['ports']:
-            slot_id, port_id = port.split('/')
-            port_ep = FabricFcVsanPortEp(parent_mo_or_dn=vsan_obj,
-                                         name="",
-                                         auto_negotiate='yes',
-                                         switch_id=switch_id,
-                                         slot_id=slot_id,
-                                         admin_state='enabled',
-                                         port_id=port_id)
-            handle.add_mo(port_ep, True)
+    if not vsans:
+        return dict(changed=False, failed=True,
+                    msg="vsan {0} not found on fabric {1}".format(
+                        vsan_id, ", ".join(switch_ids)))
 
-        handle.commit()
-        return True
-    else:
-        return False
+    changes, diff = build_port_assignment(handle, vsans, params)
+    commits = commit_changes(handle, changes, params)
+
+    return dict(changed=bool(changes), diff=diff, commits=commits)
 
 
 
@@ -96,21 +220,27 @@ def main():
         ),
         switch_id=dict(
             required=True,
-            type="str"
+            type="list",
+            choices=SWITCH_IDS
         ),
         ports=dict(
             type="list"
         ),
+        exclusive=dict(
+            required=False,
+            type="bool",
+            default=False
+        ),
     ))
 
 
-    module = AnsibleModule(argument_spec=spec)
-
-    handle = get_handle(module)
+    module = AnsibleModule(argument_spec=spec, supports_check_mode=True)
 
-    result = assign_ports(handle, module.params)
+    result = run_on_domains(module, assign_ports)
 
-    module.exit_json(changed=result)
+    if result.get('failed'):
+        module.fail_json(**result)
+    module.exit_json(**result)
 
 
 from ansible.module_utils.basic import *
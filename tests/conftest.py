@@ -0,0 +1,86 @@
+"""Fixtures running the modules against the stand-in UCSM of bench/."""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY = os.path.join(ROOT, "library")
+sys.path.insert(0, LIBRARY)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import mock_ucsm
+import ucs
+
+
+@pytest.fixture
+def tree():
+    """the stand-in's objects: the login objects, the root org and the
+       tenant orgs, two of them named Prod"""
+
+    tree = mock_ucsm.seed_tree(mock_ucsm.MoTree())
+    for dn in ("org-root/org-exchange", "org-root/org-Prod",
+               "org-root/org-HR", "org-root/org-HR/org-Prod"):
+        tree.add("orgOrg", dn, name=dn.rsplit("/org-", 1)[-1], descr="")
+    return tree
+
+
+@pytest.fixture
+def server(tree, tmp_path, monkeypatch):
+    """a stand-in UCSM serving tree, with an org index of its own"""
+
+    monkeypatch.setattr(ucs, "ORG_CACHE_DIR", str(tmp_path / "orgs"))
+    server = mock_ucsm.start_server(tree=tree)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def params(server):
+    """the options of a task against the stand-in, every other one at its
+       default"""
+
+    params = dict((name, option.get('default')) for name, option in
+                  ucs.get_ucs_argument_spec().items())
+    params.update(hostname="127.0.0.1", username="admin",
+                  password="password", port=server.server_address[1],
+                  secure=False, broker_socket=None, commit_backoff=0)
+    return params
+
+
+@pytest.fixture
+def handle(params):
+    """a session logged in to the stand-in"""
+
+    handle = ucs.open_handle(params)
+    yield handle
+    handle.logout()
+    del ucs.HANDLE_LIST[:]
+
+
+@pytest.fixture
+def run_module(server, tmp_path):
+    """run_module(name, **args) runs library/<name>.py against the
+       stand-in as ansible would and returns (rc, result)"""
+
+    def run(name, **args):
+        args.update(hostname="127.0.0.1", username="admin",
+                    password="password", port=server.server_address[1],
+                    secure=False)
+        args_path = tmp_path / "args.json"
+        args_path.write_text(json.dumps(dict(ANSIBLE_MODULE_ARGS=args)))
+        env = dict(os.environ, UCS_ORG_CACHE_DIR=str(tmp_path / "orgs"),
+                   UCS_BROKER_SOCKET="")
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(LIBRARY, name + ".py"),
+             str(args_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env)
+        out, err = process.communicate()
+        assert b"Traceback" not in err, err.decode("utf-8")
+        return process.returncode, json.loads(out.decode("utf-8"))
+
+    return run
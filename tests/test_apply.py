@@ -0,0 +1,116 @@
+"""Batches of ucs_apply against the stand-in."""
+
+from test_modules import VNICS
+from ucs_apply import apply_objects
+
+ORG_DN = "org-root/org-exchange"
+TEMPLATE = dict(type="sp_template", org_name="root/exchange",
+                service_profile_name="exchange", management_ip="mgmt",
+                lan_con_policy="exchange")
+LAN_CONN = dict(type="lan_conn", org_name="root/exchange",
+                lan_con_name="exchange", vnics=VNICS)
+
+
+def ip_pool(name, first, count):
+    return dict(type="ip_pool", org_name="root/exchange", ip_pool_name=name,
+                ip_v4_pool_block=[dict(starting_address=first,
+                                       number_of_ip=count)])
+
+
+def apply(params, handle, objects, **options):
+    task = dict(params, objects=objects, chunk_size=0)
+    task.update(options)
+    return apply_objects(handle, task)
+
+
+def statuses(result):
+    return [(entry.get('name'), entry['status'])
+            for entry in result['results']]
+
+
+def test_template_naming_pool_and_policy_of_the_batch(server, params,
+                                                      handle):
+    result = apply(params, handle, [TEMPLATE, LAN_CONN,
+                                    ip_pool("mgmt", "10.20.0.10", 100)])
+    assert not result.get('failed'), result
+    assert statuses(result) == [("exchange", "changed"),
+                                ("exchange", "changed"),
+                                ("mgmt", "changed")]
+    assert len(result['commits']) == 1
+    # pools and policies go out before the template naming them
+    dns = list(result['commits'][0]['mos'])
+    assert dns.index(ORG_DN + "/ip-pool-mgmt") < \
+        dns.index(ORG_DN + "/ls-exchange")
+    assert dns.index(ORG_DN + "/lan-conn-pol-exchange") < \
+        dns.index(ORG_DN + "/ls-exchange")
+
+    result = apply(params, handle, [TEMPLATE, LAN_CONN,
+                                    ip_pool("mgmt", "10.20.0.10", 100)])
+    assert [status for _, status in statuses(result)] == ["unchanged"] * 3
+
+
+def test_template_naming_a_failed_pool_fails(params, handle):
+    result = apply(params, handle, [TEMPLATE, LAN_CONN,
+                                    ip_pool("mgmt", "10.20.0.10", 0)])
+    assert statuses(result) == [("exchange", "failed"),
+                                ("exchange", "changed"),
+                                ("mgmt", "failed")]
+    assert "management_ip mgmt" in result['results'][0]['msg']
+
+
+def test_pools_overlapping_in_one_batch(server, params, handle):
+    result = apply(params, handle, [ip_pool("a", "10.30.0.1", 10),
+                                    ip_pool("b", "10.30.0.5", 10),
+                                    ip_pool("c", "10.30.0.21", 10)])
+    assert statuses(result) == [("a", "failed"), ("b", "failed"),
+                                ("c", "changed")]
+    assert result['failed'] and "overlap" in result['results'][0]['msg']
+    assert ORG_DN + "/ip-pool-a" not in server.ucsm.tree.mos
+
+
+def test_blocks_moving_between_pools_of_one_batch(params, handle):
+    apply(params, handle, [ip_pool("a", "10.30.0.1", 10)])
+    result = apply(params, handle, [ip_pool("a", "10.30.1.1", 10),
+                                    ip_pool("b", "10.30.0.1", 10)])
+    assert statuses(result) == [("a", "changed"), ("b", "changed")]
+
+
+def test_object_missing_an_option_fails_alone(params, handle):
+    result = apply(params, handle, [
+        dict((key, value) for key, value in LAN_CONN.items()
+             if key != "lan_con_name"),
+        dict(LAN_CONN, vnics=[dict(name="eth0", templ="a", policy="b")]),
+        dict(type="mystery"),
+        dict(LAN_CONN, lan_con_name="good")])
+    assert [entry['status'] for entry in result['results']] == [
+        "failed", "failed", "failed", "changed"]
+    assert [entry['msg'] for entry in result['results'][:3]] == [
+        "object 1 has no lan_con_name", "object 2 has no order",
+        "unknown object type mystery"]
+
+
+def test_commit_failure_fails_its_chunk_and_skips_the_rest(server, params,
+                                                           handle):
+    server.ucsm.busy_commits = 3
+    result = apply(params, handle, [
+        dict(LAN_CONN, lan_con_name="one"),
+        dict(LAN_CONN, lan_con_name="two"),
+        dict(LAN_CONN, lan_con_name="three")],
+        chunk_size=1, commit_retries=2)
+    assert [entry['status'] for entry in result['results']] == [
+        "failed", "skipped", "skipped"]
+    assert "system is busy" in result['results'][0]['msg']
+    assert result['failed'] and result['msg'] == "1 of 3 objects failed"
+    assert result['commits'] == []
+
+
+def test_commit_failure_after_a_chunk_went_through(server, params, handle):
+    result = apply(params, handle, [dict(LAN_CONN, lan_con_name="one")])
+    server.ucsm.busy_commits = 3
+    result = apply(params, handle, [
+        dict(LAN_CONN, lan_con_name="one"),
+        dict(LAN_CONN, lan_con_name="two"),
+        dict(LAN_CONN, lan_con_name="three")],
+        chunk_size=1, commit_retries=2)
+    assert [entry['status'] for entry in result['results']] == [
+        "unchanged", "failed", "skipped"]
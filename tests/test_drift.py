@@ -0,0 +1,65 @@
+"""Drift reports of ucs_drift against the stand-in."""
+
+import json
+
+from test_modules import POLICY_DN, VNICS, lan_conn
+from ucs_drift import drift
+from ucs_lan_conn import vcon_present
+
+LAN_CONN = dict(type="lan_conn", org_name="exchange",
+                lan_con_name="exchange", lan_con_descr="exchange",
+                vnics=VNICS)
+IP_POOL = dict(type="ip_pool", org_name="exchange", ip_pool_name="mgmt",
+               ip_v4_pool_block=[dict(starting_address="10.20.0.10",
+                                      number_of_ip=10)])
+
+
+def check(params, handle, **options):
+    task = dict(params, objects=None, desired_state=None)
+    task.update(options)
+    return drift(handle, task)
+
+
+def test_converged_objects_do_not_drift(params, handle):
+    vcon_present(handle, lan_conn(params))
+    result = check(params, handle, objects=[LAN_CONN])
+    assert not result['changed']
+    assert (result['checked'], result['drifted'], result['drift']) == \
+        (1, 0, [])
+
+
+def test_changed_and_missing_objects_drift(server, params, handle):
+    vcon_present(handle, lan_conn(params))
+    server.ucsm.tree.mos[POLICY_DN + "/ether-eth1"][1]['nwTemplName'] = \
+        "changed-by-hand"
+
+    result = check(params, handle, objects=[LAN_CONN, IP_POOL])
+    assert not result['changed'] and result['drifted'] == 2
+    lan, pool = result['drift']
+    assert (lan['name'], lan['status']) == ("exchange", "drifted")
+    assert [(change['op'], change['dn'], change['props']['nw_templ_name'])
+            for change in lan['changes']] == [
+        ("add", POLICY_DN + "/ether-eth1", "exchange-b")]
+    assert (pool['name'], pool['status']) == ("mgmt", "drifted")
+    assert [change['class_id'] for change in pool['changes']] == [
+        "IppoolPool", "IppoolBlock"]
+    assert "org-root/org-exchange/ip-pool-mgmt" not in server.ucsm.tree.mos
+
+
+def test_domain_objects_from_desired_state(params, handle, tmp_path):
+    vcon_present(handle, lan_conn(params))
+    state_path = tmp_path / "desired.json"
+    state_path.write_text(json.dumps(dict(
+        objects=[LAN_CONN],
+        domains={"127.0.0.1:{0}".format(params['port']): [IP_POOL],
+                 "elsewhere": [dict(LAN_CONN, lan_con_name="other")]})))
+    result = check(params, handle, desired_state=str(state_path))
+    assert result['checked'] == 2
+    assert [entry['name'] for entry in result['drift']] == ["mgmt"]
+
+
+def test_failed_object_is_reported(params, handle):
+    result = check(params, handle, objects=[dict(LAN_CONN, org_name="Prod")])
+    assert result['drifted'] == 1
+    assert result['drift'][0]['status'] == "failed"
+    assert "ambiguous" in result['drift'][0]['msg']
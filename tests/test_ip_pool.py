@@ -0,0 +1,64 @@
+"""Block overlaps of ucs_ip_pool."""
+
+import pytest
+
+from ip_pool import desired_blocks, find_overlaps
+
+
+def test_no_overlap():
+    assert find_overlaps([("10.0.0.1", "10.0.0.10")], {
+        "org-root/ip-pool-a/block-10.0.0.11-10.0.0.20":
+            ("10.0.0.11", "10.0.0.20")}) == []
+
+
+def test_overlap_with_existing_block():
+    assert find_overlaps([("10.0.0.5", "10.0.0.14")], {
+        "org-root/ip-pool-a/block-10.0.0.1-10.0.0.10":
+            ("10.0.0.1", "10.0.0.10")}) == [
+        "10.0.0.5-10.0.0.14 overlaps "
+        "org-root/ip-pool-a/block-10.0.0.1-10.0.0.10"]
+
+
+def test_wanted_blocks_overlapping_each_other():
+    overlaps = find_overlaps([("10.0.0.1", "10.0.0.100"),
+                              ("10.0.0.10", "10.0.0.20"),
+                              ("10.0.0.50", "10.0.0.60"),
+                              ("10.0.1.1", "10.0.1.10")], {})
+    assert overlaps == ["10.0.0.10-10.0.0.20 overlaps 10.0.0.1-10.0.0.100",
+                        "10.0.0.50-10.0.0.60 overlaps 10.0.0.1-10.0.0.100"]
+
+
+def test_existing_blocks_overlapping_each_other_are_not_reported():
+    assert find_overlaps([("10.0.1.1", "10.0.1.10")], {
+        "a": ("10.0.0.1", "10.0.0.100"),
+        "b": ("10.0.0.50", "10.0.0.60")}) == []
+
+
+def test_touching_blocks_do_not_overlap():
+    assert find_overlaps([("10.0.0.1", "10.0.0.10"),
+                          ("10.0.0.11", "10.0.0.20")], {}) == []
+
+
+def test_desired_blocks():
+    blocks = desired_blocks(dict(ip_v4_pool_block=[dict(
+        starting_address="10.0.0.250", number_of_ip=10,
+        default_route="10.0.0.1")]))
+    assert list(blocks) == [("10.0.0.250", "10.0.1.3")]
+    assert blocks[("10.0.0.250", "10.0.1.3")]['def_gw'] == "10.0.0.1"
+
+
+@pytest.mark.parametrize("block", [
+    dict(number_of_ip=10),
+    dict(starting_address="10.0.0.256", number_of_ip=10),
+    dict(starting_address="10.0.0.1", number_of_ip=0),
+    dict(starting_address="255.255.255.250", number_of_ip=10),
+])
+def test_desired_blocks_invalid(block):
+    with pytest.raises(ValueError):
+        desired_blocks(dict(ip_v4_pool_block=[block]))
+
+
+def test_desired_blocks_listed_twice():
+    block = dict(starting_address="10.0.0.1", number_of_ip=10)
+    with pytest.raises(ValueError, match="listed twice"):
+        desired_blocks(dict(ip_v4_pool_block=[block, dict(block)]))
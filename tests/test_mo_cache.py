@@ -0,0 +1,100 @@
+"""MoCache expiry, invalidation and the broker's event channel."""
+
+import time
+
+from ucs import MoCache
+from ucs_broker import EventWatcher
+
+POLICY_DN = "org-root/lan-conn-pol-web"
+KEYS = ["dn:" + POLICY_DN, "dn:" + POLICY_DN + "/ether-eth0",
+        "tree:org-root", "tree:" + POLICY_DN + "/ether-eth0",
+        "dn:org-root/org-HR", "class:vnicEther", "class:orgOrg"]
+
+
+def filled(**options):
+    cache = MoCache(**options)
+    now = time.time()
+    for key in KEYS:
+        cache.put(key, now, ["<{0}/>".format(key.split(":")[0])])
+    return cache
+
+
+def test_fresh_within_ttl_and_dropped_after():
+    cache = MoCache(ttl=60)
+    now = time.time()
+    cache.put("dn:org-root", now - 30, ["<orgOrg/>"])
+    cache.put("dn:org-root/org-HR", now - 61, ["<orgOrg/>"])
+    assert list(cache.get(["dn:org-root", "dn:org-root/org-HR"])) == [
+        "dn:org-root"]
+    assert "dn:org-root/org-HR" not in cache.entries
+
+
+def test_watched_reads_outlive_the_ttl():
+    cache = MoCache(ttl=0)
+    cache.watching(True)
+    cache.put("dn:org-root", time.time(), ["<orgOrg/>"])
+    assert list(cache.get(["dn:org-root"])) == ["dn:org-root"]
+    cache.watching(False)
+    assert cache.get(["dn:org-root"]) == {}
+
+
+def test_invalidate_a_dn():
+    cache = filled()
+    cache.invalidate([POLICY_DN + "/ether-eth0"], ["vnicEther"])
+    assert sorted(cache.get(KEYS)) == ["class:orgOrg", "dn:" + POLICY_DN,
+                                       "dn:org-root/org-HR"]
+
+
+def test_invalidate_a_subtree_of_any_class():
+    cache = filled()
+    cache.invalidate([POLICY_DN])
+    assert sorted(cache.get(KEYS)) == ["dn:org-root/org-HR"]
+
+
+def test_read_started_before_a_change_is_not_stored():
+    cache = MoCache()
+    read_at = time.time() - 1
+    cache.invalidate(["org-root/org-HR"], [])
+    assert not cache.put("dn:org-root/org-HR", read_at, ["<orgOrg/>"])
+    assert cache.put("dn:org-root", read_at, ["<orgOrg/>"])
+    assert cache.put("dn:org-root/org-HR", time.time(), ["<orgOrg/>"])
+
+
+def test_changes_past_the_history_make_older_reads_stale():
+    cache = MoCache(history=2)
+    read_at = time.time() - 1
+    for index in range(3):
+        cache.invalidate(["org-root/org-{0}".format(index)], [])
+    assert not cache.put("dn:org-root/org-HR", read_at, ["<orgOrg/>"])
+
+
+def test_least_recently_used_out_first():
+    cache = MoCache(max_bytes=60)
+    now = time.time()
+    for name in ("a", "b", "c"):
+        cache.put("dn:" + name, now, ["x" * 15])
+    cache.get(["dn:a"])
+    cache.put("dn:d", now, ["x" * 15])
+    assert sorted(cache.entries) == ["dn:a", "dn:c", "dn:d"]
+    assert cache.size == 3 * len("dn:a" + "x" * 15)
+    assert not cache.put("dn:big", now, ["x" * 100])
+
+
+def test_event_drops_what_it_names():
+    cache = filled()
+    EventWatcher(None, cache).changed(
+        '<methodVessel><inStimuli><configMoChangeEvent><inConfig>'
+        '<vnicEther dn="{0}/ether-eth0" status="modified"/>'
+        '</inConfig></configMoChangeEvent></inStimuli></methodVessel>'
+        .format(POLICY_DN))
+    assert sorted(cache.get(KEYS)) == ["class:orgOrg", "dn:" + POLICY_DN,
+                                       "dn:org-root/org-HR"]
+
+
+def test_deletion_event_drops_every_class():
+    cache = filled()
+    EventWatcher(None, cache).changed(
+        '<configMoChangeEvent><inConfig><vnicLanConnPolicy dn="{0}" '
+        'status="deleted"/></inConfig></configMoChangeEvent>'
+        .format(POLICY_DN))
+    assert sorted(cache.get(KEYS)) == ["dn:org-root/org-HR"]
@@ -0,0 +1,125 @@
+"""Module task functions and whole module runs against the stand-in."""
+
+import ucs
+import ucs_rolling
+from ucs_lan_conn import vcon_absent, vcon_present
+
+POLICY_DN = "org-root/org-exchange/lan-conn-pol-exchange"
+VNICS = [dict(name="eth0", order=1, templ="exchange-a", policy="Windows"),
+         dict(name="eth1", order=2, templ="exchange-b", policy="Windows")]
+
+
+def lan_conn(params, **options):
+    task = dict(params, org_name="exchange", lan_con_name="exchange",
+                lan_con_descr="exchange", vnics=VNICS)
+    task.update(options)
+    return task
+
+
+def commits(server):
+    methods = server.ucsm.snapshot_stats()['methods']
+    return methods.get('configConfMos', {}).get('calls', 0)
+
+
+def test_create_converge_absent(server, params, handle):
+    result = vcon_present(handle, lan_conn(params))
+    assert result['changed'] and not result.get('failed')
+    assert [len(chunk['mos']) for chunk in result['commits']] == [3]
+    assert server.ucsm.tree.mos[POLICY_DN + "/ether-eth1"][1][
+        'nwTemplName'] == "exchange-b"
+
+    server.ucsm.reset_stats()
+    result = vcon_present(handle, lan_conn(params))
+    assert not result['changed'] and result['commits'] == []
+    assert commits(server) == 0
+
+    result = vcon_absent(handle, lan_conn(params))
+    assert result['changed']
+    assert POLICY_DN not in server.ucsm.tree.mos
+    assert not vcon_absent(handle, lan_conn(params))['changed']
+
+
+def test_check_mode(server, params, handle):
+    server.ucsm.reset_stats()
+    result = vcon_present(handle, lan_conn(params, check_mode=True))
+    assert result['changed'] and result['commits'] == []
+    assert sorted(result['diff']['after']['vnics']) == ["eth0", "eth1"]
+    assert POLICY_DN not in server.ucsm.tree.mos
+    assert commits(server) == 0
+
+
+def test_commit_error_past_retries(server, run_module):
+    server.ucsm.busy_commits = 10
+    rc, result = run_module("ucs_lan_conn", org_name="exchange",
+                            lan_con_name="exchange", vnics=VNICS,
+                            commit_retries=2, commit_backoff=0)
+    assert rc == 1 and result['failed']
+    assert "system is busy" in result['msg']
+    assert result['commits'] == [] and not result['changed']
+    assert commits(server) == 3
+    assert POLICY_DN not in server.ucsm.tree.mos
+
+
+def test_commit_retried_until_taken(server, params, handle):
+    server.ucsm.busy_commits = 2
+    result = vcon_present(handle, lan_conn(params, commit_retries=2))
+    assert result['changed']
+    assert result['commits'][0]['attempts'] == 3
+
+
+def test_ambiguous_org(params, handle, run_module):
+    result = vcon_present(handle, lan_conn(params, org_name="Prod"))
+    assert result['failed'] and not result['changed']
+    assert "org-root/org-Prod" in result['msg']
+    assert "org-root/org-HR/org-Prod" in result['msg']
+
+    rc, result = run_module("ucs_lan_conn", org_name="Prod",
+                            lan_con_name="exchange", vnics=VNICS)
+    assert rc == 1 and "ambiguous" in result['msg']
+
+    result = vcon_present(handle, lan_conn(params, org_name="root/HR/Prod"))
+    assert result['changed'] and not result.get('failed')
+
+
+def test_apply_ambiguous_org_fails_only_its_objects(server, run_module):
+    rc, result = run_module("ucs_apply", objects=[
+        dict(type="lan_conn", org_name="Prod", lan_con_name="one",
+             vnics=VNICS),
+        dict(type="lan_conn", org_name="exchange", lan_con_name="two",
+             vnics=VNICS)])
+    assert rc == 1
+    assert [entry['status'] for entry in result['results']] == \
+        ["failed", "changed"]
+    assert "org-root/org-exchange/lan-conn-pol-two" in server.ucsm.tree.mos
+
+
+def test_rolling_discover_on_snapshot(tree):
+    other_dn = "org-root/org-exchange/lan-conn-pol-other"
+    for index, policy_dn in enumerate([POLICY_DN, other_dn, POLICY_DN]):
+        profile = "org-root/org-exchange/ls-sp{0}".format(index)
+        tree.add("lsServer", profile, name="sp{0}".format(index),
+                 type="instance",
+                 pnDn="sys/chassis-1/blade-{0}".format(index + 1))
+        tree.add("vnicConnDef", profile + "/conn-def",
+                 operLanConnPolicyName=policy_dn)
+        tree.add("vnicEther", profile + "/ether-eth0", name="eth0",
+                 order=1, switchId="A")
+        tree.add("lsmaintAck", profile + "/ack", adminState="untriggered",
+                 operState="waiting-for-user")
+    tree.add("lsServer", "org-root/org-exchange/ls-template",
+             name="template", type="updating-template")
+    tree.add("vnicConnDef", "org-root/org-exchange/ls-template/conn-def",
+             operLanConnPolicyName=POLICY_DN)
+
+    snapshot = ucs.SnapshotHandle(name="backup")
+    for dn, (class_id, attrs) in tree.mos.items():
+        snapshot.add(class_id, dict(attrs))
+
+    servers = ucs_rolling.discover(snapshot, POLICY_DN, "lan")
+    assert [server['profile'] for server in servers] == [
+        "org-root/org-exchange/ls-sp0", "org-root/org-exchange/ls-sp2"]
+    report = ucs_rolling.roll_out(snapshot, dict(
+        rolling=True, wave_size="1", fabric_order=["A", "B"]),
+        POLICY_DN, "lan")
+    assert report['bound'] == 2 and not report['changed']
+    assert [wave['state'] for wave in report['waves']] == ["planned"] * 2
@@ -0,0 +1,59 @@
+"""Whole-org reconciliation of ucs_org_state against the stand-in."""
+
+from test_modules import VNICS
+from ucs_org_state import reconcile_org
+
+ORG_DN = "org-root/org-exchange"
+
+
+def pool(name, first, count):
+    return dict(ip_pool_name=name, ip_v4_pool_block=[dict(
+        starting_address=first, number_of_ip=count)])
+
+
+def reconcile(params, handle, **sections):
+    task = dict(params, org_name="exchange", prune=False, ip_pools=[],
+                lan_conns=[], san_conns=[], vsan_assigns=[], sp_templates=[])
+    task.update(sections)
+    return reconcile_org(handle, task)
+
+
+def statuses(result):
+    return dict((entry['name'], entry['status'])
+                for entry in result['results'])
+
+
+def test_templates_after_what_they_name(server, params, handle):
+    result = reconcile(
+        params, handle, ip_pools=[pool("mgmt", "10.20.0.10", 100)],
+        lan_conns=[dict(lan_con_name="web", vnics=VNICS)],
+        sp_templates=[dict(service_profile_name="web", management_ip="mgmt",
+                           lan_con_policy="web")])
+    assert not result.get('failed'), result
+    assert [(step['action'], step['type']) for step in result['plan']] == [
+        ("create", "ip_pool"), ("create", "lan_conn"),
+        ("create", "sp_template")]
+    assert len(result['commits']) == 1
+    assert ORG_DN + "/ls-web" in server.ucsm.tree.mos
+
+
+def test_pools_overlapping_in_one_definition(server, params, handle):
+    result = reconcile(params, handle, ip_pools=[
+        pool("a", "10.30.0.1", 10), pool("b", "10.30.0.5", 10),
+        pool("c", "10.30.0.21", 10)])
+    assert statuses(result) == dict(a="failed", b="failed", c="changed")
+    assert ORG_DN + "/ip-pool-b" not in server.ucsm.tree.mos
+    assert ORG_DN + "/ip-pool-c" in server.ucsm.tree.mos
+
+
+def test_entry_missing_an_option_fails_alone(params, handle):
+    result = reconcile(params, handle, lan_conns=[
+        dict(lan_con_name="bad", vnics=[dict(name="eth0", templ="a",
+                                             policy="b")]),
+        dict(lan_con_name="good", vnics=VNICS)])
+    assert statuses(result) == dict(bad="failed", good="changed")
+    assert result['results'][0]['msg'] == "lan_conn bad has no order"
+
+    result = reconcile(params, handle, lan_conns=[dict(vnics=VNICS)])
+    assert result['failed'] and \
+        result['msg'] == "an entry of lan_conns has no lan_con_name"
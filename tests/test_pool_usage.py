@@ -0,0 +1,60 @@
+"""Interval arithmetic and reads of ucs_pool_usage."""
+
+from ucs_pool_usage import (count_within, hex_to_int, merge_intervals,
+                            pool_usage, read_pools)
+
+
+def test_merge_overlapping_touching_and_apart():
+    assert merge_intervals([(20, 30), (1, 10), (5, 12), (13, 15),
+                            (40, 40), (25, 26)]) == [[1, 15], [20, 30],
+                                                     [40, 40]]
+
+
+def test_merge_contained_and_empty():
+    assert merge_intervals([(1, 100), (10, 20), (50, 60)]) == [[1, 100]]
+    assert merge_intervals([]) == []
+
+
+def test_count_within():
+    merged = [[1, 10], [20, 30]]
+    assert count_within(merged, [0, 1, 10, 11, 19, 20, 25, 30, 31]) == 5
+    assert count_within(merged, []) == 0
+
+
+def test_hex_to_int():
+    assert hex_to_int("00:25:B5:00:00:0A") == 0x0025b500000a
+    assert hex_to_int("0000-00000000000F") == 15
+
+
+def test_pool_usage_counts_overlapping_blocks_once():
+    usage = pool_usage(dict(kind="ip", name="mgmt",
+                            dn="org-root/org-HR/ip-pool-mgmt",
+                            blocks=[(1, 10), (5, 14), (100, 109)],
+                            addresses=[1, 2, 2, 14, 100, 50]))
+    assert usage == dict(kind="ip", name="mgmt",
+                         dn="org-root/org-HR/ip-pool-mgmt",
+                         org="org-root/org-HR", size=24, used=4, free=20,
+                         outside=1, blocks=3, percent_used=16.7)
+
+
+def test_pool_usage_of_an_empty_pool():
+    usage = pool_usage(dict(kind="mac", name="empty", dn="org-root/mac-pool-e",
+                            blocks=[], addresses=[]))
+    assert usage['size'] == 0 and usage['percent_used'] is None
+
+
+def test_read_pools_leaves_out_unassigned(tree, handle):
+    pool_dn = "org-root/ip-pool-mgmt"
+    tree.add("ippoolPool", pool_dn, name="mgmt")
+    tree.add("ippoolBlock", pool_dn + "/block-10.0.0.1-10.0.0.10",
+             **{"from": "10.0.0.1", "to": "10.0.0.10"})
+    for last, assigned in enumerate(["yes", "no", "false", "true"], 1):
+        tree.add("ippoolPooled", "{0}/pooled-10.0.0.{1}".format(
+            pool_dn, last), id="10.0.0.{0}".format(last), assigned=assigned)
+    tree.add("ippoolBlock", "org-root/ip-pool-gone/block-10.1.0.1-10.1.0.2",
+             **{"from": "10.1.0.1", "to": "10.1.0.2"})
+
+    pools = read_pools(handle, ["ip"])
+    assert list(pools) == [pool_dn]
+    usage = pool_usage(pools[pool_dn])
+    assert (usage['size'], usage['used'], usage['free']) == (10, 2, 8)
@@ -0,0 +1,94 @@
+"""Wave planning of ucs_rolling, and when a task rolls out at all."""
+
+import pytest
+
+import ucs_rolling
+from ucs_rolling import plan_waves, wave_count
+
+
+def blade(chassis, slot, fabric="A"):
+    server = "sys/chassis-{0}/blade-{1}".format(chassis, slot)
+    return dict(profile="org-root/ls-c{0}b{1}".format(chassis, slot),
+                server=server, chassis=ucs_rolling.chassis_of(server),
+                fabric=fabric)
+
+
+def slots(wave):
+    return [server['server'][len("sys/"):] for server in wave]
+
+
+@pytest.mark.parametrize("wave_size, total, size", [
+    ("3", 10, 3), (3, 10, 3), ("10%", 160, 16), ("10%", 5, 1),
+    ("25%", 10, 3), ("100%", 7, 7)])
+def test_wave_count(wave_size, total, size):
+    assert wave_count(wave_size, total) == size
+
+
+@pytest.mark.parametrize("wave_size", ["0", "-1", "0%", "ten", "", "5%%"])
+def test_wave_count_invalid(wave_size):
+    with pytest.raises(ValueError):
+        wave_count(wave_size, 10)
+
+
+def test_waves_of_wave_size():
+    servers = [blade(1, slot) for slot in range(1, 8)]
+    waves = plan_waves(servers, "3", 0, ["A", "B"])
+    assert [len(wave) for wave in waves] == [3, 3, 1]
+    assert sorted(server['profile'] for wave in waves for server in wave) \
+        == sorted(server['profile'] for server in servers)
+
+
+def test_chassis_limit_takes_the_chassis_in_turn():
+    servers = [blade(chassis, slot) for chassis in (1, 2)
+               for slot in range(1, 5)]
+    waves = plan_waves(servers, "4", 2, ["A"])
+    assert [slots(wave) for wave in waves] == [
+        ["chassis-1/blade-1", "chassis-2/blade-1",
+         "chassis-1/blade-2", "chassis-2/blade-2"],
+        ["chassis-1/blade-3", "chassis-2/blade-3",
+         "chassis-1/blade-4", "chassis-2/blade-4"]]
+
+
+def test_chassis_limit_shorter_than_wave_size():
+    servers = [blade(1, slot) for slot in range(1, 6)]
+    waves = plan_waves(servers, "4", 2, ["A"])
+    assert [len(wave) for wave in waves] == [2, 2, 1]
+
+
+def test_fabrics_in_order_then_the_rest():
+    servers = [blade(1, 1, "A"), blade(1, 2, "B"), blade(1, 3, None),
+               blade(1, 4, "B"), blade(1, 5, "A")]
+    waves = plan_waves(servers, "10", 0, ["B", "A"])
+    assert [[server['fabric'] for server in wave] for wave in waves] == [
+        ["B", "B"], ["A", "A"], [None]]
+
+
+def test_no_fabric_order_mixes_the_fabrics():
+    servers = [blade(1, 1, "A"), blade(1, 2, "B")]
+    assert len(plan_waves(servers, "2", 0, [])) == 1
+
+
+def test_rack_units_have_no_chassis_limit():
+    servers = [dict(profile="org-root/ls-r{0}".format(index),
+                    server="sys/rack-unit-{0}".format(index), chassis=None,
+                    fabric="A") for index in range(1, 5)]
+    assert [len(wave) for wave in plan_waves(servers, "4", 1, ["A"])] == [4]
+
+
+def test_unchanged_task_does_not_roll_out(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ucs_rolling, "roll_out", lambda *args: calls.append(
+        args) or dict(changed=True, bound=1, waves=[]))
+    params = dict(rolling=True, resume_rolling=False)
+
+    result = ucs_rolling.add_roll_out(None, params, dict(changed=False),
+                                      "dn", "lan")
+    assert result == dict(changed=False) and calls == []
+
+    result = ucs_rolling.add_roll_out(None, params, dict(changed=True),
+                                      "dn", "lan")
+    assert result['rolling']['bound'] == 1 and len(calls) == 1
+
+    result = ucs_rolling.add_roll_out(None, dict(params, resume_rolling=True),
+                                      dict(changed=False), "dn", "lan")
+    assert result['changed'] and len(calls) == 2
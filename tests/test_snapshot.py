@@ -0,0 +1,72 @@
+"""Full, incremental and unchanged ucs_snapshot runs against the stand-in."""
+
+import json
+import os
+
+from test_modules import POLICY_DN, VNICS, lan_conn
+from ucs_lan_conn import vcon_absent, vcon_present
+from ucs_snapshot import snapshot
+
+
+def take(params, handle, tmp_path, **options):
+    task = dict(params, dest=str(tmp_path / "snapshots"), incremental=True,
+                classes=["vnicLanConnPolicy", "vnicEther"])
+    task.update(options)
+    return snapshot(handle, task)
+
+
+def written(result, class_id):
+    with open(os.path.join(result['snapshot_dir'],
+                           class_id + ".jsonl")) as class_file:
+        return dict((entry['dn'], entry['attrs']) for entry in
+                    (json.loads(line) for line in class_file))
+
+
+def test_full_then_unchanged_then_incremental(params, handle, tmp_path):
+    vcon_present(handle, lan_conn(params))
+    result = take(params, handle, tmp_path)
+    assert result['refresh'] == "full" and result['changed']
+    assert result['counts'] == dict(vnicLanConnPolicy=1, vnicEther=2)
+
+    result = take(params, handle, tmp_path)
+    assert result['refresh'] == "unchanged" and not result['changed']
+    assert result['counts'] == dict(vnicLanConnPolicy=1, vnicEther=2)
+
+    vnics = [dict(VNICS[0], templ="exchange-c"),
+             dict(name="eth2", order=3, templ="exchange-b",
+                  policy="Windows")]
+    vcon_present(handle, lan_conn(params, vnics=vnics))
+    result = take(params, handle, tmp_path)
+    assert result['refresh'] == "incremental" and result['reread'] >= 1
+    assert result['counts'] == dict(vnicLanConnPolicy=1, vnicEther=2)
+    ethers = written(result, "vnicEther")
+    assert sorted(ethers) == [POLICY_DN + "/ether-eth0",
+                              POLICY_DN + "/ether-eth2"]
+    assert ethers[POLICY_DN + "/ether-eth0"]['nwTemplName'] == "exchange-c"
+
+    vcon_absent(handle, lan_conn(params))
+    result = take(params, handle, tmp_path)
+    assert result['refresh'] == "incremental"
+    assert result['counts'] == dict(vnicLanConnPolicy=0, vnicEther=0)
+
+
+def test_full_when_the_audit_log_rolled_over(server, params, handle,
+                                             tmp_path):
+    vcon_present(handle, lan_conn(params, lan_con_name="other"))
+    assert take(params, handle, tmp_path)['refresh'] == "full"
+    server.ucsm.audit_size = 1
+    vcon_present(handle, lan_conn(params))
+    result = take(params, handle, tmp_path)
+    assert result['refresh'] == "full"
+    assert result['counts'] == dict(vnicLanConnPolicy=2, vnicEther=4)
+
+
+def test_full_when_the_classes_change_or_not_incremental(params, handle,
+                                                         tmp_path):
+    take(params, handle, tmp_path)
+    assert take(params, handle, tmp_path,
+                classes=["vnicEther"])['refresh'] == "full"
+    assert take(params, handle, tmp_path, classes=["vnicEther"],
+                incremental=False)['refresh'] == "full"
+    assert take(params, handle, tmp_path,
+                classes=["vnicEther"])['refresh'] == "unchanged"
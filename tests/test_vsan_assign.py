@@ -0,0 +1,40 @@
+"""Port notation of ucs_vsan_assign."""
+
+import pytest
+
+from ucs_vsan_assign import expand_ports, port_names
+
+
+def test_single_ports_and_ranges():
+    assert expand_ports(["1/16", "2/1-3", " 1/2 "]) == [
+        (1, 2), (1, 16), (2, 1), (2, 2), (2, 3)]
+
+
+def test_duplicates_collapse():
+    assert expand_ports(["1/1-4", "1/3", "1/4-5"]) == [
+        (1, 1), (1, 2), (1, 3), (1, 4), (1, 5)]
+
+
+def test_one_port_range():
+    assert expand_ports(["1/7-7"]) == [(1, 7)]
+
+
+def test_nothing():
+    assert expand_ports(None) == [] and expand_ports([]) == []
+
+
+def test_backwards_range():
+    with pytest.raises(ValueError, match="runs backwards"):
+        expand_ports(["1/16-1"])
+
+
+@pytest.mark.parametrize("port", ["1", "1/", "a/1", "1/1-", "1/1-b",
+                                  "1/2/3", "1-2/3", ""])
+def test_bad_notation(port):
+    with pytest.raises(ValueError, match="notation"):
+        expand_ports([port])
+
+
+def test_port_names():
+    assert port_names(set([(2, 1), (1, 10), (1, 2)])) == [
+        "1/2", "1/10", "2/1"]